@@ -0,0 +1,94 @@
+"""Many clients bidding on one hot auction: accepted bids per second and lost updates.
+
+Compares the atomic /bid operation with the read-modify-write the auction
+service used before it (a lease /read followed by a /write of the whole
+auction). A lost update is a bid a client was told succeeded whose amount
+is above the auction's final highest bid.
+
+Usage: python benchmarks/bid_contention.py [--clients 32] [--duration 10]
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from local_cluster import DEFAULT_APP_DIR, start_node, stop_node
+
+URL = "http://127.0.0.1:5001"
+AUCTION = {
+    "title": "hot",
+    "description": "contended auction",
+    "starting_bid": 1.0,
+    "highest_bid": 1.0,
+    "highest_bidder": None,
+}
+
+
+def bid_atomic(client, bidder, seen):
+    amount = seen + random.randint(1, 10)
+    response = client.post(f"{URL}/bid", json={"auction_id": "hot", "bidder": bidder, "amount": amount})
+    auction = response.json().get("auction") or {}
+    return response.status_code == 200, amount, auction.get("highest_bid", seen)
+
+
+def bid_read_modify_write(client, bidder, seen):
+    auction = client.get(f"{URL}/read/bids/hot", params={"consistency": "lease"}).json()["value"]
+    amount = auction["highest_bid"] + random.randint(1, 10)
+    auction.update(highest_bid=amount, highest_bidder=bidder)
+    response = client.post(f"{URL}/write", json={"key": "hot", "value": auction, "db_type": "bids"})
+    return response.status_code == 200, amount, amount
+
+
+def run(mode, clients, duration):
+    bid = bid_atomic if mode == "atomic" else bid_read_modify_write
+    accepted = []
+    attempts = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(n):
+        session = requests.Session()
+        seen = 1.0
+        while time.time() < deadline:
+            ok, amount, seen = bid(session, f"bidder-{n}", seen)
+            with lock:
+                attempts[0] += 1
+                if ok:
+                    accepted.append(amount)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    final = requests.get(f"{URL}/read/bids/hot", params={"consistency": "lease"}).json()["value"]["highest_bid"]
+    lost = sum(1 for amount in accepted if amount > final)
+    print(f"{mode:>18}: {attempts[0]:>6} attempts  {len(accepted) / duration:>8.1f} accepted bids/s  "
+          f"{lost:>5} lost updates  final highest bid {final:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    for mode in ("atomic", "read-modify-write"):
+        with tempfile.TemporaryDirectory() as workdir:
+            node = start_node(workdir, args.app_dir)
+            try:
+                auction = dict(AUCTION, created_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                requests.post(f"{URL}/write", json={"key": "hot", "value": auction, "db_type": "bids"})
+                run(mode, args.clients, args.duration)
+            finally:
+                stop_node(node)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Print the critical path of the slowest traced requests.
+
+Reads the spans kept by the auction service and database nodes, from
+their /traces endpoints or from TRACE_FILE files, joins each trace's
+spans across services and, for the --slowest traces with the longest
+root span, prints the chain of spans the request waited on: starting
+from the root, the child that finished last, then the one that finished
+last before that child started, and so on, each followed down in turn.
+A span that waited on background work, such as a quorum wait on
+replication, names it in its waits_on attribute and is followed into the
+background spans of that name that finished while it waited.
+Every span on the path shows its total time and its self time, the part
+not spent in a child on the path. A summary then adds up the self time
+per span name over those traces.
+
+Spans from different hosts are placed by their wall-clock start, so
+clock skew between hosts can shift a child slightly outside its parent.
+
+Usage: python benchmarks/critical_path.py http://127.0.0.1:5000 http://127.0.0.1:5101 traces.jsonl [--slowest 5]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+import requests
+
+
+def load_spans(sources):
+    spans = {}
+    for source in sources:
+        if source.startswith(("http://", "https://")):
+            records = requests.get(f"{source.rstrip('/')}/traces", timeout=10).json()["spans"]
+        else:
+            with open(source, 'r') as file:
+                records = []
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Processes sharing a file can interleave long lines.
+                        continue
+        for record in records:
+            spans[record["span_id"]] = record
+    return spans
+
+
+def end(span):
+    return span["start"] + span["duration"]
+
+
+def critical_path(span, children, background, depth=0):
+    """(depth, span, self time) of each span on `span`'s critical path, in order."""
+    path = []
+    cursor = end(span)
+    waited = 0
+    candidates = children[span["span_id"]] + [
+        other for other in background[span["trace_id"]]
+        if other["name"] == span["attributes"].get("waits_on") and other["service"] == span["service"]
+        and span["start"] < end(other) <= end(span)]
+    for child in sorted(candidates, key=end, reverse=True):
+        # Children of another service may overhang through clock skew; those
+        # of the same service that end later ran alongside, not on the path.
+        if child["start"] >= cursor or (end(child) > cursor and child["service"] == span["service"]):
+            continue
+        # The child's own path, plus the stretch of this span it covered.
+        path = critical_path(child, children, background, depth + 1) + path
+        waited += min(end(child), cursor) - max(child["start"], span["start"])
+        cursor = child["start"]
+        if cursor <= span["start"]:
+            break
+    return [(depth, span, max(span["duration"] - waited, 0))] + path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="service URLs to read /traces from, or TRACE_FILE files")
+    parser.add_argument("--slowest", type=int, default=5)
+    parser.add_argument("--name", help="only requests whose root span name contains this, such as /bid")
+    args = parser.parse_args()
+
+    spans = load_spans(args.sources)
+    children = defaultdict(list)
+    roots = []
+    for span in spans.values():
+        if span["parent_id"] in spans:
+            children[span["parent_id"]].append(span)
+        else:
+            roots.append(span)
+    # Spans still running after their parent finished, such as replication
+    # started by a request's write and waited on by its quorum wait.
+    background = defaultdict(list)
+    for span in spans.values():
+        parent = spans.get(span["parent_id"])
+        if parent is not None and parent["service"] == span["service"] and end(span) > end(parent):
+            background[span["trace_id"]].append(span)
+    # A trace can have several roots if the process that started it did not keep it.
+    slowest = {}
+    for root in roots:
+        if args.name and args.name not in root["name"]:
+            continue
+        if root["trace_id"] not in slowest or root["duration"] > slowest[root["trace_id"]]["duration"]:
+            slowest[root["trace_id"]] = root
+    slowest = sorted(slowest.values(), key=lambda root: root["duration"], reverse=True)[:args.slowest]
+    if not slowest:
+        print("No traces found")
+        return
+
+    totals = defaultdict(float)
+    for root in slowest:
+        print(f"trace {root['trace_id']}: {root['name']} on {root['service']}, {root['duration'] * 1000:.1f} ms")
+        for depth, span, self_time in critical_path(root, children, background):
+            totals[span["name"]] += self_time
+            attributes = " ".join(f"{key}={value}" for key, value in span["attributes"].items())
+            print(f"  {span['duration'] * 1000:9.2f} ms {self_time * 1000:9.2f} ms self  {'  ' * depth}"
+                  f"{span['name']} [{span['service']}] {attributes}")
+        print()
+    print(f"Self time on the critical path of the {len(slowest)} slowest requests:")
+    overall = sum(totals.values()) or 1
+    for name, total in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {total * 1000:9.2f} ms {100 * total / overall:5.1f}%  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure Database write/read latency as the number of stored records grows.
+
+Usage: python benchmarks/database_latency.py [--sizes 1000,10000,100000,1000000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("MY_POD_NAME", "bench-0")
+os.environ.setdefault("PEERS", "bench-0")
+for module_dir in ("database", "common"):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_images", module_dir))
+
+import logging
+logging.disable(logging.INFO)
+
+from database import Database, DB_TYPES
+from storage import JsonStore
+
+
+def auction(i):
+    return {
+        "title": f"auction-{i}",
+        "description": "benchmark auction",
+        "starting_bid": 10.0,
+        "highest_bid": 10.0,
+        "highest_bidder": None,
+        "created_time": "2024-01-01 00:00:00",
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run(size, operations):
+    with tempfile.TemporaryDirectory() as workdir:
+        bid_file = os.path.join(workdir, "bids.json")
+        with open(bid_file, "w") as file:
+            json.dump({f"auction-{i}": auction(i) for i in range(size)}, file)
+
+        load_start = time.perf_counter()
+        database = Database(["bench-0"], JsonStore(workdir, DB_TYPES), os.path.join(workdir, "database.wal"))
+        load_time = time.perf_counter() - load_start
+
+        writes = []
+        for i in range(operations):
+            key = f"auction-{random.randrange(size)}"
+            start = time.perf_counter()
+            database.write_record(key, auction(i), None, "bids")
+            writes.append(time.perf_counter() - start)
+
+        reads = []
+        for _ in range(operations):
+            key = f"auction-{random.randrange(size)}"
+            start = time.perf_counter()
+            database.read_record(key, "bids")
+            reads.append(time.perf_counter() - start)
+        database.wal.close()
+
+    return load_time, writes, reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--operations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'records':>10} {'load s':>8} {'write p50 us':>13} {'write p99 us':>13} "
+          f"{'read p50 us':>12} {'read p99 us':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        load_time, writes, reads = run(size, args.operations)
+        print(f"{size:>10} {load_time:>8.2f} {percentile(writes, 50) * 1e6:>13.1f} "
+              f"{percentile(writes, 99) * 1e6:>13.1f} {percentile(reads, 50) * 1e6:>12.2f} "
+              f"{percentile(reads, 99) * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Failover time of a local three-node cluster when the leader is killed.
+
+Starts three database nodes, keeps a client writing through a follower,
+then repeatedly kills the leader with SIGKILL and measures how long the
+survivors take to agree on a new leader and until writes succeed again.
+The killed node is restarted and rejoins as a follower before the next
+round. Finally checks that every acknowledged write survived.
+
+Usage: python benchmarks/failover.py [--rounds 5] [--script app.py]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from local_cluster import DEFAULT_APP_DIR, percentile, start_cluster, start_node, stop_node, wait_for_leader
+
+
+def writer(urls, stop, acknowledged, last_success):
+    session = requests.Session()
+    i = 0
+    while not stop.is_set():
+        url = urls()[i % 2]
+        key = f"key-{i}"
+        try:
+            response = session.post(f"{url}/write", json={"key": key, "value": {"n": i}, "db_type": "bids"},
+                                    timeout=2)
+            if response.status_code == 200:
+                acknowledged.append(key)
+                last_success[0] = time.monotonic()
+        except requests.exceptions.RequestException:
+            pass
+        i += 1
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        nodes = start_cluster(workdir, 3, args.app_dir, script=args.script)
+        names = list(nodes)
+        leader = wait_for_leader([url for url, _ in nodes.values()])
+        stop = threading.Event()
+        acknowledged, last_success = [], [time.monotonic()]
+        followers = lambda: [url for name, (url, _) in nodes.items() if name != leader]
+        thread = threading.Thread(target=writer, args=(followers, stop, acknowledged, last_success))
+        thread.start()
+
+        agreed, elections, unavailable = [], [], []
+        try:
+            for n in range(args.rounds):
+                time.sleep(2)
+                url, process = nodes[leader]
+                survivors = [other for name, (other, _) in nodes.items() if name != leader]
+                killed_at = time.monotonic()
+                process.kill()
+                process.wait()
+                new_leader = wait_for_leader(survivors, exclude=leader)
+                agreed.append(time.monotonic() - killed_at)
+                elections.append(requests.get(f"http://{new_leader}/election").json()["last_election_seconds"])
+                while last_success[0] < killed_at:
+                    time.sleep(0.005)
+                unavailable.append(last_success[0] - killed_at)
+                print(f"round {n + 1}: killed {leader}, {new_leader} elected; survivors agreed after "
+                      f"{agreed[-1]:.2f} s, election took {elections[-1] * 1000:.0f} ms, "
+                      f"writes resumed after {unavailable[-1]:.2f} s")
+
+                index = names.index(leader)
+                nodes[leader] = (url, start_node(os.path.join(workdir, f"node-{index}"), args.app_dir, leader, names,
+                                                 script=args.script, port=5101 + index, wait=False))
+                leader = new_leader
+                wait_for_leader([url for url, _ in nodes.values()])
+        finally:
+            stop.set()
+            thread.join()
+
+        time.sleep(1)
+        stored = requests.get(f"http://{leader}/data").json()["bids"]
+        lost = [key for key in acknowledged if key not in stored]
+        for _, process in nodes.values():
+            stop_node(process)
+
+    print(f"leader agreed after kill: median {percentile(agreed, 50):.2f} s, max {max(agreed):.2f} s")
+    print(f"election round: median {percentile(elections, 50) * 1000:.0f} ms, max {max(elections) * 1000:.0f} ms")
+    print(f"write unavailability: median {percentile(unavailable, 50):.2f} s, max {max(unavailable):.2f} s")
+    print(f"{len(acknowledged)} acknowledged writes, {len(lost)} lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Leader failure detection on a local three-node cluster: latency, false positives and heartbeat traffic.
+
+1. Counts the leader's heartbeat requests per second while the cluster is
+   idle, then while a client writes through a follower.
+2. Freezes the leader with SIGSTOP for a random pause of up to
+   --pause-max seconds, many times; an election during a pause is a
+   false positive, since the leader comes back.
+3. Kills the leader with SIGKILL and measures how long until a survivor
+   starts an election (detection) and until both agree on a new leader.
+
+Point --app-dir at another checkout to compare failure detectors.
+
+Usage: python benchmarks/failure_detection.py [--pauses 20] [--kills 5]
+"""
+import argparse
+import os
+import random
+import signal
+import tempfile
+import threading
+import time
+
+import requests
+
+from local_cluster import DEFAULT_APP_DIR, percentile, start_cluster, start_node, stop_node, wait_for_leader
+
+
+def heartbeats_sent(url):
+    return requests.get(f"{url}/http_stats").json()["call_types"].get("heartbeat", {}).get("requests", 0)
+
+
+def heartbeat_rate(url, seconds):
+    before = heartbeats_sent(url)
+    time.sleep(seconds)
+    return (heartbeats_sent(url) - before) / seconds
+
+
+def write_load(url, stop):
+    session = requests.Session()
+    i = 0
+    while not stop.is_set():
+        session.post(f"{url}/write", json={"key": f"key-{i % 100}", "value": {"n": i}, "db_type": "bids"})
+        i += 1
+        time.sleep(0.01)
+
+
+def term(url):
+    return requests.get(f"{url}/election", timeout=1).json()["term"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--measure", type=float, default=20, help="seconds to count heartbeats for")
+    parser.add_argument("--pauses", type=int, default=20)
+    parser.add_argument("--pause-max", type=float, default=0.5)
+    parser.add_argument("--kills", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        nodes = start_cluster(workdir, 3, args.app_dir)
+        names = list(nodes)
+        urls = [url for url, _ in nodes.values()]
+        try:
+            leader = wait_for_leader(urls)
+            time.sleep(5)
+            idle_rate = heartbeat_rate(f"http://{leader}", args.measure)
+            stop = threading.Event()
+            follower = next(url for name, (url, _) in nodes.items() if name != leader)
+            writer = threading.Thread(target=write_load, args=(follower, stop))
+            writer.start()
+            busy_rate = heartbeat_rate(f"http://{leader}", args.measure)
+            stop.set()
+            writer.join()
+            print(f"leader heartbeat requests: {idle_rate:.2f}/s idle, {busy_rate:.2f}/s under writes")
+
+            false_positives = 0
+            for _ in range(args.pauses):
+                leader = wait_for_leader(urls)
+                before = term(f"http://{leader}")
+                process = nodes[leader][1]
+                process.send_signal(signal.SIGSTOP)
+                time.sleep(random.uniform(0.1, args.pause_max))
+                process.send_signal(signal.SIGCONT)
+                time.sleep(3)
+                if max(term(url) for url in urls) != before:
+                    false_positives += 1
+            print(f"false positives: {false_positives} elections in {args.pauses} leader pauses "
+                  f"of up to {args.pause_max:.1f} s")
+
+            detected, agreed = [], []
+            for _ in range(args.kills):
+                leader = wait_for_leader(urls)
+                time.sleep(random.uniform(5, 8))
+                survivors = [url for name, (url, _) in nodes.items() if name != leader]
+                before = term(f"http://{leader}")
+                killed_at = time.monotonic()
+                nodes[leader][1].kill()
+                nodes[leader][1].wait()
+                while max(term(url) for url in survivors) == before:
+                    time.sleep(0.005)
+                detected.append(time.monotonic() - killed_at)
+                wait_for_leader(survivors, exclude=leader)
+                agreed.append(time.monotonic() - killed_at)
+                index = names.index(leader)
+                nodes[leader] = (nodes[leader][0], start_node(os.path.join(workdir, f"node-{index}"), args.app_dir,
+                                                              leader, names, port=5101 + index, wait=False))
+                wait_for_leader(urls)
+            print(f"detection after kill: median {percentile(detected, 50):.2f} s, max {max(detected):.2f} s")
+            print(f"new leader agreed:    median {percentile(agreed, 50):.2f} s, max {max(agreed):.2f} s")
+        finally:
+            for _, process in nodes.values():
+                process.send_signal(signal.SIGCONT)
+                stop_node(process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare write throughput of per-request commits against group commit.
+
+Each client thread issues single-record writes as fast as it can, the way
+concurrent /write requests hit the leader during a bid burst.
+
+Usage: python benchmarks/group_commit_throughput.py [--clients 32] [--writes 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("MY_POD_NAME", "bench-0")
+os.environ.setdefault("PEERS", "bench-0")
+for module_dir in ("database", "common"):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_images", module_dir))
+
+import logging
+logging.disable(logging.INFO)
+
+from database import Database, DB_TYPES, STORAGE_ENGINE
+from group_commit import GroupCommitter
+from storage import open_store
+
+
+def new_database(workdir):
+    database = Database(["bench-0"], open_store(STORAGE_ENGINE, workdir, DB_TYPES),
+                        os.path.join(workdir, "database.wal"))
+    flushes = [0]
+    append = database.wal.append
+
+    def counting_append(entries):
+        flushes[0] += 1
+        return append(entries)
+
+    database.wal.append = counting_append
+    return database, flushes
+
+
+def run_clients(clients, writes, write):
+    def client(n):
+        for i in range(writes):
+            write(f"auction-{n}-{i}", {"highest_bid": i})
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--writes", type=int, default=200, help="writes per client")
+    parser.add_argument("--window-ms", type=float, default=0.2)
+    args = parser.parse_args()
+    total = args.clients * args.writes
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database, flushes = new_database(workdir)
+        elapsed = run_clients(args.clients, args.writes,
+                              lambda key, value: database.write_record(key, value, None, "bids"))
+        print(f"per-request:  {total / elapsed:>9.0f} writes/s  {flushes[0]:>6} log flushes")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database, flushes = new_database(workdir)
+        committer = GroupCommitter(lambda records: [database.write_batch(records, None)] * len(records),
+                                   window=args.window_ms / 1000)
+        elapsed = run_clients(args.clients, args.writes, lambda key, value: committer.submit(
+            {"key": key, "value": value, "db_type": "bids"}).result())
+        print(f"group commit: {total / elapsed:>9.0f} writes/s  {flushes[0]:>6} log flushes")
+
+
+if __name__ == "__main__":
+    main()
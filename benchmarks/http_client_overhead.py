@@ -0,0 +1,58 @@
+"""Per-request overhead of bare requests calls versus the shared pooled HttpClient.
+
+Starts a local database node and sends sequential small requests to it by
+host name, so each bare call pays for name resolution and a new TCP
+connection the way the services' calls between pods used to.
+
+Usage: python benchmarks/http_client_overhead.py [--requests 2000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+from local_cluster import DOCKER_IMAGES, percentile, start_node, stop_node
+
+sys.path.insert(0, os.path.join(DOCKER_IMAGES, "common"))
+from http_client import CallPolicy, HttpClient
+
+URL = "http://localhost:5001/liveness"
+
+
+def measure(call, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call().raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    print(f"{name:>12}: mean {sum(latencies) / len(latencies) * 1e6:>7.0f} us  "
+          f"p50 {percentile(latencies, 50) * 1e6:>7.0f} us  p99 {percentile(latencies, 99) * 1e6:>7.0f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        node = start_node(workdir)
+        try:
+            report("bare", measure(lambda: requests.get(URL, timeout=5), args.requests))
+            client = HttpClient({"probe": CallPolicy(timeout=(1, 5))})
+            report("pooled", measure(lambda: client.get(URL, "probe"), args.requests))
+            for origin, counters in client.stats()["peers"].items():
+                print(f"pooled connections to {origin}: {counters['connections_opened']} opened, "
+                      f"{counters['connections_reused']} reused")
+        finally:
+            stop_node(node)
+
+
+if __name__ == "__main__":
+    main()
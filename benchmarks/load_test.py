@@ -0,0 +1,221 @@
+"""Replay auction-site traffic against a local cluster and report throughput, latency and failover time as JSON.
+
+Starts --shards shards of --replicas database nodes and the auction
+service on loopback ports (see local_cluster.py), then, through the
+auction service:
+
+1. registers --users users and logs each of them in,
+2. creates --auctions auctions; the first --hot of them are hot,
+3. runs --clients logged-in users for --duration seconds, each sending
+   a mix (--mix) of listing pages, auction page views and bids, where
+   --hot-share of the views and bids go to the hot auctions,
+4. --kill-at seconds in, kills shard 0's leader with SIGKILL, while a
+   probe bids on a shard 0 auction every 10 ms.
+
+The report has each request type's count, errors, throughput and
+p50/p99/p999 latency in ms, and for the leader kill how long the
+survivors took to agree on a new leader and bids took to succeed again.
+Bids outbid by a concurrent one count as rejected, not as errors.
+
+Usage: python benchmarks/load_test.py [--shards 1] [--clients 32] [--duration 30] [--output report.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from local_cluster import (DOCKER_IMAGES, DEFAULT_APP_DIR, cluster_shards, percentile, start_auction_service,
+                           start_cluster, stop_node, wait_for_leader)
+
+sys.path.insert(0, os.path.join(DOCKER_IMAGES, "common"))
+from shard_router import shard_for
+
+
+class Recorder:
+    """Latencies and outcomes of each request type."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.outcomes = {}
+
+    def record(self, name, outcome, latency):
+        with self.lock:
+            if outcome != "error":
+                self.latencies.setdefault(name, []).append(latency)
+            counts = self.outcomes.setdefault(name, {"ok": 0, "rejected": 0, "error": 0})
+            counts[outcome] += 1
+
+    def report(self, duration):
+        report = {}
+        for name, counts in self.outcomes.items():
+            latencies = self.latencies.get(name) or [0]
+            report[name] = dict(counts, throughput=round((counts["ok"] + counts["rejected"]) / duration, 1),
+                                **{f"p{label}_ms": round(percentile(latencies, p) * 1000, 2)
+                                   for label, p in (("50", 50), ("99", 99), ("999", 99.9))})
+        return report
+
+
+def timed(recorder, name, request, ok=(200,), rejected=()):
+    """Send a request and record how it went; returns the response, or None if it failed."""
+    start = time.perf_counter()
+    try:
+        response = request()
+    except requests.exceptions.RequestException:
+        recorder.record(name, "error", time.perf_counter() - start)
+        return None
+    outcome = "ok" if response.status_code in ok else "rejected" if response.status_code in rejected else "error"
+    recorder.record(name, outcome, time.perf_counter() - start)
+    return response
+
+
+def run_phase(recorder, name, calls, clients):
+    """Run `calls` on `clients` threads; returns the phase's report."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(lambda call: call(recorder), calls))
+    return recorder.report(time.perf_counter() - start)[name]
+
+
+def client_loop(url, session, auctions, hot, args, amounts, recorder, deadline):
+    operations, weights = zip(*args.mix.items())
+    while time.time() < deadline:
+        operation = random.choices(operations, weights)[0]
+        if operation == "list":
+            timed(recorder, "list", lambda: session.get(f"{url}/"))
+            continue
+        auction_id = random.choice(hot if random.random() < args.hot_share else auctions)
+        if operation == "view":
+            timed(recorder, "view", lambda: session.get(f"{url}/auction/{auction_id}", allow_redirects=False),
+                  ok=(200, 302))
+        else:
+            amount = next(amounts)
+            timed(recorder, "bid", lambda: session.post(f"{url}/bid/{auction_id}", data={"bid_amount": amount},
+                                                        allow_redirects=False), ok=(302,), rejected=(400,))
+
+
+def kill_leader(nodes, shard_nodes, url, session, auction_id, amounts, failover):
+    """Kill the shard's leader and time the election and the first bid accepted after it."""
+    urls = [f"http://{name}" for name in shard_nodes]
+    leader = wait_for_leader(urls)
+    killed_at = time.monotonic()
+    nodes[leader][1].kill()
+    nodes[leader][1].wait()
+    survivors = [other for other in urls if other != f"http://{leader}"]
+    elected = threading.Thread(target=lambda: failover.update(
+        new_leader=wait_for_leader(survivors, exclude=leader), leader_agreed_s=round(time.monotonic() - killed_at, 3)))
+    elected.start()
+    failed = 0
+    while time.monotonic() - killed_at < 60:
+        try:
+            response = session.post(f"{url}/bid/{auction_id}", data={"bid_amount": next(amounts)},
+                                    allow_redirects=False, timeout=5)
+            # Outbid counts too: the new leader decided the bid.
+            if response.status_code in (302, 400):
+                break
+        except requests.exceptions.RequestException:
+            pass
+        failed += 1
+        time.sleep(0.01)
+    failover.update(killed=leader, bids_resumed_s=round(time.monotonic() - killed_at, 3), failed_probe_bids=failed)
+    elected.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--auction-port", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--auctions", type=int, default=100)
+    parser.add_argument("--hot", type=int, default=3)
+    parser.add_argument("--hot-share", type=float, default=0.8)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", default="list=20,view=30,bid=50",
+                        help="relative weights of listing pages, auction views and bids")
+    parser.add_argument("--kill-at", type=float, default=None,
+                        help="seconds into the run to kill shard 0's leader (default: halfway; negative: never)")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+    args.mix = {name: float(weight) for name, weight in (part.split("=") for part in args.mix.split(","))}
+    kill_at = args.duration / 2 if args.kill_at is None else args.kill_at
+
+    recorder = Recorder()
+    amounts = itertools.count(10)
+    shards = cluster_shards(args.replicas, args.shards)
+    url = f"http://127.0.0.1:{args.auction_port}"
+    report = {"config": {key: value for key, value in vars(args).items() if key != "app_dir"}}
+    with tempfile.TemporaryDirectory() as workdir:
+        nodes = start_cluster(workdir, args.replicas, args.app_dir, script=args.script, shards=args.shards)
+        processes = [process for _, process in nodes.values()]
+        try:
+            processes.append(start_auction_service(shards, args.auction_port))
+            sessions = [requests.Session() for _ in range(args.users)]
+            credentials = [{"username": f"user-{i}", "password": f"password-{i}"} for i in range(args.users)]
+            report["register"] = run_phase(recorder, "register", [
+                lambda rec, session=session, user=user: timed(
+                    rec, "register", lambda: session.post(f"{url}/register", data=user, allow_redirects=False),
+                    ok=(302,))
+                for session, user in zip(sessions, credentials)], args.clients)
+            report["login"] = run_phase(recorder, "login", [
+                lambda rec, session=session, user=user: timed(
+                    rec, "login", lambda: session.post(f"{url}/login", data=user, allow_redirects=False), ok=(302,))
+                for session, user in zip(sessions, credentials)], args.clients)
+
+            auctions = []
+            def create(rec, session):
+                response = timed(rec, "create_auction", lambda: session.post(
+                    f"{url}/create_auction", data={"title": "auction", "description": "load test", "starting_bid": 1},
+                    allow_redirects=False), ok=(302,))
+                if response is not None and response.status_code == 302:
+                    auctions.append(response.headers["Location"].rsplit("/", 1)[1])
+            report["create_auction"] = run_phase(recorder, "create_auction", [
+                lambda rec, session=sessions[i % args.users]: create(rec, session) for i in range(args.auctions)],
+                args.clients)
+            hot = auctions[:args.hot]
+
+            # The mixed run gets a recorder of its own, so its throughput covers its requests only.
+            recorder = Recorder()
+            failover = {}
+            deadline = time.time() + args.duration
+            clients = [threading.Thread(target=client_loop, args=(url, sessions[i % args.users], auctions, hot, args,
+                                                                  amounts, recorder, deadline))
+                       for i in range(args.clients)]
+            for thread in clients:
+                thread.start()
+            if 0 <= kill_at < args.duration:
+                time.sleep(kill_at)
+                probe = next(auction_id for auction_id in auctions if shard_for(auction_id, args.shards) == 0)
+                kill_leader(nodes, shards[0], url, sessions[0], probe, amounts, failover)
+            for thread in clients:
+                thread.join()
+            report["mixed"] = recorder.report(args.duration)
+            report["mixed"]["all"] = {"throughput": round(sum(
+                counts["ok"] + counts["rejected"] for counts in recorder.outcomes.values()) / args.duration, 1),
+                "errors": sum(counts["error"] for counts in recorder.outcomes.values())}
+            report["failover"] = failover or None
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    stop_node(process)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
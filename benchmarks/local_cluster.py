@@ -0,0 +1,153 @@
+"""Helpers for running database nodes and the auction service as local processes in benchmarks.
+
+Run directly to start a whole cluster on loopback ports and keep it up until interrupted:
+
+    python benchmarks/local_cluster.py [--shards 1] [--replicas 3] [--script app.py] [--auction-port 5000]
+"""
+import argparse
+import os
+import tempfile
+import subprocess
+import sys
+import time
+
+import requests
+
+DOCKER_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_images")
+DEFAULT_APP_DIR = os.path.join(DOCKER_IMAGES, "database")
+AUCTION_APP_DIR = os.path.join(DOCKER_IMAGES, "auction")
+
+
+def wait_until_live(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(f"{url}/liveness", timeout=1)
+            return True
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def wait_for_leader(urls, timeout=30, exclude=None):
+    """Wait until every node in `urls` follows the same leader, other than `exclude`; return its node ID."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            leaders = {requests.get(f"{url}/election", timeout=1).json()["leader_id"] for url in urls}
+            if len(leaders) == 1 and not leaders & {None, exclude}:
+                return leaders.pop()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("no leader was elected")
+
+
+def _env(app_dir, env):
+    # The shared modules live next to the app directory, as in the images.
+    common_dir = os.path.join(os.path.dirname(app_dir), "common")
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [common_dir, os.environ.get("PYTHONPATH")])),
+                **env)
+
+
+def start_node(workdir, app_dir=DEFAULT_APP_DIR, name="bench-0", peers=None, env=None, script="app.py",
+               port=5001, wait=True, shards=None):
+    """Start one database node on `port` with its data files in `workdir`.
+
+    `script` picks the server: app.py (Flask) or async_app.py (asyncio).
+    Peers are named by their host:port; `shards` lists every shard's
+    replicas in a sharded cluster, in place of `peers`. With `wait`,
+    returns once the node is live and a leader has been elected.
+    """
+    app_dir = os.path.abspath(app_dir)
+    peers = ";".join(",".join(shard) for shard in shards or [peers or [name]])
+    node_env = _env(app_dir, dict(MY_POD_NAME=name, PEERS=peers, PORT=str(port), PEER_URL_TEMPLATE="http://{peer}",
+                                  **(env or {})))
+    node = subprocess.Popen([sys.executable, os.path.join(app_dir, script)], cwd=workdir,
+                            env=node_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    if not wait_until_live(url):
+        node.kill()
+        raise RuntimeError("database node did not start")
+    if wait:
+        wait_for_leader([url])
+    return node
+
+
+def cluster_shards(size=3, shards=1, base_port=5101):
+    """Node IDs of each shard's `size` replicas, on consecutive ports."""
+    return [[f"127.0.0.1:{base_port + shard * size + i}" for i in range(size)] for shard in range(shards)]
+
+
+def start_cluster(workdir, size=3, app_dir=DEFAULT_APP_DIR, env=None, script="app.py", base_port=5101, shards=1):
+    """Start `shards` shards of `size` nodes on consecutive ports, each node in its own subdirectory of `workdir`.
+
+    Returns {node ID: (url, process)} once each shard agrees on a leader.
+    """
+    groups = cluster_shards(size, shards, base_port)
+    nodes = {}
+    for i, name in enumerate(name for group in groups for name in group):
+        node_dir = os.path.join(workdir, f"node-{i}")
+        os.makedirs(node_dir, exist_ok=True)
+        nodes[name] = (f"http://{name}", start_node(node_dir, app_dir, name, env=env, script=script,
+                                                    port=base_port + i, wait=False, shards=groups))
+    for group in groups:
+        wait_for_leader([f"http://{name}" for name in group])
+    return nodes
+
+
+def start_auction_service(shards, port=5000, app_dir=AUCTION_APP_DIR, env=None):
+    """Start the auction service on `port`, using the database nodes of `shards` (see cluster_shards)."""
+    app_dir = os.path.abspath(app_dir)
+    service_env = _env(app_dir, dict(PORT=str(port), DATABASE_SHARDS=";".join(",".join(shard) for shard in shards),
+                                     DATABASE_NODE_URL="http://{node}", **(env or {})))
+    service = subprocess.Popen([sys.executable, os.path.join(app_dir, "app.py")], cwd=app_dir,
+                               env=service_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_until_live(f"http://127.0.0.1:{port}"):
+        service.kill()
+        raise RuntimeError("auction service did not start")
+    return service
+
+
+def stop_node(node):
+    node.terminate()
+    node.wait()
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local cluster until interrupted.")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--base-port", type=int, default=5101)
+    parser.add_argument("--auction-port", type=int, default=5000)
+    parser.add_argument("--workdir", help="keep the nodes' data here instead of a temporary directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = args.workdir or workdir
+        nodes = start_cluster(workdir, args.replicas, script=args.script, base_port=args.base_port,
+                              shards=args.shards)
+        processes = [process for _, process in nodes.values()]
+        try:
+            processes.append(start_auction_service(cluster_shards(args.replicas, args.shards, args.base_port),
+                                                   args.auction_port))
+            for shard, group in enumerate(cluster_shards(args.replicas, args.shards, args.base_port)):
+                print(f"shard {shard}: {', '.join(f'http://{name}' for name in group)}")
+            print(f"auction service: http://127.0.0.1:{args.auction_port}, data in {workdir}")
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                stop_node(process)
+
+
+if __name__ == "__main__":
+    main()
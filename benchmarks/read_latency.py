@@ -0,0 +1,76 @@
+"""Measure database read latency under a concurrent read/write load.
+
+Starts a single database node from --app-dir on port 5001 in a scratch
+directory, runs reader and writer threads against it over HTTP, and prints
+read latency percentiles. Point --app-dir at another checkout to compare
+revisions, e.g. one created with `git worktree add`.
+
+Usage: python benchmarks/read_latency.py [--readers 8] [--writers 4] [--duration 20]
+"""
+import argparse
+import tempfile
+import threading
+import time
+
+import requests
+
+from local_cluster import DEFAULT_APP_DIR, percentile, start_node, stop_node
+
+URL = "http://127.0.0.1:5001"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        node = start_node(workdir, args.app_dir)
+        try:
+            session = requests.Session()
+            for i in range(args.keys):
+                session.post(f"{URL}/write", json={"key": f"auction-{i}", "value": {"highest_bid": 0},
+                                                   "db_type": "bids"})
+
+            deadline = time.time() + args.duration
+            read_latencies = []
+            writes = [0]
+
+            def reader(n):
+                client = requests.Session()
+                i = n
+                while time.time() < deadline:
+                    start = time.perf_counter()
+                    client.get(f"{URL}/read/bids/auction-{i % args.keys}")
+                    read_latencies.append(time.perf_counter() - start)
+                    i += 1
+
+            def writer(n):
+                client = requests.Session()
+                i = n
+                while time.time() < deadline:
+                    client.post(f"{URL}/write", json={"key": f"auction-{i % args.keys}",
+                                                      "value": {"highest_bid": i}, "db_type": "bids"})
+                    writes[0] += 1
+                    i += 1
+
+            threads = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+            threads += [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            stop_node(node)
+
+    print(f"reads: {len(read_latencies)}  writes: {writes[0]}  over {args.duration:.0f}s")
+    print(f"read p50: {percentile(read_latencies, 50) * 1000:.1f} ms  "
+          f"p99: {percentile(read_latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Read throughput of one shard as replicas are added, with reads routed by advertised staleness.
+
+For each replica count starts a local cluster, writes --keys auctions
+through the leader, then keeps --clients connections reading random
+auctions through AsyncShardRouter, as the auction service does. "leader"
+sends every read to the leader; "replicas" spreads them over the
+replicas within --max-staleness of the leader. Reports reads per second,
+each node's share of the reads and the database processes' CPU time per
+read. The nodes share this machine's cores, so throughput can only grow
+with replicas up to the core count printed; on a single core it shows
+only how evenly reads spread and what routing them costs.
+
+Usage: python benchmarks/read_scaling.py [--replicas 1,3,5] [--clients 32] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import psutil
+
+from local_cluster import DOCKER_IMAGES, DEFAULT_APP_DIR, start_cluster, stop_node, wait_for_leader
+
+sys.path.insert(0, os.path.join(DOCKER_IMAGES, "common"))
+from async_http_client import AsyncHttpClient
+from http_client import CallPolicy
+from shard_router import AsyncShardRouter
+
+POLICIES = {
+    "read": CallPolicy(timeout=(1, 5), retries=1),
+    "write": CallPolicy(timeout=(1, 5), retries=1),
+    "discover": CallPolicy(timeout=(0.5, 1), retries=1),
+}
+
+
+async def reader(router, keys, leader, deadline, counts):
+    while time.time() < deadline:
+        key = random.randrange(keys)
+        try:
+            response = await router.get(0, f"/read/bids/auction-{key}", "read", leader=leader,
+                                        params={"max_staleness": router.max_staleness})
+            counts["ok" if response.status_code == 200 else "failed"] += 1
+        except Exception:
+            counts["failed"] += 1
+
+
+async def run(nodes, keys, clients, duration, leader, max_staleness):
+    client = AsyncHttpClient(POLICIES, pool_size=clients)
+    router = AsyncShardRouter([list(nodes)], client, lambda node: f"http://{node}", max_staleness=max_staleness)
+    try:
+        for start in range(0, keys, 500):
+            records = [{"key": f"auction-{i}", "value": {"title": f"auction {i}"}, "db_type": "bids"}
+                       for i in range(start, min(keys, start + 500))]
+            (await router.post(0, "/write_batch", "write", json={"records": records})).json()
+        # Let every follower catch up and the router learn their staleness.
+        await router.refresh(0)
+        await asyncio.sleep(2)
+        await router.refresh(0)
+        before = {origin: counters["requests"] for origin, counters in client.peers.items()}
+        processes = [psutil.Process(process.pid) for _, process in nodes.values()]
+        cpu_before = sum(sum(p.cpu_times()[:2]) for p in processes)
+        counts = {"ok": 0, "failed": 0}
+        deadline = time.time() + duration
+        await asyncio.gather(*(reader(router, keys, leader, deadline, counts) for _ in range(clients)))
+        cpu = sum(sum(p.cpu_times()[:2]) for p in processes) - cpu_before
+        served = {origin: counters["requests"] - before.get(origin, 0) for origin, counters in client.peers.items()}
+    finally:
+        await client.close()
+    return counts, served, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--replicas", default="1,3,5")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--max-staleness", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores")
+    for replicas in [int(n) for n in args.replicas.split(",")]:
+        for mode in ("leader", "replicas"):
+            with tempfile.TemporaryDirectory() as workdir:
+                nodes = start_cluster(workdir, replicas, args.app_dir, script=args.script)
+                try:
+                    leader_id = wait_for_leader([url for url, _ in nodes.values()])
+                    counts, served, cpu = asyncio.run(run(nodes, args.keys, args.clients, args.duration,
+                                                          mode == "leader", args.max_staleness))
+                finally:
+                    for _, process in nodes.values():
+                        stop_node(process)
+            total = max(1, sum(served.get(node, 0) for node in nodes))
+            shares = ", ".join(f"{'L' if node == leader_id else 'F'} {served.get(node, 0) / total:.0%}"
+                               for node in nodes)
+            print(f"{replicas} replica(s), {mode:>8}: {counts['ok'] / args.duration:7.0f} reads/s, "
+                  f"{cpu / max(1, counts['ok']) * 1000:.2f} ms CPU per read, per node {shares}, "
+                  f"{counts['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
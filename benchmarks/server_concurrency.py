@@ -0,0 +1,102 @@
+"""Throughput, latency and server threads for the Flask and asyncio database servers under many concurrent connections.
+
+Starts a single database node with app.py, then with async_app.py, and for
+each concurrency level opens that many keep-alive connections, each sending
+reads with a share of writes back to back. The server's peak thread count
+and memory are sampled while the load runs.
+
+Usage: python benchmarks/server_concurrency.py [--connections 100,1000,2000] [--duration 10]
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import threading
+import time
+
+import aiohttp
+import psutil
+
+from local_cluster import DEFAULT_APP_DIR, percentile, start_node, stop_node
+
+URL = "http://127.0.0.1:5001"
+SERVERS = {"flask": "app.py", "asyncio": "async_app.py"}
+
+
+async def client(session, keys, write_ratio, deadline, latencies, errors):
+    while time.time() < deadline:
+        key = f"auction-{random.randrange(keys)}"
+        start = time.perf_counter()
+        try:
+            if random.random() < write_ratio:
+                request = session.post(f"{URL}/write", json={"key": key, "value": {"highest_bid": start},
+                                                             "db_type": "bids"})
+            else:
+                request = session.get(f"{URL}/read/bids/{key}")
+            async with request as response:
+                await response.read()
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors[0] += 1
+            await asyncio.sleep(0.1)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def load(connections, keys, write_ratio, duration):
+    latencies, errors = [], [0]
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        for i in range(keys):
+            async with session.post(f"{URL}/write", json={"key": f"auction-{i}", "value": {"highest_bid": 0},
+                                                          "db_type": "bids"}) as response:
+                response.raise_for_status()
+        deadline = time.time() + duration
+        await asyncio.gather(*(client(session, keys, write_ratio, deadline, latencies, errors)
+                               for _ in range(connections)))
+    return latencies, errors[0]
+
+
+def sample_server(pid, stop, peak):
+    process = psutil.Process(pid)
+    while not stop.is_set():
+        peak["threads"] = max(peak["threads"], process.num_threads())
+        peak["rss"] = max(peak["rss"], process.memory_info().rss)
+        stop.wait(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--connections", default="100,1000,2000")
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{'server':>8} {'conns':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'threads':>8} {'rss MB':>7}")
+    for server, script in SERVERS.items():
+        for connections in (int(c) for c in args.connections.split(",")):
+            with tempfile.TemporaryDirectory() as workdir:
+                node = start_node(workdir, args.app_dir, script=script)
+                peak = {"threads": 0, "rss": 0}
+                stop = threading.Event()
+                sampler = threading.Thread(target=sample_server, args=(node.pid, stop, peak))
+                sampler.start()
+                try:
+                    latencies, errors = asyncio.run(load(connections, args.keys, args.write_ratio, args.duration))
+                finally:
+                    stop.set()
+                    sampler.join()
+                    stop_node(node)
+            p50 = percentile(latencies, 50) * 1000 if latencies else float("nan")
+            p99 = percentile(latencies, 99) * 1000 if latencies else float("nan")
+            print(f"{server:>8} {connections:>6} {len(latencies) / args.duration:>8.0f} {p50:>8.1f} {p99:>8.1f} "
+                  f"{errors:>7} {peak['threads']:>8} {peak['rss'] / 2 ** 20:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Write throughput of a local cluster as the keyspace is split across more shards.
+
+For each shard count starts that many three-node shards as local
+processes, then keeps --clients-per-shard connections per shard writing
+random keys, each sent straight to its shard's leader as the auction
+service's router does. Reports acknowledged writes per second, how evenly
+the keys spread, the speedup over one shard and the database processes'
+CPU time per write. The cluster shares this machine's cores, so the
+speedup is capped by the core count printed; on a single core it shows
+only what splitting the keyspace costs, not how throughput scales.
+
+Usage: python benchmarks/shard_throughput.py [--shards 1,2,4] [--clients-per-shard 16] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+import psutil
+
+from local_cluster import DOCKER_IMAGES, DEFAULT_APP_DIR, cluster_shards, start_cluster, stop_node, wait_for_leader
+
+sys.path.insert(0, os.path.join(DOCKER_IMAGES, "common"))
+from shard_router import shard_for
+
+
+async def client(session, leaders, deadline, counts, errors):
+    prefix = uuid.uuid4().hex[:8]
+    i = 0
+    while time.time() < deadline:
+        key = f"auction-{prefix}-{i}"
+        shard = shard_for(key, len(leaders))
+        i += 1
+        try:
+            async with session.post(f"http://{leaders[shard]}/write",
+                                    json={"key": key, "value": {"highest_bid": i}, "db_type": "bids"}) as response:
+                await response.read()
+                if response.status == 200:
+                    counts[shard] += 1
+                    continue
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        errors.append(key)
+
+
+async def load(leaders, clients, duration):
+    counts, errors = [0] * len(leaders), []
+    deadline = time.time() + duration
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10)) as session:
+        await asyncio.gather(*(client(session, leaders, deadline, counts, errors) for _ in range(clients)))
+    return counts, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=DEFAULT_APP_DIR)
+    parser.add_argument("--script", default="app.py")
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--clients-per-shard", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores")
+    baseline = None
+    for shards in [int(n) for n in args.shards.split(",")]:
+        with tempfile.TemporaryDirectory() as workdir:
+            nodes = start_cluster(workdir, 3, args.app_dir, script=args.script, shards=shards)
+            try:
+                leaders = [wait_for_leader([f"http://{name}" for name in group])
+                           for group in cluster_shards(3, shards)]
+                processes = [psutil.Process(process.pid) for _, process in nodes.values()]
+                cpu_before = sum(sum(p.cpu_times()[:2]) for p in processes)
+                counts, errors = asyncio.run(load(leaders, shards * args.clients_per_shard, args.duration))
+                cpu = sum(sum(p.cpu_times()[:2]) for p in processes) - cpu_before
+            finally:
+                for _, process in nodes.values():
+                    stop_node(process)
+        throughput = sum(counts) / args.duration
+        baseline = baseline or throughput
+        spread = ", ".join(f"{count / sum(counts):.0%}" for count in counts)
+        print(f"{shards} shard(s): {throughput:7.0f} writes/s ({throughput / baseline:.2f}x), "
+              f"{cpu / max(1, sum(counts)) * 1000:.2f} ms CPU per write, per shard {spread}, {len(errors)} failed")
+
+
+if __name__ == "__main__":
+    main()
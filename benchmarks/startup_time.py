@@ -0,0 +1,107 @@
+"""Database node restart time and peak memory as the dataset grows, per storage engine.
+
+For each record count, fills a Database with auctions on each engine,
+takes a snapshot (which compacts the log behind it), then logs
+--tail more writes, as a node would between snapshots. Each restart runs
+in a fresh process and reports the time until the node can serve reads,
+the time until its auction listing is ready (stored auctions are indexed
+in the background) and the process's peak memory. "sqlite, full log"
+restarts the SQLite engine without ever snapshotting, so the whole history
+is replayed as before compaction existed.
+
+Usage: python benchmarks/startup_time.py [--sizes 10000,100000,1000000] [--tail 10000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("MY_POD_NAME", "bench-0")
+os.environ.setdefault("PEERS", "bench-0")
+for module_dir in ("database", "common"):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_images", module_dir))
+
+import logging
+logging.disable(logging.INFO)
+
+from database import Database, DB_TYPES
+from storage import open_store
+
+CASES = (("json", True), ("sqlite", False), ("sqlite", True), ("snapshot", True))
+
+
+def auction(i, now):
+    return {
+        "title": f"auction-{i}",
+        "description": "benchmark auction",
+        "starting_bid": 10.0,
+        "highest_bid": 10.0 + i % 100,
+        "highest_bidder": f"user-{i * 7 % 1000}",
+        "creator": f"user-{i % 1000}",
+        "created_time": now,
+    }
+
+
+def open_database(engine, workdir):
+    return Database(["bench-0"], open_store(engine, workdir, DB_TYPES), os.path.join(workdir, "database.wal"))
+
+
+def fill(engine, workdir, size, tail, snapshot):
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    database = open_database(engine, workdir)
+    for start in range(0, size, 1000):
+        database.write_batch([{"db_type": "bids", "key": f"auction-{i}", "value": auction(i, now)}
+                              for i in range(start, min(size, start + 1000))], None)
+    if snapshot:
+        database.snapshot()
+    for start in range(0, tail, 100):
+        database.write_batch([{"db_type": "bids", "key": f"auction-{i * 7919 % size}", "value": auction(i, now)}
+                              for i in range(start, min(tail, start + 100))], None)
+    database.auctions_indexed.wait()
+    database.store.close()
+    database.wal.close()
+
+
+def restart(engine, workdir):
+    """Run in a fresh process: reopen the node and report timings and peak memory."""
+    start = time.perf_counter()
+    database = open_database(engine, workdir)
+    database.read_record("auction-0", "bids")
+    ready = time.perf_counter() - start
+    database.auctions_indexed.wait()
+    indexed = time.perf_counter() - start
+    replayed = database.wal.size
+    # VmHWM rather than ru_maxrss, which counts the parent's memory from before the exec.
+    with open("/proc/self/status") as status:
+        peak_kb = int(status.read().split("VmHWM:")[1].split()[0])
+    print(json.dumps({"ready": ready, "indexed": indexed, "log_bytes": replayed, "peak_rss_kb": peak_kb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--tail", type=int, default=10000)
+    parser.add_argument("--restart", nargs=2, metavar=("ENGINE", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.restart:
+        restart(*args.restart)
+        return
+
+    print(f"{'records':>9} {'engine':>17} {'log MB':>7} {'ready s':>8} {'listing s':>10} {'peak MB':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for engine, snapshot in CASES:
+            with tempfile.TemporaryDirectory() as workdir:
+                fill(engine, workdir, size, args.tail, snapshot)
+                output = subprocess.run([sys.executable, __file__, "--restart", engine, workdir],
+                                        check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            name = engine if snapshot else f"{engine}, full log"
+            print(f"{size:>9} {name:>17} {result['log_bytes'] / 1e6:>7.1f} {result['ready']:>8.2f} "
+                  f"{result['indexed']:>10.2f} {result['peak_rss_kb'] / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
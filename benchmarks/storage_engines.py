@@ -0,0 +1,129 @@
+"""Compare the database's storage engines: on-disk size, write latency, checkpoint, cold load and indexed queries.
+
+For each record count, fills a Database on each engine with auctions,
+snapshots it, then times single writes (log fsync plus the engine's
+update), loading the stored tables into a fresh engine, and looking up
+auctions by creator. "json-indented" is the previous pretty-printed JSON
+format, for size and load time only.
+
+Usage: python benchmarks/storage_engines.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("MY_POD_NAME", "bench-0")
+os.environ.setdefault("PEERS", "bench-0")
+for module_dir in ("database", "common"):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker_images", module_dir))
+
+import logging
+logging.disable(logging.INFO)
+
+from database import Database, DB_TYPES
+from storage import JsonStore, open_store
+
+CREATORS = 1000
+
+
+def auction(i):
+    return {
+        "title": f"auction-{i}",
+        "description": "benchmark auction",
+        "starting_bid": 10.0,
+        "highest_bid": 10.0 + i % 100,
+        "highest_bidder": f"user-{i * 7 % CREATORS}",
+        "creator": f"user-{i % CREATORS}",
+        "created_time": "2024-01-01 00:00:00",
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def store_size(workdir):
+    return sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)
+               if not name.startswith("database.wal"))
+
+
+def time_queries(store, operations):
+    latencies = []
+    for _ in range(operations):
+        creator = f"user-{random.randrange(CREATORS)}"
+        start = time.perf_counter()
+        store.find_auctions("creator", creator, 100)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_engine(engine, size, operations):
+    with tempfile.TemporaryDirectory() as workdir:
+        database = Database(["bench-0"], open_store(engine, workdir, DB_TYPES), os.path.join(workdir, "database.wal"))
+        for start in range(0, size, 1000):
+            database.write_batch([{"db_type": "bids", "key": f"auction-{i}", "value": auction(i)}
+                                  for i in range(start, min(size, start + 1000))], None)
+        writes = []
+        for i in range(operations):
+            start = time.perf_counter()
+            database.write_record(f"auction-{random.randrange(size)}", auction(i), None, "bids")
+            writes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        database.snapshot()
+        checkpoint = time.perf_counter() - start
+        database.store.close()
+        database.wal.close()
+        disk = store_size(workdir)
+
+        start = time.perf_counter()
+        store = open_store(engine, workdir, DB_TYPES)
+        store.load()
+        load = time.perf_counter() - start
+        queries = time_queries(store, operations)
+        store.close()
+    return disk, writes, checkpoint, load, queries
+
+
+def run_indented(size, operations):
+    with tempfile.TemporaryDirectory() as workdir:
+        for db_type in DB_TYPES:
+            table = {f"auction-{i}": auction(i) for i in range(size)} if db_type == "bids" else {}
+            with open(os.path.join(workdir, f"{db_type}.json"), "w") as file:
+                json.dump(table, file, indent=4)
+        disk = store_size(workdir)
+        start = time.perf_counter()
+        store = JsonStore(workdir, DB_TYPES)
+        store.load()
+        load = time.perf_counter() - start
+        queries = time_queries(store, operations)
+    return disk, None, None, load, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--operations", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'records':>9} {'engine':>14} {'disk MB':>8} {'write p50 us':>13} {'write p99 us':>13} "
+          f"{'checkpoint s':>13} {'load s':>7} {'query p50 us':>13}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for engine in ("json-indented", "json", "sqlite", "snapshot"):
+            if engine == "json-indented":
+                disk, writes, checkpoint, load, queries = run_indented(size, args.operations)
+            else:
+                disk, writes, checkpoint, load, queries = run_engine(engine, size, args.operations)
+            write_p50 = f"{percentile(writes, 50) * 1e6:.0f}" if writes else "-"
+            write_p99 = f"{percentile(writes, 99) * 1e6:.0f}" if writes else "-"
+            checkpoint = f"{checkpoint:.3f}" if checkpoint is not None else "-"
+            print(f"{size:>9} {engine:>14} {disk / 1e6:>8.1f} {write_p50:>13} {write_p99:>13} "
+                  f"{checkpoint:>13} {load:>7.2f} {percentile(queries, 50) * 1e6:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,90 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-import requests
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify
+from http_client import HttpClient, CallPolicy
+from shard_router import ShardRouter, parse_shards
+from bid_feed import BidFeed
+from id_blocks import IdAllocationError, IdBlockAllocator
+from metrics import CONTENT_TYPE, REGISTRY, instrument_flask
+import tracing
 from datetime import datetime, timedelta
+import threading
 import time
+import os
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
+instrument_flask(app)
+tracing.instrument_flask(app)
 
 # Server configuration
-DATABASE_URL = f'http://database-service-external.database.svc.cluster.local:5001'
+PORT = int(os.getenv("PORT", "5000"))
+# The database nodes of each shard, as in the database's PEERS, and where each node is reached.
+DATABASE_SHARDS = parse_shards(os.getenv("DATABASE_SHARDS", "database-server-0,database-server-1,database-server-2"))
+DATABASE_NODE_URL = os.getenv("DATABASE_NODE_URL", "http://{node}.database-server.database.svc.cluster.local:5001")
+# Reads go to any replica at most this many seconds behind its shard's leader.
+DATABASE_MAX_STALENESS = float(os.getenv("DATABASE_MAX_STALENESS", "5"))
+AUCTIONS_PER_PAGE = 20
+# Highest bids listed on an auction's page.
+TOP_BIDS_SHOWN = 5
+# Auction IDs reserved from the database per round trip; unused ones are skipped if the pod restarts.
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "100"))
+db_client = HttpClient({
+    "read": CallPolicy(timeout=(1, 5), retries=1),
+    "write": CallPolicy(timeout=(1, 5), retries=1),
+    "discover": CallPolicy(timeout=(0.5, 1), retries=1),
+    # Long polls of the bid change feed, which the database holds open up to BID_FEED_POLL seconds.
+    "changes": CallPolicy(timeout=(1, 15)),
+}, pool_size=32)
+db_router = ShardRouter(DATABASE_SHARDS, db_client, lambda node: DATABASE_NODE_URL.format(node=node),
+                        max_staleness=DATABASE_MAX_STALENESS)
+BID_FEED_POLL = 10
+# Comments keep idle event streams open through proxies.
+EVENT_STREAM_KEEPALIVE = 15
+# Each open event stream holds a server thread. Viewers beyond this many get the newest
+# change at once and reconnect EVENT_STREAM_RETRY seconds later, polling instead.
+EVENT_STREAM_LIMIT = int(os.getenv("EVENT_STREAM_LIMIT", "200"))
+EVENT_STREAM_RETRY = 5
+event_streams = threading.BoundedSemaphore(EVENT_STREAM_LIMIT)
+bid_feed = BidFeed(db_router, len(DATABASE_SHARDS), "changes", poll_timeout=BID_FEED_POLL)
+
+REGISTRY.counter("database_calls_total", "Calls to the database by call type and outcome.", ("call_type", "outcome"),
+                 collect=lambda: {(call_type, outcome): count
+                                  for call_type, counters in db_client.stats()["call_types"].items()
+                                  for outcome, count in counters.items()})
+REGISTRY.gauge("auction_event_stream_viewers", "Viewers waiting on an auction's bid event stream.",
+               collect=lambda: {(): bid_feed.viewers()})
+
+next_auction_id = IdBlockAllocator(db_router, "auctions", ID_BLOCK_SIZE)
+
+# Read-your-writes: remember the database version of this session's last
+# write to each shard and ask for reads that are at least that fresh.
+def read_params(shard, consistency=None):
+    params = {'min_version': session.get('db_versions', {}).get(str(shard), 0), 'max_staleness': DATABASE_MAX_STALENESS}
+    if consistency:
+        params['consistency'] = consistency
+    return params
+
+def remember_version(response, shard):
+    if response.status_code == 200:
+        versions = session.get('db_versions', {})
+        versions[str(shard)] = max(versions.get(str(shard), 0), response.json().get('version', 0))
+        session['db_versions'] = versions
+
+def active_auctions_page(cursor=None):
+    """Merge one page of every shard's live auctions, soonest-ending first."""
+    auctions, more = [], False
+    for shard in range(len(DATABASE_SHARDS)):
+        params = dict(read_params(shard), limit=AUCTIONS_PER_PAGE)
+        if cursor:
+            params['cursor'] = cursor
+        page = db_router.get(shard, '/auctions/active', 'read', leader=False, min_version=params['min_version'],
+                             params=params).json()
+        auctions += page.get('auctions', [])
+        more = more or page.get('next_cursor') is not None
+    auctions.sort(key=lambda auction: (auction['expires'], auction['id']))
+    more = more or len(auctions) > AUCTIONS_PER_PAGE
+    auctions = auctions[:AUCTIONS_PER_PAGE]
+    next_cursor = f"{auctions[-1]['expires']!r}:{auctions[-1]['id']}" if more and auctions else None
+    return auctions, next_cursor
 
 # Helper function to get the current time
 def current_time():
@@ -21,20 +98,60 @@ def is_auction_active(auction):
 # Routes
 @app.route('/')
 def home():
-    response = requests.get(f'{DATABASE_URL}/data')
-    auctions = response.json().get('bids', {})
-    active_auctions = [
-        auction for auction in auctions.values() if is_auction_active(auction)
-    ]
-    return render_template('auction_list.html', auctions=active_auctions)
+    auctions, next_cursor = active_auctions_page(request.args.get('cursor'))
+    return render_template('auction_list.html', auctions=auctions, next_cursor=next_cursor)
 
 @app.route('/auction/<auction_id>')
 def auction_detail(auction_id):
-    response = requests.get(f'{DATABASE_URL}/read/bids/{auction_id}')
+    shard = db_router.shard_for(auction_id)
+    params = read_params(shard)
+    response = db_router.get(shard, f'/read/bids/{auction_id}', 'read', leader=False,
+                             min_version=params['min_version'], params=params)
+    version = response.json().get('version', 0)
     auction = response.json().get('value', {})
-    if not auction or not is_auction_active(auction):
+    if not auction:
+        # Closed auctions are moved to the database's archive.
+        response = db_router.get(shard, f'/archive/{auction_id}', 'read', leader=False)
+        auction = response.json().get('value', {})
+    if not auction:
         return redirect(url_for('home'))
-    return render_template('auction_detail.html', auction=auction, auction_id=auction_id)
+    response = db_router.get(shard, f'/bids/{auction_id}/top', 'read', leader=False,
+                             min_version=params['min_version'], params=dict(params, n=TOP_BIDS_SHOWN))
+    top_bids = response.json().get('bids', []) if response.status_code == 200 else []
+    return render_template('auction_detail.html', auction=auction, auction_id=auction_id,
+                           closed=not is_auction_active(auction), version=version, top_bids=top_bids,
+                           top_bids_shown=TOP_BIDS_SHOWN)
+
+@app.route('/auction/<auction_id>/events')
+def auction_events(auction_id):
+    """Server-sent events with the auction's state after each committed bid, and once it closes."""
+    # Browsers resume from the last event they received when they reconnect.
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('version', 0))
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID and version must be integers."}), 400
+
+    def stream():
+        # Taken once the response starts, so a stream that never starts holds no slot.
+        if not event_streams.acquire(blocking=False):
+            change = bid_feed.latest(auction_id, since)
+            yield f"retry: {EVENT_STREAM_RETRY * 1000}\n\n" + (change[1] if change else "")
+            return
+        try:
+            version = since
+            while True:
+                change = bid_feed.wait(auction_id, version, EVENT_STREAM_KEEPALIVE)
+                if change is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                version, event, closed = change
+                yield event
+                if closed:
+                    return
+        finally:
+            event_streams.release()
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/bid/<auction_id>', methods=['POST'])
 def bid(auction_id):
@@ -42,36 +159,28 @@ def bid(auction_id):
         return jsonify({"error": "You must log in to bid."}), 401
 
     bid_amount = float(request.form['bid_amount'])
-    response = requests.get(f'{DATABASE_URL}/read/bids/{auction_id}')
-    auction = response.json().get('value', {})
-
-    if not auction:
-        return jsonify({"error": "Auction not found."}), 404
-
-    # Check if the auction is active
-    created_time = datetime.strptime(auction['created_time'], '%Y-%m-%d %H:%M:%S')
-    if current_time() > created_time + timedelta(days=1):
-        return jsonify({"error": "Auction is no longer active."}), 400
-
-    # Validate the bid
-    highest_bid = auction.get('highest_bid', auction['starting_bid'])
-    if bid_amount > highest_bid:
-        auction['highest_bid'] = bid_amount
-        auction['highest_bidder'] = session['user_id']
-        requests.post(
-            f'{DATABASE_URL}/write',
-            json={"key": auction_id, "value": auction, "db_type": "bids"}
-        )
+    shard = db_router.shard_for(auction_id)
+    response = db_router.post(
+        shard, '/bid', 'write',
+        json={"auction_id": auction_id, "bidder": session['user_id'], "amount": bid_amount}
+    )
+    if response.status_code == 200:
+        remember_version(response, shard)
         return redirect(url_for('auction_detail', auction_id=auction_id))
-    else:
-        return jsonify({"error": "Bid must be higher than the current highest bid."}), 400
+    if response.status_code == 404:
+        return jsonify({"error": "Auction not found."}), 404
+    if response.status_code in (400, 409):
+        return jsonify({"error": response.json().get("error")}), 400
+    return jsonify({"error": "Bid could not be placed, please try again."}), 503
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        response = requests.post(f'{DATABASE_URL}/add_user', json={'username': username, 'password': password})
+        shard = db_router.shard_for(username)
+        response = db_router.post(shard, '/add_user', 'write', json={'username': username, 'password': password})
+        remember_version(response, shard)
         if response.status_code == 200:
             return redirect(url_for('login'))
         else:
@@ -83,7 +192,10 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        response = requests.post(f'{DATABASE_URL}/authenticate_user', json={'username': username, 'password': password})
+        shard = db_router.shard_for(username)
+        params = read_params(shard)
+        response = db_router.post(shard, '/authenticate_user', 'read', leader=False, min_version=params['min_version'],
+                                  json={'username': username, 'password': password, **params})
         if response.status_code == 200:
             session['user_id'] = username
             return redirect(url_for('home'))
@@ -110,20 +222,43 @@ def create_auction():
             'starting_bid': starting_bid,
             'highest_bid': starting_bid,
             'highest_bidder': None,
+            'creator': session['user_id'],
             'created_time': current_time().strftime('%Y-%m-%d %H:%M:%S')
         }
-        auction_id = len(requests.get(f'{DATABASE_URL}/data').json().get('bids', {})) + 1
-        requests.post(
-            f'{DATABASE_URL}/write',
-            json={"key": title, "value": auction, "db_type": "bids"}
+        try:
+            auction_id = str(next_auction_id())
+        except IdAllocationError:
+            return jsonify({"error": "Auction could not be created, please try again."}), 503
+        shard = db_router.shard_for(auction_id)
+        response = db_router.post(
+            shard, '/create', 'write',
+            json={"key": auction_id, "value": auction, "db_type": "bids"}
         )
-        return redirect(url_for('home'))
+        if response.status_code == 409:
+            return jsonify({"error": "Auction already exists."}), 409
+        if response.status_code != 200:
+            return jsonify({"error": "Auction could not be created, please try again."}), 503
+        remember_version(response, shard)
+        return redirect(url_for('auction_detail', auction_id=auction_id))
     return render_template('create_auction.html')
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+@app.route('/traces', methods=['GET'])
+def traces():
+    limit = request.args.get("limit")
+    return jsonify({"spans": tracing.COLLECTOR.export(int(limit) if limit else None)}), 200
+
+@app.route('/http_stats', methods=['GET'])
+def http_stats():
+    return jsonify(db_client.stats()), 200
+
 @app.route('/liveness', methods=['GET'])
 def liveness():
     return jsonify({"liveness": "Service is live and listening to requests"}), 200
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=PORT)
 
@@ -0,0 +1,122 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Watched:
+    """Viewers waiting on one auction, and the newest change they have been offered."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.viewers = 0
+        self.change = None
+
+
+class BidFeed:
+    """Fans the database's bid change feed out to every viewer of an auction.
+
+    One thread per shard long-polls the shard's /changes and keeps the
+    newest change of each recently changed auction, already encoded as a
+    server-sent event. Viewers wait on their auction only, and all of an
+    auction's viewers send the same encoded event, so the database sees
+    one subscription per shard however many viewers there are.
+    """
+
+    def __init__(self, router, shards, call_type, poll_timeout=10, recent_size=10000):
+        self.router = router
+        self.call_type = call_type
+        self.poll_timeout = poll_timeout
+        self.recent_size = recent_size
+        self.lock = threading.Lock()
+        # auction id -> (log index, event, closed), for viewers that connect
+        # after a change their page missed.
+        self.recent = collections.OrderedDict()
+        self.watched = {}
+        for shard in range(shards):
+            threading.Thread(target=self._follow, args=(shard,), daemon=True).start()
+
+    def _follow(self, shard):
+        after = 0
+        while True:
+            try:
+                response = self.router.get(shard, '/changes', self.call_type, leader=False,
+                                           params={"after": after, "timeout": self.poll_timeout})
+                body = response.json()
+                if response.status_code == 410:
+                    # Changes were missed; what viewers are shown has to be read afresh.
+                    after = body["next"]
+                    self._refresh(shard, after)
+                    continue
+                response.raise_for_status()
+                for change in body["changes"]:
+                    self._publish(change)
+                after = body["next"]
+            except Exception as e:
+                logger.error(f"Failed to follow bid changes of shard {shard}: {e}\n")
+                time.sleep(1)
+
+    def _refresh(self, shard, index):
+        with self.lock:
+            for auction_id in [key for key in self.recent if self.router.shard_for(key) == shard]:
+                del self.recent[auction_id]
+            watched = [key for key in self.watched if self.router.shard_for(key) == shard]
+        for auction_id in watched:
+            response = self.router.get(shard, f'/read/bids/{auction_id}', 'read', leader=False)
+            if response.status_code == 200:
+                self._publish({"index": index, "op": "put", "key": auction_id, "value": response.json()["value"]})
+
+    def _publish(self, change):
+        closed = change["op"] in ("archive", "delete")
+        event = "closed" if closed else "bid"
+        data = json.dumps({"version": change["index"], "auction": change["value"]})
+        entry = (change["index"], f"id: {change['index']}\nevent: {event}\ndata: {data}\n\n", closed)
+        with self.lock:
+            self.recent[change["key"]] = entry
+            self.recent.move_to_end(change["key"])
+            if len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+            watched = self.watched.get(change["key"])
+        if watched is not None:
+            with watched.condition:
+                watched.change = entry
+                watched.condition.notify_all()
+
+    def _newer(self, auction_id, watched, since):
+        change = watched.change or self.recent.get(auction_id)
+        return change if change is not None and change[0] > since else None
+
+    def viewers(self):
+        with self.lock:
+            return sum(watched.viewers for watched in self.watched.values())
+
+    def latest(self, auction_id, since):
+        """The newest change to an auction after log index `since`, as (index, event, closed), without waiting."""
+        with self.lock:
+            watched = self.watched.get(auction_id)
+            change = (watched.change if watched is not None else None) or self.recent.get(auction_id)
+        return change if change is not None and change[0] > since else None
+
+    def wait(self, auction_id, since, timeout):
+        """The newest change to an auction after log index `since`, as (index, event, closed).
+
+        Waits up to `timeout` seconds for one; returns None if none came.
+        """
+        with self.lock:
+            watched = self.watched.get(auction_id)
+            if watched is None:
+                watched = self.watched[auction_id] = _Watched()
+            watched.viewers += 1
+        try:
+            with watched.condition:
+                watched.condition.wait_for(lambda: self._newer(auction_id, watched, since), timeout)
+                return self._newer(auction_id, watched, since)
+        finally:
+            with self.lock:
+                watched.viewers -= 1
+                if watched.viewers == 0:
+                    del self.watched[auction_id]
@@ -0,0 +1,28 @@
+import threading
+
+
+class IdAllocationError(Exception):
+    pass
+
+
+class IdBlockAllocator:
+    """Hands out IDs of a database sequence from blocks reserved on its shard's leader."""
+
+    def __init__(self, router, name, block_size):
+        self.router = router
+        self.name = name
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next = self.end = 0
+
+    def __call__(self):
+        with self.lock:
+            if self.next >= self.end:
+                response = self.router.post(self.router.shard_for(self.name), '/allocate_ids', 'write',
+                                            json={"name": self.name, "count": self.block_size})
+                if response.status_code != 200:
+                    raise IdAllocationError(response.json().get("error"))
+                block = response.json()
+                self.next, self.end = block["start"], block["start"] + block["count"]
+            self.next += 1
+            return self.next - 1
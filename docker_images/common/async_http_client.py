@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import tracing
+from http_client import CallPolicy
+
+
+class ResponseError(aiohttp.ClientError):
+    def __init__(self, status_code, body):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+
+
+class AsyncResponse:
+    """The parts of a requests.Response the database server uses, read in full."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = body
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ResponseError(self.status_code, self.text)
+
+
+def _never_sent(error):
+    """True if a failed request cannot have reached the server."""
+    return isinstance(error, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+
+
+class AsyncHttpClient:
+    """asyncio counterpart of HttpClient, for the event-loop server.
+
+    One aiohttp connector keeps up to `pool_size` keep-alive connections per
+    peer and caches DNS answers for `dns_ttl` seconds. Call types, policies
+    and their environment overrides are the same as HttpClient's; failures
+    raise aiohttp.ClientError. Must be created on the running event loop.
+    """
+
+    def __init__(self, policies, pool_size=10, dns_ttl=30):
+        self.policies = {call_type: CallPolicy.from_env(call_type, policy) for call_type, policy in policies.items()}
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.peers = {}
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_connection_create_end.append(self._on_connection_created)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=pool_size, ttl_dns_cache=dns_ttl),
+            trace_configs=[trace])
+
+    async def _on_request_start(self, session, context, params):
+        context.origin = f"{params.url.host}:{params.url.port}"
+        self._count_peer(context.origin, "requests")
+
+    async def _on_connection_created(self, session, context, params):
+        self._count_peer(context.origin, "connections_opened")
+
+    def _count_peer(self, origin, field):
+        with self.lock:
+            counters = self.peers.setdefault(origin, {"requests": 0, "connections_opened": 0})
+            counters[field] += 1
+
+    def _count(self, call_type, field):
+        with self.lock:
+            counters = self.counters.setdefault(call_type, {"requests": 0, "errors": 0, "retries": 0})
+            counters[field] += 1
+
+    async def request(self, method, url, call_type, **kwargs):
+        policy = self.policies[call_type]
+        connect, read = policy.timeout
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+        if kwargs.get("params"):
+            # aiohttp only accepts str, int and float query values.
+            kwargs["params"] = {key: str(value) for key, value in kwargs["params"].items() if value is not None}
+        policy.earn_retry()
+        parts = urlsplit(url)
+        with tracing.span(f"{method} {parts.path}", call_type=call_type, peer=parts.netloc) as span:
+            if span is not None:
+                kwargs["headers"] = dict(kwargs.get("headers") or {}, traceparent=span.traceparent())
+            response = await self._send(method, url, call_type, policy, kwargs)
+            if span is not None:
+                span.set("status", response.status_code)
+            return response
+
+    async def _send(self, method, url, call_type, policy, kwargs):
+        attempt = 0
+        while True:
+            self._count(call_type, "requests")
+            try:
+                async with self.session.request(method, url, trace_request_ctx=SimpleNamespace(), **kwargs) as response:
+                    return AsyncResponse(response.status, await response.text())
+            except aiohttp.ClientError as e:
+                self._count(call_type, "errors")
+                retryable = method == "GET" or _never_sent(e)
+                if attempt >= policy.retries or not retryable or not policy.spend_retry():
+                    raise
+                attempt += 1
+                self._count(call_type, "retries")
+            except asyncio.TimeoutError as e:
+                self._count(call_type, "errors")
+                raise aiohttp.ServerTimeoutError(f"{method} {urlsplit(url).netloc} timed out") from e
+
+    async def get(self, url, call_type, **kwargs):
+        return await self.request("GET", url, call_type, **kwargs)
+
+    async def post(self, url, call_type, **kwargs):
+        return await self.request("POST", url, call_type, **kwargs)
+
+    def stats(self):
+        """Request counters per call type and connection reuse per peer, as HttpClient.stats()."""
+        with self.lock:
+            call_types = {call_type: dict(counters) for call_type, counters in self.counters.items()}
+            peers = {origin: dict(counters, connections_reused=counters["requests"] - counters["connections_opened"])
+                     for origin, counters in self.peers.items()}
+        return {"call_types": call_types, "peers": peers}
+
+    async def close(self):
+        await self.session.close()
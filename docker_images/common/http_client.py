@@ -0,0 +1,171 @@
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import tracing
+
+
+class CallPolicy:
+    """Timeout and retry settings for one kind of call.
+
+    `timeout` is a (connect, read) pair in seconds. Up to `retries` extra
+    attempts are made when the request provably never reached the server,
+    or for any connection failure on a GET, as long as the retry budget
+    allows: each call earns `retry_ratio` of a retry, so retries stay a small
+    fraction of traffic when a peer is down.
+
+    Environment variables HTTP_TIMEOUT_<CALL_TYPE> (read timeout) and
+    HTTP_RETRIES_<CALL_TYPE> override the defaults.
+    """
+
+    def __init__(self, timeout=(1, 5), retries=0, retry_ratio=0.1, retry_reserve=10):
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_ratio = retry_ratio
+        self.retry_reserve = retry_reserve
+        self.retry_tokens = retry_reserve
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, call_type, default):
+        name = call_type.upper()
+        timeout = default.timeout
+        if os.getenv(f"HTTP_TIMEOUT_{name}"):
+            timeout = (timeout[0], float(os.getenv(f"HTTP_TIMEOUT_{name}")))
+        retries = int(os.getenv(f"HTTP_RETRIES_{name}", default.retries))
+        return cls(timeout, retries, default.retry_ratio, default.retry_reserve)
+
+    def earn_retry(self):
+        with self.lock:
+            self.retry_tokens = min(self.retry_reserve, self.retry_tokens + self.retry_ratio)
+
+    def spend_retry(self):
+        with self.lock:
+            if self.retry_tokens < 1:
+                return False
+            self.retry_tokens -= 1
+            return True
+
+
+def _never_sent(error):
+    """True if a failed request cannot have reached the server."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class HttpClient:
+    """Shared HTTP client with a keep-alive connection pool per peer.
+
+    Host names are resolved once and cached for `dns_ttl` seconds; requests
+    go to the cached address with the original Host header, and a
+    connection failure drops the cached entry. Call sites name a call type
+    from `policies` to pick timeouts and retries.
+    """
+
+    def __init__(self, policies, pool_size=10, dns_ttl=30):
+        self.policies = {call_type: CallPolicy.from_env(call_type, policy) for call_type, policy in policies.items()}
+        self.pool_size = pool_size
+        self.dns_ttl = dns_ttl
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.addresses = {}
+        self.counters = {}
+
+    def resolve(self, host):
+        now = time.monotonic()
+        cached = self.addresses.get(host)
+        if cached and cached[1] > now:
+            return cached[0]
+        address = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+        self.addresses[host] = (address, now + self.dns_ttl)
+        return address
+
+    def forget(self, host):
+        self.addresses.pop(host, None)
+
+    def _session(self, origin):
+        session = self.sessions.get(origin)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(origin)
+                if session is None:
+                    session = requests.Session()
+                    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                    self.sessions[origin] = session
+        return session
+
+    def _count(self, call_type, field):
+        with self.lock:
+            counters = self.counters.setdefault(call_type, {"requests": 0, "errors": 0, "retries": 0})
+            counters[field] += 1
+
+    def request(self, method, url, call_type, **kwargs):
+        policy = self.policies[call_type]
+        parts = urlsplit(url)
+        kwargs.setdefault("timeout", policy.timeout)
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.setdefault("Host", parts.netloc)
+        policy.earn_retry()
+        with tracing.span(f"{method} {parts.path}", call_type=call_type, peer=parts.netloc) as span:
+            if span is not None:
+                headers["traceparent"] = span.traceparent()
+            response = self._send(method, parts, call_type, policy, headers, kwargs)
+            if span is not None:
+                span.set("status", response.status_code)
+            return response
+
+    def _send(self, method, parts, call_type, policy, headers, kwargs):
+        host = parts.hostname
+        attempt = 0
+        while True:
+            try:
+                address = self.resolve(host)
+            except OSError as e:
+                self._count(call_type, "errors")
+                raise requests.exceptions.ConnectionError(f"Cannot resolve {host}: {e}")
+            netloc = f"[{address}]" if ":" in address else address
+            if parts.port:
+                netloc = f"{netloc}:{parts.port}"
+            self._count(call_type, "requests")
+            try:
+                return self._session(netloc).request(method, urlunsplit(parts._replace(netloc=netloc)),
+                                                     headers=headers, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self.forget(host)
+                self._count(call_type, "errors")
+                retryable = method == "GET" or _never_sent(e)
+                if attempt >= policy.retries or not retryable or not policy.spend_retry():
+                    raise
+                attempt += 1
+                self._count(call_type, "retries")
+            except requests.exceptions.RequestException:
+                self._count(call_type, "errors")
+                raise
+
+    def get(self, url, call_type, **kwargs):
+        return self.request("GET", url, call_type, **kwargs)
+
+    def post(self, url, call_type, **kwargs):
+        return self.request("POST", url, call_type, **kwargs)
+
+    def stats(self):
+        """Request counters per call type and connection reuse per peer."""
+        peers = {}
+        for origin, session in list(self.sessions.items()):
+            opened = sent = 0
+            pools = session.get_adapter("http://").poolmanager.pools
+            for pool in filter(None, (pools.get(key) for key in pools.keys())):
+                opened += pool.num_connections
+                sent += pool.num_requests
+            peers[origin] = {"requests": sent, "connections_opened": opened, "connections_reused": sent - opened}
+        with self.lock:
+            call_types = {call_type: dict(counters) for call_type, counters in self.counters.items()}
+        return {"call_types": call_types, "peers": peers}
@@ -0,0 +1,227 @@
+"""In-process metrics, served in the Prometheus text format.
+
+Metrics are created once at import time, like loggers, and recording a
+value is a dict update under a lock, cheap enough for every request.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds in seconds, from an uncontended lock to a peer timing out.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format(name, label_names, label_values, value, extra=()):
+    pairs = [f'{label}="{_escape(label_value)}"' for label, label_value in zip(label_names, label_values)]
+    pairs += [f'{label}="{label_value}"' for label, label_value in extra]
+    return f"{name}{{{','.join(pairs)}}} {value}" if pairs else f"{name} {value}"
+
+
+class Counter:
+    """A count that only goes up, per combination of label values.
+
+    With `collect`, the values are read from `collect()`, a dict of
+    {label values tuple: value}, whenever metrics are rendered.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def lines(self):
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [_format(self.name, self.labels, label_values, value) for label_values, value in values.items()]
+
+
+class Gauge(Counter):
+    """A value that can go up and down; usually read through `collect`."""
+
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets, with their sum, per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe how long the `with` block took."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def lines(self):
+        with self.lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self.series.items()]
+        lines = []
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(_format(f"{self.name}_bucket", self.labels, label_values, cumulative, [("le", bound)]))
+            lines.append(_format(f"{self.name}_sum", self.labels, label_values, total))
+            lines.append(_format(f"{self.name}_count", self.labels, label_values, cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            # A module imported twice gets the metric it created the first time.
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=(), collect=None):
+        return self._add(Counter(name, help, labels, collect))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self._add(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines += metric.lines()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+HTTP_REQUESTS = REGISTRY.histogram("http_request_duration_seconds", "Time taken to answer HTTP requests, by route.",
+                                   ("method", "route", "status"))
+
+
+def instrument_flask(app):
+    """Record every request a Flask app answers in HTTP_REQUESTS."""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            # The route pattern, not the path, so auction ids do not each get a series.
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_REQUESTS.observe(time.perf_counter() - start, request.method, route, response.status_code)
+        return response
+
+
+def aiohttp_middleware():
+    """An aiohttp middleware recording every request answered in HTTP_REQUESTS."""
+    from aiohttp import web
+
+    @web.middleware
+    async def observe_request(request, handler):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            HTTP_REQUESTS.observe(time.perf_counter() - start, request.method, route, status)
+
+    return observe_request
+
+
+class TimedLock:
+    """A threading.Lock that records in `histogram` how long each acquisition waited.
+
+    Acquisitions that had to wait are also traced as `span_name` spans.
+    """
+
+    def __init__(self, histogram, span_name="lock_wait"):
+        self.histogram = histogram
+        self.span_name = span_name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self.histogram.observe(0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        waited = time.perf_counter() - start
+        self.histogram.observe(waited)
+        tracing.record(self.span_name, start, waited)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return True
+
+    def __exit__(self, *exc_info):
+        self.release()
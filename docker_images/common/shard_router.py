@@ -0,0 +1,237 @@
+import asyncio
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+
+import requests
+
+from metrics import REGISTRY
+
+READ_FAILURES = REGISTRY.counter("shard_router_read_failures_total",
+                                 "Reads a replica failed, by whether they were retried on another.", ("result",))
+
+
+def parse_shards(spec):
+    """Node IDs of each shard's replicas from "a,b,c;d,e,f"; a list without ";" is a single shard."""
+    return [group.split(",") for group in spec.split(";") if group]
+
+
+def shard_for(key, shard_count):
+    """The shard that owns `key`. crc32 rather than hash(), which differs between processes."""
+    return zlib.crc32(str(key).encode()) % shard_count
+
+
+class ShardRouter:
+    """Sends each key to the shard that owns it.
+
+    `shards` lists the node IDs of every shard's replicas and `node_url`
+    maps a node ID to its base URL. Writes go to the shard's leader, which
+    is found by asking a replica's /election and cached until a call to it
+    fails or answers 503. A replica that has lost the leadership forwards
+    writes to the new leader, so a stale cache costs a hop rather than an
+    error. `client` needs a "discover" call type.
+
+    Reads may go to any replica. With `max_staleness` (seconds) they are
+    spread over the replicas fresh enough to serve them: each replica's
+    /election advertises its staleness and last log index, polled in the
+    background every `status_interval` seconds while reads flow. A replica
+    qualifies if its advertised staleness plus the age of that report is
+    within `max_staleness` and it has the read's `min_version`; of two
+    random qualifying replicas, the one with fewer reads in flight gets the
+    read. With none qualifying, reads go to the leader.
+    """
+
+    def __init__(self, shards, client, node_url, max_staleness=None, status_interval=1.0):
+        self.shards = shards
+        self.client = client
+        self.node_url = node_url
+        self.leaders = {}
+        self.max_staleness = max_staleness
+        self.status_interval = status_interval
+        # node ID -> (staleness or None if behind, last index, monotonic time of the report, is leader)
+        self.replica_status = {}
+        self.status_checked = {}
+        self.in_flight = Counter()
+
+    def shard_for(self, key):
+        return shard_for(key, len(self.shards))
+
+    def _replicas(self, shard):
+        return random.sample(self.shards[shard], len(self.shards[shard]))
+
+    def leader(self, shard):
+        """The shard's leader, or None if no replica knows one."""
+        if shard not in self.leaders:
+            for node in self._replicas(shard):
+                try:
+                    leader_id = self.client.get(f"{self.node_url(node)}/election", "discover").json()["leader_id"]
+                except (requests.exceptions.RequestException, ValueError, KeyError):
+                    continue
+                if leader_id:
+                    self.leaders[shard] = leader_id
+                    break
+        return self.leaders.get(shard)
+
+    def _status_due(self, shard):
+        now = time.monotonic()
+        if self.max_staleness is None or now - self.status_checked.get(shard, float("-inf")) < self.status_interval:
+            return False
+        self.status_checked[shard] = now
+        return True
+
+    def _note_status(self, shard, node, status):
+        """Record a replica's /election answer, or None if it gave none."""
+        if status is None:
+            self.replica_status.pop(node, None)
+            return
+        self.replica_status[node] = (status.get("staleness"), status.get("last_index", 0), time.monotonic(),
+                                     status.get("leader_id") == node)
+        if status.get("leader_id"):
+            self.leaders[shard] = status["leader_id"]
+
+    def refresh(self, shard):
+        """Poll every replica of the shard for its advertised staleness."""
+        for node in self.shards[shard]:
+            try:
+                status = self.client.get(f"{self.node_url(node)}/election", "discover").json()
+            except (requests.exceptions.RequestException, ValueError):
+                status = None
+            self._note_status(shard, node, status)
+
+    def _fresh(self, node, now, min_version):
+        status = self.replica_status.get(node)
+        if status is None:
+            return False
+        staleness, last_index, reported, is_leader = status
+        if is_leader:
+            return True
+        return staleness is not None and staleness + now - reported <= self.max_staleness and last_index >= min_version
+
+    def _read_replica(self, shard, min_version, exclude):
+        replicas = [node for node in self.shards[shard] if node not in exclude]
+        if self.max_staleness is None:
+            return random.choice(replicas)
+        now = time.monotonic()
+        fresh = [node for node in replicas if self._fresh(node, now, min_version)]
+        if not fresh:
+            leader_id = self.leaders.get(shard)
+            return leader_id if leader_id in replicas else random.choice(replicas)
+        return min(random.sample(fresh, min(2, len(fresh))), key=lambda node: self.in_flight[node])
+
+    def _read_failed(self, node, tried, shard):
+        """Stop reading from a replica that failed; whether another one is worth trying."""
+        self.replica_status.pop(node, None)
+        tried.append(node)
+        retry = len(tried) < min(2, len(self.shards[shard]))
+        READ_FAILURES.inc("retried" if retry else "failed")
+        return retry
+
+    def read(self, method, shard, path, call_type, min_version=0, **kwargs):
+        """Send a read to a replica fresh enough for it, retrying once on another replica if it cannot be reached."""
+        if self._status_due(shard):
+            threading.Thread(target=self.refresh, args=(shard,), daemon=True).start()
+        tried = []
+        while True:
+            node = self._read_replica(shard, min_version, tried)
+            self.in_flight[node] += 1
+            try:
+                return self.client.request(method, self.node_url(node) + path, call_type, **kwargs)
+            except requests.exceptions.RequestException:
+                if not self._read_failed(node, tried, shard):
+                    raise
+            finally:
+                self.in_flight[node] -= 1
+
+    def _base_url(self, shard, leader_id):
+        if leader_id is not None:
+            return self.node_url(leader_id)
+        return self.node_url(random.choice(self.shards[shard]))
+
+    def _done(self, shard, status_code):
+        if status_code == 503:
+            self.leaders.pop(shard, None)
+
+    def request(self, method, shard, path, call_type, leader=True, min_version=0, **kwargs):
+        """Send a request to the shard's leader, or with `leader=False` read it from a replica (see read)."""
+        if not leader:
+            return self.read(method, shard, path, call_type, min_version, **kwargs)
+        url = self._base_url(shard, self.leader(shard)) + path
+        try:
+            response = self.client.request(method, url, call_type, **kwargs)
+        except requests.exceptions.RequestException:
+            self.leaders.pop(shard, None)
+            raise
+        self._done(shard, response.status_code)
+        return response
+
+    def get(self, shard, path, call_type, **kwargs):
+        return self.request("GET", shard, path, call_type, **kwargs)
+
+    def post(self, shard, path, call_type, **kwargs):
+        return self.request("POST", shard, path, call_type, **kwargs)
+
+
+class AsyncShardRouter(ShardRouter):
+    """ShardRouter for the asyncio server, over an AsyncHttpClient."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refreshes = set()
+
+    async def leader(self, shard):
+        if shard not in self.leaders:
+            for node in self._replicas(shard):
+                try:
+                    response = await self.client.get(f"{self.node_url(node)}/election", "discover")
+                    leader_id = response.json()["leader_id"]
+                except Exception:
+                    continue
+                if leader_id:
+                    self.leaders[shard] = leader_id
+                    break
+        return self.leaders.get(shard)
+
+    async def refresh(self, shard):
+        for node in self.shards[shard]:
+            try:
+                status = (await self.client.get(f"{self.node_url(node)}/election", "discover")).json()
+            except Exception:
+                status = None
+            self._note_status(shard, node, status)
+
+    async def read(self, method, shard, path, call_type, min_version=0, **kwargs):
+        if self._status_due(shard):
+            task = asyncio.get_running_loop().create_task(self.refresh(shard))
+            self.refreshes.add(task)
+            task.add_done_callback(self.refreshes.discard)
+        tried = []
+        while True:
+            node = self._read_replica(shard, min_version, tried)
+            self.in_flight[node] += 1
+            try:
+                return await self.client.request(method, self.node_url(node) + path, call_type, **kwargs)
+            except Exception:
+                if not self._read_failed(node, tried, shard):
+                    raise
+            finally:
+                self.in_flight[node] -= 1
+
+    async def request(self, method, shard, path, call_type, leader=True, min_version=0, **kwargs):
+        if not leader:
+            return await self.read(method, shard, path, call_type, min_version, **kwargs)
+        url = self._base_url(shard, await self.leader(shard)) + path
+        try:
+            response = await self.client.request(method, url, call_type, **kwargs)
+        except Exception:
+            self.leaders.pop(shard, None)
+            raise
+        self._done(shard, response.status_code)
+        return response
+
+    async def get(self, shard, path, call_type, **kwargs):
+        return await self.request("GET", shard, path, call_type, **kwargs)
+
+    async def post(self, shard, path, call_type, **kwargs):
+        return await self.request("POST", shard, path, call_type, **kwargs)
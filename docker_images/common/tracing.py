@@ -0,0 +1,237 @@
+"""Request tracing across the auction service and the database nodes.
+
+Each request a service serves gets a span, and so does every call it
+makes to another service, every contended lock wait and every file
+operation under it. Spans carry the W3C traceparent of their trace, and
+HttpClient/AsyncHttpClient send it along with each call, so the spans a
+bid leaves on the auction service, the database node it reached, the
+leader it was forwarded to and the followers it was replicated to all
+belong to one trace.
+
+Spans are buffered per request. When the request finishes its trace is
+kept if the trace was sampled where it started (TRACE_SAMPLE_RATE), or,
+at TRACE_SLOW_SAMPLE_RATE, if the request took TRACE_SLOW_SECONDS or
+longer. Kept spans go to an in-process collector served at /traces and,
+if TRACE_FILE is set, are appended to that file as JSON lines.
+benchmarks/critical_path.py reads either and prints the critical path of
+the slowest requests.
+"""
+import collections
+import contextvars
+import json
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "0.25"))
+TRACE_SLOW_SAMPLE_RATE = float(os.getenv("TRACE_SLOW_SAMPLE_RATE", "1"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+# Spans the in-process collector keeps, oldest dropped first.
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "10000"))
+SERVICE = os.getenv("MY_POD_NAME") or socket.gethostname()
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+class _Trace:
+    """The spans of one trace recorded by this process for one request."""
+
+    __slots__ = ("sampled", "long_poll", "root", "spans", "kept")
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.long_poll = False
+        self.root = None
+        self.spans = []
+        # Decided when the root span finishes.
+        self.kept = None
+
+
+class Span:
+    __slots__ = ("trace", "trace_id", "span_id", "parent_id", "name", "attributes", "start", "started", "duration")
+
+    def __init__(self, trace, trace_id, parent_id, name, attributes):
+        self.trace = trace
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self):
+        """The traceparent header that makes a call's spans children of this one."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "service": SERVICE, "start": self.start, "duration": self.duration,
+                "attributes": self.attributes}
+
+
+class Collector:
+    """Spans of kept traces, in memory and, with `path`, appended to a file as JSON lines."""
+
+    def __init__(self, size=TRACE_BUFFER, path=TRACE_FILE):
+        self.spans = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.file = open(path, 'a') if path else None
+
+    def add(self, spans):
+        records = [span.to_dict() for span in spans]
+        with self.lock:
+            self.spans.extend(records)
+            if self.file is not None:
+                self.file.write("".join(json.dumps(record) + "\n" for record in records))
+                self.file.flush()
+
+    def export(self, limit=None):
+        """The newest `limit` spans kept, oldest first."""
+        with self.lock:
+            spans = list(self.spans)
+        return spans[-limit:] if limit else spans
+
+
+COLLECTOR = Collector()
+
+
+def _finish(span, duration=None):
+    span.duration = time.perf_counter() - span.started if duration is None else duration
+    trace = span.trace
+    if span is trace.root:
+        trace.spans.append(span)
+        slow = span.duration >= TRACE_SLOW_SECONDS and not trace.long_poll
+        trace.kept = trace.sampled or (slow and random.random() < TRACE_SLOW_SAMPLE_RATE)
+        if trace.kept:
+            COLLECTOR.add(list(trace.spans))
+    elif trace.kept is None:
+        trace.spans.append(span)
+    elif trace.kept:
+        # Finished after the request did, such as replication still in flight.
+        COLLECTOR.add([span])
+
+
+def _parse(traceparent):
+    try:
+        version, trace_id, parent_id, flags = traceparent.split("-")
+        int(trace_id, 16), int(parent_id, 16)
+        return trace_id, parent_id, bool(int(flags, 16) & 1)
+    except (AttributeError, ValueError):
+        return None, None, False
+
+
+def current():
+    """The span of whatever this thread or task is doing for a request, or None."""
+    return _current.get()
+
+
+def start_request(name, traceparent=None, **attributes):
+    """Start the span of a request this service serves, continuing the caller's trace if it sent a traceparent.
+
+    Returns the span and a token for end_request.
+    """
+    trace_id, parent_id, sampled = _parse(traceparent)
+    if trace_id is None:
+        trace_id = f"{random.getrandbits(128):032x}"
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    trace = _Trace(sampled)
+    trace.root = Span(trace, trace_id, parent_id, name, attributes)
+    return trace.root, _current.set(trace.root)
+
+
+def long_poll():
+    """Mark the current request as one that waits by design, so taking long does not make it slow."""
+    span = _current.get()
+    if span is not None:
+        span.trace.long_poll = True
+
+
+def end_request(span, token):
+    _current.reset(token)
+    _finish(span)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """Record the `with` block as a child of `parent`, by default the current span.
+
+    Does nothing outside a request, so background work is not traced.
+    """
+    parent = parent or _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, parent.trace_id, parent.span_id, name, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set("error", type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        _finish(child)
+
+
+def record(name, started, duration, parent=None, **attributes):
+    """Add a finished child of `parent`, by default the current span, that began at time.perf_counter() `started`."""
+    parent = parent or _current.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, parent.trace_id, parent.span_id, name, attributes)
+    child.start -= child.started - started
+    child.started = started
+    _finish(child, duration)
+
+
+def instrument_flask(app):
+    """Give every request a Flask app serves a span, continuing the caller's trace."""
+    from flask import g, request
+
+    @app.before_request
+    def start_span():
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.trace_span = start_request(f"{request.method} {route}", request.headers.get("traceparent"))
+
+    @app.after_request
+    def note_status(response):
+        if "trace_span" in g:
+            g.trace_span[0].set("status", response.status_code)
+        return response
+
+    @app.teardown_request
+    def end_span(error):
+        started = g.pop("trace_span", None)
+        if started is not None:
+            end_request(*started)
+
+
+def aiohttp_middleware():
+    """An aiohttp middleware giving every request a span, continuing the caller's trace."""
+    from aiohttp import web
+
+    @web.middleware
+    async def trace_request(request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        started = start_request(f"{request.method} {route}", request.headers.get("traceparent"))
+        try:
+            response = await handler(request)
+            started[0].set("status", response.status)
+            return response
+        except web.HTTPException as e:
+            started[0].set("status", e.status)
+            raise
+        finally:
+            end_request(*started)
+
+    return trace_request
@@ -1,234 +1,386 @@
 from flask import Flask, request, jsonify, redirect
 from leader_election import LeaderElection
-from database import Database
-import socket
+from database import Database, PEER_CALL_POLICIES, PEERS, SHARDS, SHARD_ID, HEARTBEATS_SENT, LogConflict, peer_url, \
+    register_node_metrics
+from http_client import HttpClient
+from shard_router import ShardRouter
+from metrics import CONTENT_TYPE, REGISTRY, instrument_flask
+import tracing
+import handlers
+from handlers import (SERVER_ID, PORT, heartbeat_interval, phi_threshold, heartbeat_pause, election_timeout,
+                      version_wait_timeout, group_commit_window, snapshot_entries)
+from group_commit import GroupCommitter
+from replication import QuorumTimeout
+from concurrent.futures import ThreadPoolExecutor
+from failure_detector import PhiAccrualDetector
 import threading
 import time
 import os
 import requests
 import psutil
-start_time = time.time()
 
 app = Flask(__name__)
+instrument_flask(app)
+tracing.instrument_flask(app)
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
-SERVER_ID = os.getenv("MY_POD_NAME")
-PEERS = os.getenv("PEERS").split(",")
-SERVER_IP = socket.gethostbyname(socket.gethostname())
-
-leader_election = LeaderElection(PEERS, start_time)
-database = Database(PEERS)
-
-heartbeat_timeout = 15
-write_in_progress = False
-read_retry_timeout = 30
-
-last_heartbeat = time.time()
-
-leader_ip = leader_election.get_leader(start_time)
-while not leader_ip:
-    print("waiting for leader election")
-    time.sleep(2)
-
-if leader_ip != SERVER_IP:
-    logger.info(f"Synchronizing data with leader {leader_ip}...\n")
-    database.synchronize_with_leader(leader_ip)
-else:
-    logger.info("No synchronization needed, this server is the leader.\n")
-
-def send_heartbeat():
+peer_client = HttpClient(PEER_CALL_POLICIES)
+database = Database(PEERS, client=peer_client)
+router = ShardRouter(SHARDS, peer_client, peer_url)
+shard_pool = ThreadPoolExecutor(max_workers=len(SHARDS))
+
+def resynchronize(leader_id, reset=False):
+    threading.Thread(target=database.synchronize_with_leader, args=(leader_id, reset), daemon=True).start()
+
+leader_election = LeaderElection(PEERS, SERVER_ID, peer_url, peer_client, database.log_position,
+                                 on_change=handlers.leadership_changed, election_timeout=election_timeout,
+                                 detector=PhiAccrualDetector(heartbeat_interval, phi_threshold,
+                                                             acceptable_pause=heartbeat_pause))
+handlers.configure(database, leader_election, router, resynchronize)
+register_node_metrics(database, leader_election)
+heartbeat_pool = ThreadPoolExecutor(max_workers=max(1, len(PEERS)))
+
+def send_heartbeat(peer):
+    try:
+        sent_at = time.monotonic()
+        response = peer_client.post(f"{peer_url(peer)}/heartbeat", "heartbeat",
+                                    json=database.replicator.message(database.last_index))
+        if response.status_code == 200:
+            database.replicator.record_contact(peer, sent_at)
+            HEARTBEATS_SENT.inc("ok")
+            logger.debug(f"Sent heartbeat to {peer}\n")
+        elif response.status_code == 409:
+            HEARTBEATS_SENT.inc("stale_term")
+            leader_election.observe_term(response.json()["term"])
+    except requests.exceptions.Timeout as e:
+        HEARTBEATS_SENT.inc("error")
+        logger.error(f"Timeout while sending heartbeat to peer {peer}: {e}\n")
+    except requests.exceptions.ConnectionError as e:
+        HEARTBEATS_SENT.inc("error")
+        logger.error(f"Connection error while sending heartbeat to {peer}: {e}\n")
+    except requests.exceptions.RequestException as e:
+        HEARTBEATS_SENT.inc("error")
+        logger.error(f"Request error while sending heartbeat to peer {peer}: {e}\n")
+
+def heartbeat_loop():
     while True:
-        if leader_election.get_leader(start_time) == SERVER_IP:  # Only leader sends heartbeat
-            for peer in PEERS:
-                if peer != f"{SERVER_ID}" and leader_election.get_leader(start_time) == SERVER_IP:
-                    try:
-                        response = requests.post(f"http://{peer}.database-server.database.svc.cluster.local:5001/heartbeat", timeout=2)
-                        if response.status_code == 200:
-                            logger.info(f"Sent heartbeat to {peer}\n")
-                    except requests.exceptions.Timeout as e:
-                        logger.error(f"Timeout while sending heartbeat to peer {peer}: {e}\n")
-                    except requests.exceptions.ConnectionError as e:
-                        logger.error(f"Connection error while sending heartbeat to {peer}: {e}\n")
-                    except requests.exceptions.RequestException as e:
-                        logger.error(f"Request error while sending heartbeat to peer {peer}: {e}\n")
-                    except Exception as e:
-                        logger.error(f"Unexpected error while sending heartbeat to peer {peer}: {e}\n")
-        time.sleep(5)  # Send heartbeat every 5 seconds
+        if leader_election.is_leader():  # Only leader sends heartbeat
+            # Replication traffic counts as a heartbeat, so busy followers get none.
+            for peer in database.replicator.idle_followers(heartbeat_interval):
+                heartbeat_pool.submit(send_heartbeat, peer)
+        time.sleep(heartbeat_interval / 10)
 
 # Start the heartbeat thread
-heartbeat_thread = threading.Thread(target=send_heartbeat)
+heartbeat_thread = threading.Thread(target=heartbeat_loop)
 heartbeat_thread.daemon = True
 heartbeat_thread.start()
 
-def monitor_heartbeat():
-    global last_heartbeat
-    last_heartbeat = time.time()
+def monitor_leader():
     while True:
-        if leader_election.get_leader(start_time) != SERVER_IP:
-            if time.time() - last_heartbeat > heartbeat_timeout and leader_election.get_leader(start_time) != SERVER_IP:
-                logger.info("Leader failed, starting election...\n")
-                leader_election.start_election(start_time)
-        time.sleep(10)
-
-# Start the heartbeat monitoring thread
-monitor_thread = threading.Thread(target=monitor_heartbeat)
+        if leader_election.election_due():
+            logger.info("No leader heard from, starting election...\n")
+            leader_election.start_election()
+        time.sleep(0.05)
+
+# Start the election thread; it also elects the first leader at startup.
+monitor_thread = threading.Thread(target=monitor_leader)
 monitor_thread.daemon = True
 monitor_thread.start()
 
+def snapshot_loop():
+    while True:
+        time.sleep(1)
+        if database.entries_since_snapshot >= snapshot_entries:
+            try:
+                database.snapshot()
+            except OSError as e:
+                logger.error(f"Failed to take a snapshot: {e}\n")
+
+snapshot_thread = threading.Thread(target=snapshot_loop)
+snapshot_thread.daemon = True
+snapshot_thread.start()
+
+def closer_loop():
+    # The leader closes auctions as they expire; followers apply its archive entries.
+    while True:
+        time.sleep(1)
+        try:
+            while leader_election.is_leader() and database.close_expired_auctions(SERVER_ID) is not None:
+                pass
+        except OSError as e:
+            logger.error(f"Failed to archive closed auctions: {e}\n")
+
+closer_thread = threading.Thread(target=closer_loop)
+closer_thread.daemon = True
+closer_thread.start()
+
+group_commit = GroupCommitter(handlers.flush_writes, window=group_commit_window)
+bid_commit = GroupCommitter(handlers.flush_bids, window=group_commit_window)
+
+@app.errorhandler(handlers.BadRequest)
+def handle_bad_request(e):
+    body, status = handlers.bad_request(e)
+    return jsonify(body), status
+
+def forward(target):
+    """Relay a handlers.Forward to the node that answers it, and return its (body, status).
+
+    Returns a plain pair rather than a response, since it also runs in
+    shard_pool threads, outside the application context jsonify needs.
+    """
+    try:
+        if target.shard is not None:
+            response = router.request(target.method, target.shard, target.path, "forward",
+                                      leader=target.to_leader, **target.kwargs)
+        else:
+            response = peer_client.request(target.method, f"{peer_url(target.leader_id)}{target.path}", "forward",
+                                           **target.kwargs)
+            if target.check:
+                response.raise_for_status()
+        return response.json(), response.status_code
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return target.failed(e)
+
+def respond(answer):
+    """The response to a handler's (body, status), relaying it first if it is a handlers.Forward."""
+    if isinstance(answer, handlers.Forward):
+        answer = forward(answer)
+    body, status = answer
+    return jsonify(body), status
+
+def quorum_failure(index, what):
+    """None once a quorum of replicas holds `index`, else the answer to give instead."""
+    try:
+        database.replicator.wait_for_quorum(index)
+    except QuorumTimeout as e:
+        return handlers.not_acknowledged(what, e)
+    return None
+
+def refuse_read(options, method, path, key=None, failure=handlers.READ_FORWARD_FAILED, **kwargs):
+    """None if this node answers a read, else the response relaying it to another shard or the leader, or refusing it.
+
+    `options` holds the read's consistency arguments; see handlers.read_options.
+    """
+    answer = None if key is None else handlers.shard_read_target(method, path, key, **kwargs)
+    if answer is None:
+        consistency, min_version, max_staleness = handlers.read_options(options)
+        if database.wait_for_index(min_version, version_wait_timeout) and \
+                handlers.may_read_locally(consistency, max_staleness):
+            return None
+        answer = handlers.refused_read(consistency, method, path, failure, **kwargs)
+    return respond(answer)
+
+def write_across_shards(records_by_shard):
+    """Send each shard its part of a batch. The parts commit independently, not atomically."""
+    futures = {shard: shard_pool.submit(forward, handlers.Forward("POST", "/write_batch", shard=shard,
+                                                                  json={"records": records}))
+               for shard, records in records_by_shard.items()}
+    answers = {shard: future.result() for shard, future in futures.items()}
+    return respond(handlers.batch_written_across(records_by_shard, answers))
+
 @app.route('/write', methods=['POST'])
 def handle_write():
-    global write_in_progress
-    global start_time
-    leader_ip = leader_election.get_leader(start_time)
-    data = request.json
-    key = data["key"]
-    value = data["value"]
-    db_type = data["db_type"]
-
-    if leader_ip != SERVER_IP:
-        try:
-            response = requests.post(
-                f"http://{leader_ip}:5001/write",
-                json={"key": key, "value": value, "db_type": db_type},
-                timeout=2
-            )
-            response.raise_for_status()
-            return response.json(), response.status_code
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to forward write to leader {leader_ip}: {e}\n")
-            return jsonify({"error": "Failed to forward write request to the leader"}), 500
-    write_in_progress = True
-    database.write_record(key, value, leader_ip, db_type)
-    write_in_progress = False
-    return jsonify({"message": f"Write successful to {db_type} database"}), 200
+    record = handlers.parse_record(request.json)
+    target = handlers.write_target("POST", "/write", record["key"], check=True, json=record)
+    if target is not None:
+        return respond(target)
+    index = group_commit.submit(record).result()
+    return respond(quorum_failure(index, f"Write {record['key']}") or handlers.written(record, index))
+
+@app.route('/write_batch', methods=['POST'])
+def handle_write_batch():
+    records = handlers.parse_records(request.json)
+    records_by_shard = handlers.split_batch(records)
+    if records_by_shard.keys() - {SHARD_ID}:
+        return write_across_shards(records_by_shard)
+    target = handlers.write_target("POST", "/write_batch", check=True, json={"records": records})
+    if target is not None:
+        return respond(target)
+    index = database.write_batch(records, SERVER_ID)
+    return respond(quorum_failure(index, "Batch write") or handlers.batch_written(records, index))
+
+@app.route('/bid', methods=['POST'])
+def handle_bid():
+    bid = handlers.parse_bid(request.json)
+    target = handlers.write_target("POST", "/bid", bid["auction_id"], failure="Failed to forward bid to the leader",
+                                   json=bid)
+    if target is not None:
+        return respond(target)
+    outcome, auction, index = bid_commit.submit(bid).result()
+    answer = handlers.bid_placed(outcome, auction, index)
+    if outcome == "accepted":
+        answer = quorum_failure(index, f"Bid on {bid['auction_id']}") or answer
+    return respond(answer)
+
+@app.route('/create', methods=['POST'])
+def handle_create():
+    """Write a record only if its key is free, so a new record never overwrites an existing one."""
+    record = handlers.parse_record(request.json)
+    target = handlers.write_target("POST", "/create", record["key"], json=record)
+    if target is not None:
+        return respond(target)
+    index = database.create_record(record["key"], record["value"], SERVER_ID, record["db_type"])
+    answer = handlers.created(record, index)
+    if index is not None:
+        answer = quorum_failure(index, f"Create {record['key']}") or answer
+    return respond(answer)
+
+@app.route('/allocate_ids', methods=['POST'])
+def handle_allocate_ids():
+    """Reserve a block of values of an ID sequence, which the caller can then hand out without asking again."""
+    block = handlers.parse_block(request.json)
+    # Each sequence lives on the shard that owns its name.
+    target = handlers.write_target("POST", "/allocate_ids", block["name"], json=block)
+    if target is not None:
+        return respond(target)
+    start, index = database.allocate_ids(block["name"], block["count"], SERVER_ID)
+    # Unacknowledged, the block could be handed out again by the next leader.
+    return respond(quorum_failure(index, f"ID allocation for {block['name']}") or
+                   handlers.ids_allocated(block, start, index))
 
 @app.route('/add_user', methods=['POST'])
 def add_user():
-    global write_in_progress
-    global start_time
-    data = request.json
-    username = data["username"]
-    password = data["password"]
-
-    leader_ip = leader_election.get_leader(start_time)
-    
-    if leader_ip != SERVER_IP:
-        # Redirect request to the leader
-        try:
-            response = requests.post(
-                f"http://{leader_ip}:5001/add_user",
-                json={"username": username, "password": password},
-                timeout=2
-            )
-            response.raise_for_status()
-            return response.json(), response.status_code
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to forward add_user request to leader {leader_ip}: {e}\n")
-            return jsonify({"error": "Failed to forward request to the leader"}), 500
-    
-    # Handle user creation if this is the leader
-    write_in_progress = True
-    if database.add_user(username, password, leader_ip):
-        write_in_progress = False
-        return jsonify({"message": f"User {username} added successfully."}), 200
-    write_in_progress = False
-    return jsonify({"error": f"User {username} already exists."}), 400
-
+    user = handlers.parse_user(request.json)
+    target = handlers.write_target("POST", "/add_user", user["username"],
+                                   failure="Failed to forward request to the leader", check=True, json=user)
+    if target is not None:
+        return respond(target)
+    index = database.add_user(user["username"], user["password"], SERVER_ID)
+    answer = handlers.user_added(user, index)
+    if index:
+        answer = quorum_failure(index, f"User {user['username']}") or answer
+    return respond(answer)
 
 @app.route('/read/<db_type>/<key>', methods=['GET'])
 def handle_read(db_type, key):
-    global start_time
-    leader_ip = leader_election.get_leader(start_time)
-    timeout = 30
-    st_time = time.time()
+    params = request.args.to_dict()
+    refused = refuse_read(params, "GET", f"/read/{db_type}/{key}", key, params=params)
+    return refused or respond(handlers.read_record(db_type, key))
 
-    while time.time() - st_time < timeout:
-        try:
-            response = requests.get(f"http://{leader_ip}:5001/lock_status", timeout=2)
-            if response.status_code == 200:
-                lock_status = response.json().get("write_in_progress", False)
-                if not lock_status:
-                    value = database.read_record(key, db_type)
-                    if value is None:
-                        return jsonify({"error": "Record not found"}), 404
-                    return jsonify({"key": key, "value": value}), 200
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to contact leader: {e}\n")
-        time.sleep(2)
-
-    return jsonify({"error": "Read request timed out"}), 503
+@app.route('/archive/<auction_id>', methods=['GET'])
+def handle_archive_read(auction_id):
+    # Archived auctions never change, so any replica that has one can serve it.
+    target = handlers.shard_read_target("GET", f"/archive/{auction_id}", auction_id)
+    return respond(target or handlers.read_archived(auction_id))
 
 @app.route('/authenticate_user', methods=['POST'])
 def authenticate_user():
-    global start_time
     data = request.json
-    username = data["username"]
-    password = data["password"]
-
-    leader_ip = leader_election.get_leader(start_time)
-    timeout = 30  # Maximum wait time in seconds
-    st_time = time.time()
-
-    while time.time() - st_time < timeout:
-        try:
-            response = requests.get(f"http://{leader_ip}:5001/lock_status", timeout=2)
-            if response.status_code == 200:
-                lock_status = response.json().get("write_in_progress", False)
-                if not lock_status:  # Leader is not locked
-                    if database.authenticate_user(username, password):
-                        return jsonify({"message": "Authentication successful."}), 200
-                    return jsonify({"error": "Invalid username or password."}), 401
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to contact leader: {e}\n")
-        time.sleep(2)
-    return jsonify({"error": "Authentication request timed out"}), 503
-
-
-@app.route('/replicate', methods=['POST'])
-def handle_replication():
+    user = handlers.parse_user(data)
+    refused = refuse_read(data, "POST", "/authenticate_user", user["username"],
+                          failure="Failed to forward request to the leader", json=data)
+    return refused or respond(handlers.authenticate(user))
+
+@app.route('/auctions/active', methods=['GET'])
+def handle_active_auctions():
+    # Lists this shard's auctions only; the auction service merges every shard's pages.
+    params = request.args.to_dict()
+    cursor, limit = handlers.active_options(params)
+    refused = refuse_read(params, "GET", "/auctions/active", params=params)
+    return refused or respond(handlers.active_auctions(cursor, limit))
+
+@app.route('/auctions/search', methods=['GET'])
+def handle_auction_search():
+    # Searches this shard's auctions only, like /auctions/active.
+    params = request.args.to_dict()
+    field, value, limit = handlers.search_options(params)
+    refused = refuse_read(params, "GET", "/auctions/search", params=params)
+    return refused or respond(handlers.search_auctions(field, value, limit))
+
+@app.route('/bids/<auction_id>/top', methods=['GET'])
+def handle_top_bids(auction_id):
+    params = request.args.to_dict()
+    n = handlers.query_number(params, "n", 10, low=0, high=1000)
+    refused = refuse_read(params, "GET", f"/bids/{auction_id}/top", auction_id, params=params)
+    return refused or respond(handlers.top_bids(auction_id, n))
+
+@app.route('/bids/<auction_id>/rate', methods=['GET'])
+def handle_bid_rate(auction_id):
+    params = request.args.to_dict()
+    bucket = handlers.query_number(params, "bucket", 60.0, float, low=1)
+    since = handlers.query_number(params, "since", 0.0, float)
+    refused = refuse_read(params, "GET", f"/bids/{auction_id}/rate", auction_id, params=params)
+    return refused or respond(handlers.bid_rate(auction_id, bucket, since))
+
+@app.route('/bidders/<bidder>/bids', methods=['GET'])
+def handle_bidder_bids(bidder):
+    # Bids on this shard's auctions only, like /auctions/search.
+    params = request.args.to_dict()
+    limit = handlers.query_number(params, "limit", 100, low=0, high=1000)
+    refused = refuse_read(params, "GET", f"/bidders/{bidder}/bids", params=params)
+    return refused or respond(handlers.bidder_bids(bidder, limit))
+
+@app.route('/replicate_batch', methods=['POST'])
+def handle_replication_batch():
     data = request.json
-    key = data["key"]
-    value = data["value"]
-    db_type = data["db_type"]
-    leader_ip = leader_election.get_leader(start_time)
-    database.write_record(key, value, leader_ip, db_type)
-    return jsonify({"message": "Replication successful"}), 200
+    stale = handlers.stale_term(data)
+    if stale is not None:
+        return respond(stale)
+    try:
+        applied = database.apply_replicated(data["records"], data["prev_index"], data["prev_term"])
+    except LogConflict as e:
+        return respond(handlers.log_conflict(data, e))
+    return respond(handlers.replicated(data, applied))
 
 @app.route('/new_leader', methods=['POST'])
 def handle_new_leader():
-    new_leader_ip = request.json.get("leader_ip")
-    logger.info(f"New leader elected: {new_leader_ip}\n")
-    leader_election.leader_ip = new_leader_ip
-    return jsonify({"message": "Leader update received"}), 200
+    return respond(handlers.new_leader(request.json))
 
 @app.route('/heartbeat', methods=['POST'])
 def handle_heartbeat():
-    global last_heartbeat
-    last_heartbeat = time.time()
-    return jsonify({"message": "Heartbeat received"}), 200
+    return respond(handlers.heartbeat(request.json))
 
-@app.route('/lock_status', methods=['GET'])
-def handle_lock_status():
-    return jsonify({"write_in_progress": write_in_progress}), 200
+@app.route('/vote', methods=['POST'])
+def handle_vote():
+    return respond(handlers.vote(request.json))
 
 @app.route('/election', methods=['GET'])
 def handle_election():
-    logger.info("Election endpoint hit\n")
-    uptime = time.time() - start_time
-    return jsonify({"ip": SERVER_IP, "uptime": uptime}), 200
+    return respond(handlers.election())
 
 @app.route('/liveness', methods=['GET'])
 def liveness_probe():
-    uptime = time.time() - start_time
-    return jsonify({"message": "endpoint is live", "uptime": uptime}), 200
+    return respond(handlers.liveness())
+
+@app.route('/log', methods=['GET'])
+def handle_log_request():
+    after = handlers.query_number(request.args, "after", 0)
+    limit = handlers.query_number(request.args, "limit", 1000, low=1, high=10000)
+    return respond(handlers.log_page(after, limit))
+
+@app.route('/changes', methods=['GET'])
+def handle_changes_request():
+    """Long-poll this shard's committed bid mutations; see handlers.bid_changes. Any replica serves the feed."""
+    after = handlers.query_number(request.args, "after", 0)
+    limit = handlers.query_number(request.args, "limit", 1000, low=1, high=10000)
+    timeout = handlers.query_number(request.args, "timeout", 0.0, float, low=0, high=30)
+    tracing.long_poll()
+    return respond(handlers.bid_changes(after, limit, timeout))
+
+@app.route('/snapshot', methods=['GET'])
+def handle_snapshot_request():
+    return respond(handlers.snapshot_page(*handlers.snapshot_options(request.args)))
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+@app.route('/traces', methods=['GET'])
+def handle_traces():
+    return respond(handlers.traces(request.args))
+
+@app.route('/http_stats', methods=['GET'])
+def handle_http_stats():
+    return jsonify(peer_client.stats()), 200
 
 @app.route('/data', methods=['GET'])
 def handle_data_request():
-    return jsonify(database.get_all_records()), 200
+    return respond(handlers.all_records())
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=PORT)
@@ -0,0 +1,121 @@
+import glob
+import json
+import logging
+import os
+
+from segment import Segment, write_segment
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Closed auctions kept in the archive's log before they are sealed into a segment.
+ARCHIVE_SEGMENT_RECORDS = int(os.getenv("ARCHIVE_SEGMENT_RECORDS", "10000"))
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class AuctionArchive:
+    """Closed auctions, append-only and out of the hot tables.
+
+    Each closed auction is appended to archive.log along with the index of
+    the log entry that closed it. Once the log holds ARCHIVE_SEGMENT_RECORDS
+    auctions they are sealed into an immutable archive-*.seg segment, sorted
+    by id, and the log starts over; segments are memory-mapped and searched
+    in place, so memory holds only the unsealed auctions. Appends are not
+    fsynced: the database flushes the archive before it drops the log
+    entries that could redo them.
+    """
+
+    def __init__(self, directory=".", segment_records=ARCHIVE_SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.log_path = os.path.join(directory, "archive.log")
+        for temp_file in glob.glob(os.path.join(directory, "archive-*.seg.tmp")):
+            os.remove(temp_file)
+        # Named by the last index they hold, so the newest sorts last.
+        self.segments = [Segment(path) for path in sorted(glob.glob(os.path.join(directory, "archive-*.seg")))]
+        self.last_index = self.segments[-1].descriptor["last_index"] if self.segments else 0
+        self.recent = {}
+        self.first_index = None
+        if os.path.exists(self.log_path):
+            self._load_log()
+        self.file = open(self.log_path, 'a')
+
+    def _load_log(self):
+        with open(self.log_path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash can only be the last line.
+                    logger.error(f"Discarding corrupt tail of archive {self.log_path}\n")
+                    break
+                # Records already sealed remain if a crash hit before the log was cleared.
+                if record["index"] > (self.segments[-1].descriptor["last_index"] if self.segments else 0):
+                    self._note(record)
+
+    def _note(self, record):
+        self.recent[record["key"]] = record
+        self.last_index = max(self.last_index, record["index"])
+        if self.first_index is None:
+            self.first_index = record["index"]
+
+    def append(self, records):
+        """Archive {"index", "key", "value"} records. Caller holds the database lock."""
+        self.file.write("".join(_encode(record) + "\n" for record in records))
+        self.file.flush()
+        for record in records:
+            self._note(record)
+        if len(self.recent) >= self.segment_records:
+            self._seal()
+
+    def _seal(self):
+        path = os.path.join(self.directory, f"archive-{self.last_index:020d}.seg")
+        items = ((key.encode(), _encode({"index": record["index"], "value": record["value"]}).encode())
+                 for key, record in sorted(self.recent.items()))
+        write_segment(path, {"auctions": items}, {"first_index": self.first_index, "last_index": self.last_index})
+        self.segments.append(Segment(path))
+        self.file.close()
+        self.file = open(self.log_path, 'w')
+        os.fsync(self.file.fileno())
+        self.recent, self.first_index = {}, None
+        logger.info(f"Sealed archive segment {path}\n")
+
+    def flush(self):
+        """Make every appended record durable."""
+        os.fsync(self.file.fileno())
+
+    def get(self, key):
+        """The closed auction archived under `key`, or None."""
+        record = self.recent.get(key)
+        if record is not None:
+            return record["value"]
+        for segment in reversed(self.segments):
+            encoded = segment.get("auctions", key.encode())
+            if encoded is not None:
+                return json.loads(encoded)["value"]
+        return None
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return sum(segment.count("auctions") for segment in self.segments) + len(self.recent)
+
+    def records_after(self, index):
+        """The archived records closed after log index `index`, oldest first."""
+        records = []
+        for segment in self.segments:
+            if segment.descriptor["last_index"] > index:
+                for key, encoded in segment.items("auctions"):
+                    record = json.loads(encoded)
+                    if record["index"] > index:
+                        records.append({"index": record["index"], "key": key.decode(), "value": record["value"]})
+        records += [record for record in self.recent.values() if record["index"] > index]
+        records.sort(key=lambda record: record["index"])
+        return records
+
+    def close(self):
+        self.file.close()
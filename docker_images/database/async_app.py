@@ -0,0 +1,485 @@
+"""The database server's endpoints on a single asyncio event loop.
+
+Run with `python async_app.py` in place of `python app.py`. Forwarding to
+the leader, replication, heartbeats and elections are coroutines sharing
+one AsyncHttpClient, so waiting on a peer or on a quorum does not hold a
+thread. Log appends still run on the group-commit thread, and other disk
+work runs in the default executor. What each endpoint answers is decided
+in handlers, as for the Flask server.
+"""
+from aiohttp import web
+from leader_election import AsyncLeaderElection
+from database import (Database, HEARTBEATS_SENT, PEER_CALL_POLICIES, PEERS, READ_WAIT, REPLICATION_QUORUM, SHARDS,
+                      SHARD_ID, LogConflict, peer_url, register_node_metrics)
+from http_client import HttpClient
+from async_http_client import AsyncHttpClient
+from shard_router import AsyncShardRouter
+from metrics import CONTENT_TYPE, REGISTRY, aiohttp_middleware
+import tracing
+import handlers
+from handlers import (SERVER_ID, PORT, heartbeat_interval, phi_threshold, heartbeat_pause, election_timeout,
+                      version_wait_timeout, group_commit_window, snapshot_entries)
+from group_commit import GroupCommitter
+from replication import AsyncFollowerChannel, QuorumTimeout, Replicator
+from failure_detector import PhiAccrualDetector
+import aiohttp
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+import os
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+# Created in main(), once the event loop is running.
+loop = None
+peer_client = None
+router = None
+leader_election = None
+database = None
+group_commit = None
+bid_commit = None
+
+# Reads waiting for an index to be applied, as a heap of (index, sequence, future).
+index_waiters = []
+waiter_sequence = itertools.count()
+
+routes = web.RouteTableDef()
+
+
+async def run_blocking(function, *args):
+    # In the request's context, so the work is traced as part of it.
+    return await loop.run_in_executor(None, contextvars.copy_context().run, function, *args)
+
+def resynchronize(leader_id, reset=False):
+    loop.run_in_executor(None, database.synchronize_with_leader, leader_id, reset)
+
+async def wait_for_quorum(index):
+    """Wait until a quorum holds `index`; raise QuorumTimeout otherwise."""
+    committed = loop.create_future()
+
+    def resolve():
+        if not committed.done():
+            committed.set_result(None)
+
+    database.replicator.on_quorum(index, lambda: loop.call_soon_threadsafe(resolve))
+    try:
+        with tracing.span("replication.wait_for_quorum", index=index, waits_on="replicate"):
+            await asyncio.wait_for(committed, database.replicator.timeout)
+    except asyncio.TimeoutError:
+        raise QuorumTimeout(f"Entry {index} not acknowledged by {database.replicator.quorum} nodes in time")
+
+def resolve_applied():
+    """Resolve the futures of reads waiting for indexes this node has now applied."""
+    while index_waiters and index_waiters[0][0] <= database.last_index:
+        applied = heapq.heappop(index_waiters)[2]
+        if not applied.done():
+            applied.set_result(None)
+
+async def wait_for_index(index, timeout):
+    """Wait until this node has applied `index`; True if it has."""
+    if database.last_index >= index:
+        return True
+    start = time.monotonic()
+    applied = loop.create_future()
+    waiter = (index, next(waiter_sequence), applied)
+    heapq.heappush(index_waiters, waiter)
+    # `index` may have been applied since the check above, before the listener could see this waiter.
+    resolve_applied()
+    try:
+        with tracing.span("database.wait_for_index", index=index):
+            await asyncio.wait_for(applied, timeout)
+    except asyncio.TimeoutError:
+        READ_WAIT.observe(time.monotonic() - start, "timeout")
+        return False
+    finally:
+        if applied.cancelled() and waiter in index_waiters:
+            # Timed out, or its request was cancelled, before `index` was applied.
+            index_waiters.remove(waiter)
+            heapq.heapify(index_waiters)
+    READ_WAIT.observe(time.monotonic() - start, "applied")
+    return True
+
+@web.middleware
+async def bad_request_middleware(request, handler):
+    """Answer a handlers.BadRequest with 400, as the Flask server's error handler does."""
+    try:
+        return await handler(request)
+    except handlers.BadRequest as e:
+        body, status = handlers.bad_request(e)
+        return web.json_response(body, status=status)
+
+async def request_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise handlers.BadRequest("Request body must be JSON")
+
+async def forward(target):
+    """Relay a handlers.Forward to the node that answers it, and return its (body, status)."""
+    try:
+        if target.shard is not None:
+            response = await router.request(target.method, target.shard, target.path, "forward",
+                                            leader=target.to_leader, **target.kwargs)
+        else:
+            response = await peer_client.request(target.method, f"{peer_url(target.leader_id)}{target.path}",
+                                                 "forward", **target.kwargs)
+            if target.check:
+                response.raise_for_status()
+        return response.json(), response.status_code
+    except (aiohttp.ClientError, ValueError) as e:
+        return target.failed(e)
+
+async def respond(answer):
+    """The response to a handler's (body, status), relaying it first if it is a handlers.Forward."""
+    if isinstance(answer, handlers.Forward):
+        answer = await forward(answer)
+    body, status = answer
+    return web.json_response(body, status=status)
+
+async def quorum_failure(index, what):
+    """None once a quorum of replicas holds `index`, else the answer to give instead."""
+    try:
+        await wait_for_quorum(index)
+    except QuorumTimeout as e:
+        return handlers.not_acknowledged(what, e)
+    return None
+
+async def refuse_read(options, method, path, key=None, failure=handlers.READ_FORWARD_FAILED, **kwargs):
+    """None if this node answers a read, else the response relaying or refusing it; see app.refuse_read."""
+    answer = None if key is None else handlers.shard_read_target(method, path, key, **kwargs)
+    if answer is None:
+        consistency, min_version, max_staleness = handlers.read_options(options)
+        if await wait_for_index(min_version, version_wait_timeout) and \
+                handlers.may_read_locally(consistency, max_staleness):
+            return None
+        answer = handlers.refused_read(consistency, method, path, failure, **kwargs)
+    return await respond(answer)
+
+async def write_across_shards(records_by_shard):
+    """Send each shard its part of a batch. The parts commit independently, not atomically."""
+    shards = list(records_by_shard)
+    answers = await asyncio.gather(*(forward(handlers.Forward("POST", "/write_batch", shard=shard,
+                                                              json={"records": records_by_shard[shard]}))
+                                     for shard in shards))
+    return await respond(handlers.batch_written_across(records_by_shard, dict(zip(shards, answers))))
+
+async def send_heartbeat(peer):
+    try:
+        sent_at = time.monotonic()
+        response = await peer_client.post(f"{peer_url(peer)}/heartbeat", "heartbeat",
+                                          json=database.replicator.message(database.last_index))
+        if response.status_code == 200:
+            database.replicator.record_contact(peer, sent_at)
+            HEARTBEATS_SENT.inc("ok")
+            logger.debug(f"Sent heartbeat to {peer}\n")
+        elif response.status_code == 409:
+            HEARTBEATS_SENT.inc("stale_term")
+            leader_election.observe_term(response.json()["term"])
+    except aiohttp.ClientError as e:
+        HEARTBEATS_SENT.inc("error")
+        logger.error(f"Error while sending heartbeat to peer {peer}: {e}\n")
+
+pending_heartbeats = set()
+
+async def heartbeat_loop():
+    while True:
+        if leader_election.is_leader():  # Only leader sends heartbeat
+            # Replication traffic counts as a heartbeat, so busy followers get none.
+            for peer in database.replicator.idle_followers(heartbeat_interval):
+                task = loop.create_task(send_heartbeat(peer))
+                # The loop only keeps weak references to tasks.
+                pending_heartbeats.add(task)
+                task.add_done_callback(pending_heartbeats.discard)
+        await asyncio.sleep(heartbeat_interval / 10)
+
+async def monitor_leader():
+    while True:
+        if leader_election.election_due():
+            logger.info("No leader heard from, starting election...\n")
+            await leader_election.start_election()
+        await asyncio.sleep(0.05)
+
+async def snapshot_loop():
+    while True:
+        await asyncio.sleep(1)
+        if database.entries_since_snapshot >= snapshot_entries:
+            try:
+                await run_blocking(database.snapshot)
+            except OSError as e:
+                logger.error(f"Failed to take a snapshot: {e}\n")
+
+async def closer_loop():
+    # The leader closes auctions as they expire; followers apply its archive entries.
+    while True:
+        await asyncio.sleep(1)
+        try:
+            while leader_election.is_leader() and \
+                    await run_blocking(database.close_expired_auctions, SERVER_ID) is not None:
+                pass
+        except OSError as e:
+            logger.error(f"Failed to archive closed auctions: {e}\n")
+
+@routes.post('/write')
+async def handle_write(request):
+    record = handlers.parse_record(await request_json(request))
+    target = handlers.write_target("POST", "/write", record["key"], check=True, json=record)
+    if target is not None:
+        return await respond(target)
+    index = await asyncio.wrap_future(group_commit.submit(record))
+    return await respond(await quorum_failure(index, f"Write {record['key']}") or handlers.written(record, index))
+
+@routes.post('/write_batch')
+async def handle_write_batch(request):
+    records = handlers.parse_records(await request_json(request))
+    records_by_shard = handlers.split_batch(records)
+    if records_by_shard.keys() - {SHARD_ID}:
+        return await write_across_shards(records_by_shard)
+    target = handlers.write_target("POST", "/write_batch", check=True, json={"records": records})
+    if target is not None:
+        return await respond(target)
+    index = await run_blocking(database.write_batch, records, SERVER_ID)
+    return await respond(await quorum_failure(index, "Batch write") or handlers.batch_written(records, index))
+
+@routes.post('/bid')
+async def handle_bid(request):
+    bid = handlers.parse_bid(await request_json(request))
+    target = handlers.write_target("POST", "/bid", bid["auction_id"], failure="Failed to forward bid to the leader",
+                                   json=bid)
+    if target is not None:
+        return await respond(target)
+    outcome, auction, index = await asyncio.wrap_future(bid_commit.submit(bid))
+    answer = handlers.bid_placed(outcome, auction, index)
+    if outcome == "accepted":
+        answer = await quorum_failure(index, f"Bid on {bid['auction_id']}") or answer
+    return await respond(answer)
+
+@routes.post('/create')
+async def handle_create(request):
+    record = handlers.parse_record(await request_json(request))
+    target = handlers.write_target("POST", "/create", record["key"], json=record)
+    if target is not None:
+        return await respond(target)
+    index = await run_blocking(database.create_record, record["key"], record["value"], SERVER_ID, record["db_type"])
+    answer = handlers.created(record, index)
+    if index is not None:
+        answer = await quorum_failure(index, f"Create {record['key']}") or answer
+    return await respond(answer)
+
+@routes.post('/allocate_ids')
+async def handle_allocate_ids(request):
+    block = handlers.parse_block(await request_json(request))
+    target = handlers.write_target("POST", "/allocate_ids", block["name"], json=block)
+    if target is not None:
+        return await respond(target)
+    start, index = await run_blocking(database.allocate_ids, block["name"], block["count"], SERVER_ID)
+    return await respond(await quorum_failure(index, f"ID allocation for {block['name']}") or
+                         handlers.ids_allocated(block, start, index))
+
+@routes.post('/add_user')
+async def add_user(request):
+    user = handlers.parse_user(await request_json(request))
+    target = handlers.write_target("POST", "/add_user", user["username"],
+                                   failure="Failed to forward request to the leader", check=True, json=user)
+    if target is not None:
+        return await respond(target)
+    index = await run_blocking(database.add_user, user["username"], user["password"], SERVER_ID)
+    answer = handlers.user_added(user, index)
+    if index:
+        answer = await quorum_failure(index, f"User {user['username']}") or answer
+    return await respond(answer)
+
+@routes.get('/read/{db_type}/{key}')
+async def handle_read(request):
+    db_type = request.match_info["db_type"]
+    key = request.match_info["key"]
+    params = dict(request.query)
+    refused = await refuse_read(params, "GET", f"/read/{db_type}/{key}", key, params=params)
+    return refused or await respond(handlers.read_record(db_type, key))
+
+@routes.get('/archive/{auction_id}')
+async def handle_archive_read(request):
+    auction_id = request.match_info["auction_id"]
+    target = handlers.shard_read_target("GET", f"/archive/{auction_id}", auction_id)
+    return await respond(target or handlers.read_archived(auction_id))
+
+@routes.post('/authenticate_user')
+async def authenticate_user(request):
+    data = await request_json(request)
+    user = handlers.parse_user(data)
+    refused = await refuse_read(data, "POST", "/authenticate_user", user["username"],
+                                failure="Failed to forward request to the leader", json=data)
+    return refused or await respond(handlers.authenticate(user))
+
+@routes.get('/auctions/active')
+async def handle_active_auctions(request):
+    # Lists this shard's auctions only; the auction service merges every shard's pages.
+    params = dict(request.query)
+    cursor, limit = handlers.active_options(params)
+    refused = await refuse_read(params, "GET", "/auctions/active", params=params)
+    if refused is not None:
+        return refused
+    if not database.auctions_indexed.is_set():
+        # Only right after startup, while stored auctions are still being indexed.
+        await run_blocking(database.auctions_indexed.wait)
+    return await respond(handlers.active_auctions(cursor, limit))
+
+@routes.get('/auctions/search')
+async def handle_auction_search(request):
+    # Searches this shard's auctions only, like /auctions/active.
+    params = dict(request.query)
+    field, value, limit = handlers.search_options(params)
+    refused = await refuse_read(params, "GET", "/auctions/search", params=params)
+    return refused or await respond(await run_blocking(handlers.search_auctions, field, value, limit))
+
+@routes.get('/bids/{auction_id}/top')
+async def handle_top_bids(request):
+    auction_id = request.match_info["auction_id"]
+    params = dict(request.query)
+    n = handlers.query_number(params, "n", 10, low=0, high=1000)
+    refused = await refuse_read(params, "GET", f"/bids/{auction_id}/top", auction_id, params=params)
+    return refused or await respond(handlers.top_bids(auction_id, n))
+
+@routes.get('/bids/{auction_id}/rate')
+async def handle_bid_rate(request):
+    auction_id = request.match_info["auction_id"]
+    params = dict(request.query)
+    bucket = handlers.query_number(params, "bucket", 60.0, float, low=1)
+    since = handlers.query_number(params, "since", 0.0, float)
+    refused = await refuse_read(params, "GET", f"/bids/{auction_id}/rate", auction_id, params=params)
+    return refused or await respond(handlers.bid_rate(auction_id, bucket, since))
+
+@routes.get('/bidders/{bidder}/bids')
+async def handle_bidder_bids(request):
+    # Bids on this shard's auctions only, like /auctions/search.
+    bidder = request.match_info["bidder"]
+    params = dict(request.query)
+    limit = handlers.query_number(params, "limit", 100, low=0, high=1000)
+    refused = await refuse_read(params, "GET", f"/bidders/{bidder}/bids", params=params)
+    return refused or await respond(handlers.bidder_bids(bidder, limit))
+
+@routes.post('/replicate_batch')
+async def handle_replication_batch(request):
+    data = await request.json()
+    stale = handlers.stale_term(data)
+    if stale is not None:
+        return await respond(stale)
+    try:
+        applied = await run_blocking(database.apply_replicated, data["records"], data["prev_index"], data["prev_term"])
+    except LogConflict as e:
+        return await respond(handlers.log_conflict(data, e))
+    return await respond(handlers.replicated(data, applied))
+
+@routes.post('/new_leader')
+async def handle_new_leader(request):
+    return await respond(handlers.new_leader(await request.json()))
+
+@routes.post('/heartbeat')
+async def handle_heartbeat(request):
+    return await respond(handlers.heartbeat(await request.json()))
+
+@routes.post('/vote')
+async def handle_vote(request):
+    return await respond(handlers.vote(await request.json()))
+
+@routes.get('/election')
+async def handle_election(request):
+    return await respond(handlers.election())
+
+@routes.get('/liveness')
+async def liveness_probe(request):
+    return await respond(handlers.liveness())
+
+@routes.get('/log')
+async def handle_log_request(request):
+    after = handlers.query_number(request.query, "after", 0)
+    limit = handlers.query_number(request.query, "limit", 1000, low=1, high=10000)
+    return await respond(await run_blocking(handlers.log_page, after, limit))
+
+@routes.get('/changes')
+async def handle_changes_request(request):
+    after = handlers.query_number(request.query, "after", 0)
+    limit = handlers.query_number(request.query, "limit", 1000, low=1, high=10000)
+    timeout = handlers.query_number(request.query, "timeout", 0.0, float, low=0, high=30)
+    tracing.long_poll()
+    # Waits on the event loop rather than in an executor thread, which long polls would use up.
+    changed = asyncio.Event()
+    listener = lambda: loop.call_soon_threadsafe(changed.set)
+    database.bid_changes.listeners.add(listener)
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            changed.clear()
+            body, status = handlers.bid_changes(after, limit)
+            if status != 200 or body["changes"] or loop.time() >= deadline:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        database.bid_changes.listeners.discard(listener)
+    return await respond((body, status))
+
+@routes.get('/snapshot')
+async def handle_snapshot_request(request):
+    return await respond(await run_blocking(handlers.snapshot_page, *handlers.snapshot_options(request.query)))
+
+@routes.get('/metrics')
+async def handle_metrics(request):
+    return web.Response(text=REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
+@routes.get('/traces')
+async def handle_traces(request):
+    return await respond(handlers.traces(request.query))
+
+@routes.get('/http_stats')
+async def handle_http_stats(request):
+    return web.json_response(peer_client.stats())
+
+@routes.get('/data')
+async def handle_data_request(request):
+    return await respond(await run_blocking(handlers.all_records))
+
+
+async def main():
+    global loop, peer_client, router, leader_election, database, group_commit, bid_commit
+    loop = asyncio.get_running_loop()
+    peer_client = AsyncHttpClient(PEER_CALL_POLICIES)
+    router = AsyncShardRouter(SHARDS, peer_client, peer_url)
+    # Catch-up is rare and runs in the executor, so it keeps the blocking client.
+    replicator = Replicator(PEERS, SERVER_ID, peer_url, peer_client, quorum=REPLICATION_QUORUM,
+                            channel=AsyncFollowerChannel)
+    database = Database(PEERS, client=HttpClient(PEER_CALL_POLICIES), replicator=replicator)
+    leader_election = AsyncLeaderElection(PEERS, SERVER_ID, peer_url, peer_client, database.log_position,
+                                          on_change=handlers.leadership_changed, election_timeout=election_timeout,
+                                          detector=PhiAccrualDetector(heartbeat_interval, phi_threshold,
+                                                                      acceptable_pause=heartbeat_pause))
+    handlers.configure(database, leader_election, router, resynchronize)
+    # Appends happen on other threads; only wake the loop when a read is waiting.
+    database.applied_listeners.add(lambda: index_waiters and loop.call_soon_threadsafe(resolve_applied))
+    group_commit = GroupCommitter(handlers.flush_writes, window=group_commit_window)
+    bid_commit = GroupCommitter(handlers.flush_bids, window=group_commit_window)
+
+    register_node_metrics(database, leader_election)
+
+    app = web.Application(client_max_size=64 * 1024 ** 2,
+                          middlewares=[tracing.aiohttp_middleware(), aiohttp_middleware(), bad_request_middleware])
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT, backlog=4096).start()
+    # The first leader is elected by monitor_leader once peers can be reached.
+    try:
+        await asyncio.gather(heartbeat_loop(), monitor_leader(), snapshot_loop(), closer_loop())
+    finally:
+        await runner.cleanup()
+        await peer_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import heapq
+import threading
+from bisect import bisect_right, insort
+from datetime import datetime, timedelta
+
+AUCTION_DURATION = timedelta(days=1)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Sorts after every auction id, for positioning "after all auctions expiring at t".
+MAX_ID = "\U0010ffff"
+
+
+def expiry_time(auction):
+    """Unix time at which an auction stops taking bids, or None if the record is not an auction."""
+    try:
+        created = auction['created_time']
+        # fromisoformat is far faster than strptime; checking the shape first
+        # keeps it to TIME_FORMAT alone.
+        if len(created) != 19 or created[10] != ' ':
+            return None
+        created = datetime.fromisoformat(created)
+    except (TypeError, KeyError, ValueError):
+        return None
+    return (created + AUCTION_DURATION).timestamp()
+
+
+class ExpiryIndex:
+    """Auction ids ordered by expiry time, so live auctions can be paged without a scan."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.expiries = {}
+
+    def update(self, auction_id, auction):
+        expires = expiry_time(auction)
+        with self.lock:
+            previous = self.expiries.get(auction_id)
+            if previous == expires:
+                return
+            if previous is not None:
+                self._remove(auction_id, previous)
+            if expires is not None:
+                insort(self.keys, (expires, auction_id))
+                self.expiries[auction_id] = expires
+
+    def add_many(self, entries):
+        """Add sorted (expiry, auction_id) pairs for auctions not yet in the index, with one merge."""
+        with self.lock:
+            self.keys = list(heapq.merge(self.keys, entries))
+            self.expiries.update((auction_id, expires) for expires, auction_id in entries)
+
+    def remove(self, auction_id):
+        with self.lock:
+            previous = self.expiries.get(auction_id)
+            if previous is not None:
+                self._remove(auction_id, previous)
+
+    def _remove(self, auction_id, expires):
+        position = bisect_right(self.keys, (expires, auction_id)) - 1
+        if position >= 0 and self.keys[position] == (expires, auction_id):
+            del self.keys[position]
+        del self.expiries[auction_id]
+
+    def active(self, now, cursor=None, limit=20):
+        """Return ids of up to `limit` auctions live at `now`, soonest-ending first.
+
+        `cursor` is the (expiry, id) of the last auction on the previous page.
+        Returns the ids and the cursor for the next page, or None at the end.
+        """
+        with self.lock:
+            # Expired auctions stay until they are closed; skip past them.
+            start = bisect_right(self.keys, max(cursor, (now, MAX_ID)) if cursor else (now, MAX_ID))
+            page = self.keys[start:start + limit]
+            more = start + limit < len(self.keys)
+        return [auction_id for _, auction_id in page], (page[-1] if more and page else None)
+
+    def expired(self, now, limit):
+        """(expiry, id) of up to `limit` auctions that ended by `now`, earliest first."""
+        with self.lock:
+            return self.keys[:min(limit, bisect_right(self.keys, (now, MAX_ID)))]
+
+    def __len__(self):
+        return len(self.keys)
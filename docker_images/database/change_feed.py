@@ -0,0 +1,95 @@
+import collections
+import os
+import threading
+
+# Bid mutations kept for subscribers; one further behind has to start over from a fresh read.
+CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "10000"))
+
+
+class FeedTruncated(Exception):
+    """The requested changes are no longer in the feed; re-read the records instead."""
+
+
+class ChangeFeed:
+    """Recent committed mutations of one table, for subscribers polling from a log index.
+
+    The database publishes every applied entry of the table and marks
+    entries committed as it learns of them, so subscribers never see a
+    change that could still be rolled back.
+    """
+
+    def __init__(self, db_type, start_index=0, size=CHANGE_FEED_SIZE):
+        self.db_type = db_type
+        self.changes = collections.deque(maxlen=size)
+        # Subscribers need every change after `start`, or have to start over.
+        self.start = start_index
+        self.published = start_index
+        self.committed = start_index
+        self.condition = threading.Condition()
+        # Called whenever new changes may be readable, for waiters that cannot block a thread.
+        self.listeners = set()
+
+    def publish(self, entries):
+        """Add applied log entries. Caller holds the database lock."""
+        with self.condition:
+            for entry in entries:
+                if entry.get("op") == "snapshot":
+                    # Installing a snapshot replaced the data wholesale.
+                    self.changes.clear()
+                    self.start = self.published = self.committed = entry["index"]
+                elif entry.get("db_type") == self.db_type:
+                    if len(self.changes) == self.changes.maxlen:
+                        self.start = self.changes[0]["index"]
+                    if entry.get("op") == "bid":
+                        # Bids are logged without the rest of the auction.
+                        value = {"highest_bid": entry["amount"], "highest_bidder": entry["bidder"]}
+                    else:
+                        value = entry["value"] if entry.get("op", "put") != "delete" else None
+                    self.changes.append({"index": entry["index"], "op": entry.get("op", "put"),
+                                         "key": entry["key"], "value": value})
+            if entries:
+                self.published = entries[-1]["index"]
+            self._notify()
+
+    def commit(self, index):
+        """Mark the entries up to `index` committed."""
+        with self.condition:
+            if index > self.committed:
+                self.committed = index
+                self._notify()
+
+    def _notify(self):
+        self.condition.notify_all()
+        for listener in list(self.listeners):
+            listener()
+
+    def position(self):
+        """The index a new subscriber, having just read the records, continues from."""
+        with self.condition:
+            return min(self.committed, self.published)
+
+    def read(self, after, limit=1000, timeout=0):
+        """Committed changes after log index `after`, waiting up to `timeout` seconds for one.
+
+        Returns the changes and the index subscribers should continue
+        from; raises FeedTruncated if changes after `after` were dropped.
+        """
+        with self.condition:
+            if after < self.start:
+                raise FeedTruncated(f"Changes after index {after} are no longer kept, the feed starts at {self.start}")
+            self.condition.wait_for(lambda: min(self.committed, self.published) > after or after < self.start,
+                                    timeout)
+            if after < self.start:
+                raise FeedTruncated(f"Changes after index {after} are no longer kept, the feed starts at {self.start}")
+            committed = min(self.committed, self.published)
+            changes = []
+            for change in reversed(self.changes):
+                if change["index"] <= after:
+                    break
+                if change["index"] <= committed:
+                    changes.append(change)
+            changes.reverse()
+            if len(changes) > limit:
+                changes = changes[:limit]
+                committed = changes[-1]["index"]
+        return changes, max(after, committed)
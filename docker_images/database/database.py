@@ -1,124 +1,681 @@
 import threading
 import requests
+from bisect import bisect_right
 import logging
 import os
-import socket
-import json
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from wal import WriteAheadLog
+from replication import Replicator
+from http_client import HttpClient, CallPolicy
+from archive import AuctionArchive
+from bid_ledger import BidLedger
+from change_feed import ChangeFeed
+from auction_index import ExpiryIndex, TIME_FORMAT, expiry_time
+from storage import open_store
+from shard_router import parse_shards
+from metrics import REGISTRY, TimedLock
+import tracing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SERVER_ID = os.getenv("MY_POD_NAME")
-PEERS = os.getenv("PEERS").split(",")
-SERVER_IP = socket.gethostbyname(socket.gethostname())
+# PEERS lists every database node, with the replicas of each shard separated
+# by ";". Each shard elects its own leader among its replicas.
+SHARDS = parse_shards(os.getenv("PEERS"))
+SHARD_ID = next(shard for shard, replicas in enumerate(SHARDS) if SERVER_ID in replicas)
+PEERS = SHARDS[SHARD_ID]
+# "sequences" holds the next free value of each ID sequence handed out by allocate_ids.
+DB_TYPES = ("users", "bids", "sequences")
+# The tables clients write; sequences only changes through allocate_ids, so
+# no write can move a sequence back over IDs already handed out.
+WRITABLE_DB_TYPES = ("users", "bids")
+REPLICATION_QUORUM = int(os.getenv("REPLICATION_QUORUM", "0")) or None
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "snapshot")
+# Entries kept in the log behind a snapshot, so followers a little behind
+# can catch up from the log instead of a snapshot transfer.
+LOG_RETAIN_ENTRIES = int(os.getenv("LOG_RETAIN_ENTRIES", "10000"))
+CATCH_UP_CHUNK = 1000
+# Expired auctions closed and archived per log entry batch.
+CLOSE_BATCH = int(os.getenv("CLOSE_BATCH", "500"))
+SNAPSHOT_TRANSFER_TTL = 60
+# Share of written records logged, at debug level.
+RECORD_LOG_SAMPLE = float(os.getenv("RECORD_LOG_SAMPLE", "0.01"))
+# Timeouts and retries for each kind of call between database servers.
+PEER_CALL_POLICIES = {
+    "heartbeat": CallPolicy(timeout=(0.5, 1)),
+    "election": CallPolicy(timeout=(0.5, 1)),
+    "leader_broadcast": CallPolicy(timeout=(0.5, 1), retries=1),
+    "forward": CallPolicy(timeout=(1, 2), retries=1),
+    "discover": CallPolicy(timeout=(0.5, 1), retries=1),
+    "replication": CallPolicy(timeout=(1, 2)),
+    "catch_up": CallPolicy(timeout=(1, 5), retries=2),
+}
+
+# Where each peer in PEERS is reached; {peer} is replaced by its node ID.
+PEER_URL_TEMPLATE = os.getenv("PEER_URL_TEMPLATE", "http://{peer}.database-server.database.svc.cluster.local:5001")
+
+LOCK_WAIT = REGISTRY.histogram("database_lock_wait_seconds", "Time spent waiting to acquire the database lock.")
+STORAGE_IO = REGISTRY.histogram("database_storage_io_seconds", "Time spent on log, storage engine and archive file I/O.",
+                                ("operation",))
+READ_WAIT = REGISTRY.histogram("database_read_wait_seconds",
+                               "Time reads spent waiting for this node to apply the version they asked for.",
+                               ("outcome",))
+@contextmanager
+def storage_io(operation):
+    """Time a file operation in STORAGE_IO and in the current trace."""
+    with tracing.span(f"storage.{operation}"), STORAGE_IO.time(operation):
+        yield
+
+HEARTBEATS_SENT = REGISTRY.counter("heartbeats_sent_total", "Heartbeats the leader sent, by outcome.", ("outcome",))
+HEARTBEATS_RECEIVED = REGISTRY.counter("heartbeats_received_total", "Heartbeats received, by outcome.", ("outcome",))
+
+def register_node_metrics(database, leader_election):
+    """Export this node's log position, term and, on the leader, each follower's replication lag."""
+    def lag(part):
+        if not leader_election.is_leader():
+            return {}
+        return {(peer,): progress[part] for peer, progress in database.replicator.lag().items()}
+
+    REGISTRY.gauge("database_last_index", "Index of the last entry in this node's log.",
+                   collect=lambda: {(): database.last_index})
+    REGISTRY.gauge("database_commit_index", "Highest log index this node knows to be committed.",
+                   collect=lambda: {(): database.replicator.commit_index() if leader_election.is_leader()
+                                    else database.leader_commit_index})
+    REGISTRY.gauge("election_term", "This node's current election term.", collect=lambda: {(): leader_election.term})
+    REGISTRY.gauge("election_is_leader", "1 while this node is its shard's leader.",
+                   collect=lambda: {(): int(leader_election.is_leader())})
+    REGISTRY.gauge("replication_lag_entries", "Log entries each follower is behind the leader.", ("follower",),
+                   collect=lambda: lag(0))
+    REGISTRY.gauge("replication_contact_age_seconds", "Seconds since each follower last answered the leader.",
+                   ("follower",), collect=lambda: lag(1))
+
+def peer_url(peer):
+    return PEER_URL_TEMPLATE.format(peer=peer)
+
+
+class LogConflict(Exception):
+    """This node's log disagrees with the leader's and has to be replaced by a snapshot."""
+
+def check_record(record):
+    """Raise ValueError unless `record` names a known table and a string key, which applying it needs."""
+    if record.get("db_type") not in DB_TYPES:
+        raise ValueError(f"Invalid database type: {record.get('db_type')}")
+    if not isinstance(record.get("key"), str):
+        raise ValueError(f"Invalid key: {record.get('key')!r}")
+
+def check_write(record):
+    """check_record, and raise ValueError for a table clients may not write."""
+    check_record(record)
+    if record["db_type"] not in WRITABLE_DB_TYPES:
+        raise ValueError(f"{record['db_type']} records cannot be written directly")
 
 class Database:
-    def __init__(self, peers, user_file="users.json", bid_file="bids.json"):
-        self.user_file = user_file
-        self.bid_file = bid_file
-        self.lock = threading.Lock()
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
+    def __init__(self, peers, store=None, wal_file="database.wal", client=None, replicator=None, archive=None,
+                 ledger=None):
+        self.lock = TimedLock(LOCK_WAIT, "database.lock_wait")
+        # The in-memory dicts serve reads. Every mutation goes to the
+        # write-ahead log first, then to them and to the storage engine, which
+        # is current up to store_offset in the log.
+        self.store = store or open_store(STORAGE_ENGINE, db_types=DB_TYPES)
+        with storage_io("load"):
+            tables, store_offset = self.store.load()
+        self.users = tables["users"]
+        self.bids = tables["bids"]
+        self.sequences = tables["sequences"]
+        # Closed auctions are moved out of bids into the archive, kept next to the log.
+        self.archive = archive or AuctionArchive(os.path.dirname(os.path.abspath(wal_file)))
+        # Every accepted bid, for bid history queries; the log carries bids as deltas.
+        self.ledger = ledger or BidLedger(os.path.dirname(os.path.abspath(wal_file)))
+        # Filled in by _index_auctions once the node is up; until then
+        # auctions written since startup are noted in indexing_touched.
+        self.active_auctions = ExpiryIndex()
+        self.auctions_indexed = threading.Event()
+        self.indexing_touched = set()
+        self.entries_since_snapshot = 0
+        self.snapshot_lock = threading.Lock()
         self.peers = peers
+        self.last_index = 0
+        # The term of each log entry, stored as the first index of each run of equal terms.
+        self.term = 0
+        self.term_indexes = []
+        self.terms = []
+        self.applied = threading.Condition()
+        # Called after every append, for waiters on an index that cannot block a thread.
+        self.applied_listeners = set()
+        self.leader_commit_index = 0
+        self.leader_contact = float("-inf")
+        self.wal = WriteAheadLog(wal_file)
+        unstored, replayed_bids = [], []
+        for offset, entry in self.wal.replay():
+            if offset < store_offset:
+                # Already in the stored tables; only its place in the log is needed.
+                self._note_position(entry)
+                if entry.get("op") == "archive" and entry["index"] > self.archive.last_index:
+                    self._archive([entry])
+            else:
+                try:
+                    if "key" in entry:
+                        check_record(entry)
+                except ValueError as e:
+                    # Logged before writes were checked; applying it would fail on every start.
+                    logger.error(f"Skipping log entry {entry['index']} that cannot be applied: {e}\n")
+                    self._note_position(entry)
+                    continue
+                self._apply(entry)
+                unstored.append(entry)
+            if entry.get("op") == "bid":
+                # Bids the ledger already holds are skipped.
+                replayed_bids.append(entry)
+        self.ledger.append(replayed_bids)
+        if unstored:
+            self.store.apply(unstored, self.wal.end_offset)
+            self.entries_since_snapshot = len(unstored)
+        # Committed bid mutations from here on, for /changes subscribers.
+        self.bid_changes = ChangeFeed("bids", self.last_index)
+        self.client = client or HttpClient(PEER_CALL_POLICIES)
+        self.replicator = replicator or Replicator(peers, SERVER_ID, peer_url, self.client, quorum=REPLICATION_QUORUM)
+        self.replicator.term_at = self.term_at
+        self.sync_lock = threading.Lock()
+        self.transfer_snapshots = {}
+        threading.Thread(target=self._index_auctions, daemon=True).start()
+
+    def _index_auctions(self):
+        """Add the stored auctions to active_auctions, in the background so a restart does not wait for it."""
+        records = self.bids.items()
+        if isinstance(self.bids, dict):
+            # A copy, so that writes do not disturb the iteration.
+            records = list(records)
+        entries = []
+        for key, value in records:
+            expires = expiry_time(value)
+            if expires is not None:
+                entries.append((expires, key))
+        entries.sort()
+        with self.lock:
+            # Auctions written since startup are already indexed as they are now.
+            self.active_auctions.add_many([entry for entry in entries if entry[1] not in self.indexing_touched])
+            self.indexing_touched = set()
+            self.auctions_indexed.set()
+
+    def _table(self, db_type):
+        if db_type == "users":
+            return self.users
+        elif db_type == "bids":
+            return self.bids
+        elif db_type == "sequences":
+            return self.sequences
+        raise ValueError(f"Invalid database type: {db_type}")
+
+    def _note_term(self, index, term):
+        # A snapshot can move the log back to an earlier index.
+        while self.term_indexes and self.term_indexes[-1] > index:
+            self.term_indexes.pop()
+            self.terms.pop()
+        if not self.terms or self.terms[-1] != term:
+            self.term_indexes.append(index)
+            self.terms.append(term)
+
+    def term_at(self, index):
+        """Term of the log entry at `index`, or None if it is not known."""
+        position = bisect_right(self.term_indexes, index) - 1
+        if position < 0 or index > self.last_index:
+            return None
+        return self.terms[position]
+
+    def log_position(self):
+        """(term, index) of the last log entry, for comparing how up to date two logs are."""
+        return self.term_at(self.last_index) or 0, self.last_index
 
-    def _load_data(self, file_name):
-        if os.path.exists(file_name):
-            with open(file_name, 'r') as file:
-                return json.load(file)
-        return {}
+    def _note_position(self, entry):
+        if entry.get("op") == "snapshot":
+            self.term_indexes, self.terms = [], []
+        self._note_term(entry["index"], entry.get("term", 0))
+        self.last_index = entry["index"]
 
-    def _save_data(self, file_name, data):
-        """Save database to file."""
-        with open(file_name, 'w') as file:
-            json.dump(data, file, indent=4)
+    def _apply(self, entry):
+        op = entry.get("op", "put")
+        self._note_position(entry)
+        if entry.get("db_type") == "bids" and not self.auctions_indexed.is_set():
+            self.indexing_touched.add(entry["key"])
+        if op == "put":
+            self._table(entry["db_type"])[entry["key"]] = entry["value"]
+            if entry["db_type"] == "bids":
+                self.active_auctions.update(entry["key"], entry["value"])
+        elif op == "delete":
+            self._table(entry["db_type"]).pop(entry["key"], None)
+            if entry["db_type"] == "bids":
+                self.active_auctions.remove(entry["key"])
+        elif op == "archive":
+            self.bids.pop(entry["key"], None)
+            self.active_auctions.remove(entry["key"])
+            self._archive([entry])
+        elif op == "bid":
+            auction = self.bids.get(entry["key"])
+            if auction is not None:
+                self.bids[entry["key"]] = dict(auction, highest_bid=entry["amount"], highest_bidder=entry["bidder"])
 
-    def write_record(self, key, value, leader_ip, db_type):
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
+    def _archive(self, entries):
+        self.archive.append([{"index": entry["index"], "key": entry["key"], "value": entry["value"]}
+                             for entry in entries])
+
+    def _append(self, entries):
+        """Append indexed entries to the log, then apply them. Caller holds self.lock."""
+        with storage_io("wal_append"):
+            self.wal.append(entries)
+        for entry in entries:
+            self._apply(entry)
+        self.ledger.append([entry for entry in entries if entry.get("op") == "bid"])
+        with storage_io("store_apply"):
+            self.store.apply(entries, self.wal.end_offset)
+        self.entries_since_snapshot += len(entries)
+        self.bid_changes.publish(entries)
+        with self.applied:
+            self.applied.notify_all()
+        for listener in list(self.applied_listeners):
+            listener()
+
+    def _commit(self, entries):
+        """Assign the next log indexes and the current term to new entries and append them. Caller holds self.lock."""
+        for offset, entry in enumerate(entries, 1):
+            entry["index"] = self.last_index + offset
+            entry["term"] = self.term
+        self._append(entries)
+
+    def write_record(self, key, value, leader_id, db_type):
+        return self.write_batch([{"key": key, "value": value, "db_type": db_type}], leader_id)
+
+    def write_batch(self, records, leader_id):
+        """Apply records with a single log flush and queue them for replication.
+
+        Returns the log index of the last record; the leader should pass it to
+        replicator.wait_for_quorum before acknowledging the client. An empty
+        batch changes nothing and returns the current last index.
+        """
+        if not records:
+            return self.last_index
+        for record in records:
+            check_write(record)
+        entries = [{"db_type": r["db_type"], "key": r["key"], "value": r["value"]} for r in records]
         with self.lock:
-            if db_type == "users":
-                self.users[key] = value
-                logger.info(f"User record {key} updated to {value}\n")
-                self._save_data(self.user_file, self.users)
-            elif db_type == "bids":
-                self.bids[key] = value
-                logger.info(f"Bid record {key} updated to {value}\n")
-                self._save_data(self.bid_file, self.bids)
-            else:
-                raise ValueError(f"Invalid database type: {db_type}")
+            self._commit(entries)
+            if logger.isEnabledFor(logging.DEBUG):
+                for entry in entries:
+                    if random.random() < RECORD_LOG_SAMPLE:
+                        logger.debug(f"{entry['db_type']} record {entry['key']} updated to {entry['value']}\n")
+
+            # Queued under the lock so followers receive entries in log order.
+            if SERVER_ID == leader_id:
+                self.replicate_to_followers(entries)
+        return entries[-1]["index"]
+
+    def place_bids(self, bids, leader_id):
+        """Atomically apply each bid that beats its auction's current highest bid.
+
+        Bids are decided in order, so two bids in one batch on the same
+        auction see each other. Returns (outcome, auction, index) per bid,
+        where outcome is "accepted", "too_low", "closed", "not_found" or
+        "invalid" (the stored record is not an auction with a numeric price)
+        and auction is the resulting state. Accepted bids are logged and
+        replicated as bid entries holding just the bid, not the auction.
+        """
+        now = time.time()
+        results = []
+        entries = []
+        with self.lock:
+            pending = {}
+            for bid in bids:
+                auction_id = bid["auction_id"]
+                auction = pending.get(auction_id) or self.bids.get(auction_id)
+                if auction is None:
+                    auction = self.archive.get(auction_id)
+                    results.append(("closed" if auction is not None else "not_found", auction, None))
+                    continue
+                price = None
+                if isinstance(auction, dict):
+                    price = auction.get("highest_bid", auction.get("starting_bid", 0))
+                if not isinstance(price, (int, float)) or isinstance(price, bool):
+                    # Written with /write as something other than an auction; only this bid fails.
+                    results.append(("invalid", None, None))
+                    continue
+                expires = expiry_time(auction)
+                if expires is not None and now >= expires:
+                    results.append(("closed", auction, None))
+                    continue
+                if bid["amount"] <= price:
+                    results.append(("too_low", auction, self.last_index + len(entries)))
+                    continue
+                auction = dict(auction, highest_bid=bid["amount"], highest_bidder=bid["bidder"])
+                pending[auction_id] = auction
+                entries.append({"op": "bid", "db_type": "bids", "key": auction_id, "bidder": bid["bidder"],
+                                "amount": bid["amount"], "time": now})
+                # _commit numbers the entries consecutively after last_index.
+                results.append(("accepted", auction, self.last_index + len(entries)))
+
+            if entries:
+                self._commit(entries)
+                if SERVER_ID == leader_id:
+                    self.replicate_to_followers(entries)
+        return results
+
+    def _conflicts(self, index, term):
+        own = self.term_at(index)
+        return own is not None and term is not None and own != term
 
-            if SERVER_IP == leader_ip:
-                self.replicate_to_followers(key, value, db_type)
+    def diverges_from(self, last_index, last_term, term):
+        """Whether this log holds entries the leader of `term`, whose last entry is
+        (last_term, last_index), does not have; such entries were never committed."""
+        if self.last_index > last_index:
+            return (self.term_at(self.last_index) or 0) < term
+        return self.last_index == last_index and self._conflicts(last_index, last_term)
+
+    def apply_replicated(self, entries, prev_index=None, prev_term=None):
+        """Apply entries streamed from the leader.
+
+        Returns False without applying anything if they do not follow on from
+        this node's log, in which case it has to resynchronize. Raises
+        LogConflict if this log disagrees with the leader's at prev_index or
+        at any entry it already has.
+        """
+        with self.lock:
+            if prev_index is not None and self._conflicts(prev_index, prev_term):
+                raise LogConflict(f"Entry {prev_index} differs from the leader's")
+            for entry in entries:
+                if entry["index"] <= self.last_index and self._conflicts(entry["index"], entry.get("term", 0)):
+                    raise LogConflict(f"Entry {entry['index']} differs from the leader's")
+            entries = [entry for entry in entries if entry["index"] > self.last_index]
+            if not entries:
+                return True
+            if entries[0]["index"] != self.last_index + 1:
+                return False
+            self._append(entries)
+        logger.debug(f"Replicated {len(entries)} records up to index {entries[-1]['index']}\n")
+        return True
 
     def read_record(self, key, db_type):
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
+        # Single dict lookups are atomic, so reads do not wait behind a
+        # write's fsync.
+        return self._table(db_type).get(key, None)
+
+    def active_auctions_page(self, cursor=None, limit=20):
+        """One page of live auctions, soonest-ending first, and the cursor for the next page.
+
+        Each auction carries its id and expiry, so pages from several shards can be merged.
+        """
+        self.auctions_indexed.wait()
+        auction_ids, next_cursor = self.active_auctions.active(time.time(), cursor, limit)
+        auctions = []
+        for auction_id in auction_ids:
+            auction = self.bids.get(auction_id)
+            if auction is not None:
+                auctions.append(dict(auction, id=auction_id, expires=expiry_time(auction)))
+        return auctions, next_cursor
+
+    def close_expired_auctions(self, leader_id, limit=CLOSE_BATCH):
+        """Close up to `limit` auctions past their expiry and move them to the archive.
+
+        The closed record names the winner and winning bid, if any. Returns
+        the log index of the batch, or None if no auction was due.
+        """
+        if not self.auctions_indexed.is_set():
+            return None
         with self.lock:
-            if db_type == "users":
-                return self.users.get(key, None)
-            elif db_type == "bids":
-                return self.bids.get(key, None)
-            else:
-                raise ValueError(f"Invalid database type: {db_type}")
+            entries = []
+            for expires, auction_id in self.active_auctions.expired(time.time(), limit):
+                auction = self.bids.get(auction_id)
+                if auction is None:
+                    self.active_auctions.remove(auction_id)
+                    continue
+                closed = dict(auction, closed_time=datetime.fromtimestamp(expires).strftime(TIME_FORMAT),
+                              winner=auction.get("highest_bidder"),
+                              winning_bid=auction.get("highest_bid") if auction.get("highest_bidder") else None)
+                entries.append({"op": "archive", "db_type": "bids", "key": auction_id, "value": closed})
+            if not entries:
+                return None
+            self._commit(entries)
+            if SERVER_ID == leader_id:
+                self.replicate_to_followers(entries)
+        logger.info(f"Closed and archived {len(entries)} auctions up to index {entries[-1]['index']}\n")
+        return entries[-1]["index"]
+
+    def read_archived(self, auction_id):
+        return self.archive.get(auction_id)
+
+    def find_auctions(self, field, value, limit=100):
+        """Auctions whose `field` (see storage.AUCTION_INDEX_FIELDS) equals `value`, by id."""
+        return self.store.find_auctions(field, value, limit)
+
+    def snapshot(self):
+        """Have the storage engine persist everything applied so far, then compact the log behind it.
+
+        The newest LOG_RETAIN_ENTRIES entries stay in the log. Returns
+        whether the log was compacted.
+        """
+        if not self.snapshot_lock.acquire(blocking=False):
+            return False
+        try:
+            with self.lock:
+                offset, index = self.wal.end_offset, self.last_index
+                # Archived auctions and bids must be durable before the log entries that redo them are dropped.
+                with storage_io("archive_flush"):
+                    self.archive.flush()
+                with storage_io("ledger_flush"):
+                    self.ledger.flush()
+                with storage_io("checkpoint"):
+                    finish = self.store.checkpoint(offset)
+                self.entries_since_snapshot = 0
+            if finish is not None:
+                with storage_io("snapshot_write"):
+                    finish()
+            keep_after = index - LOG_RETAIN_ENTRIES
+            with self.lock:
+                if keep_after <= self.wal.start_index or self.term_at(keep_after) is None:
+                    return False
+                with storage_io("log_compact"):
+                    compacted = self.wal.compact(keep_after, self.term_at(keep_after), offset)
+            if compacted:
+                logger.info(f"Snapshot taken at index {index}, log compacted up to index {keep_after}\n")
+            return compacted
+        finally:
+            self.snapshot_lock.release()
+
+    def wait_for_index(self, index, timeout):
+        """Wait until this node has applied `index`; True if it has."""
+        if self.last_index >= index:
+            return True
+        start = time.perf_counter()
+        with tracing.span("database.wait_for_index", index=index), self.applied:
+            applied = self.applied.wait_for(lambda: self.last_index >= index, timeout)
+        READ_WAIT.observe(time.perf_counter() - start, "applied" if applied else "timeout")
+        return applied
+
+    def note_leader_contact(self, commit_index):
+        """Record a message from the leader advertising its commit index."""
+        self.leader_commit_index = max(self.leader_commit_index, commit_index)
+        self.leader_contact = time.monotonic()
+        self.bid_changes.commit(commit_index)
+
+    def staleness(self):
+        """Seconds since this follower last knew it held everything the leader had committed."""
+        if self.last_index < self.leader_commit_index:
+            return float("inf")
+        return time.monotonic() - self.leader_contact
 
     def get_all_records(self):
-        return {"users": self.users, "bids": self.bids}
+        with self.lock:
+            return {"users": dict(self.users.items()), "bids": dict(self.bids.items()), "index": self.last_index}
 
-    def synchronize_with_leader(self, leader_ip):
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
+    def synchronize_with_leader(self, leader_id, reset=False):
+        """Catch up by fetching only the log entries after this node's last index.
+
+        Falls back to a chunked snapshot transfer when this node has no data
+        yet, the leader's log no longer reaches back far enough, or this log
+        disagrees with the leader's; `reset` forces one.
+        """
+        if not self.sync_lock.acquire(blocking=False):
+            return
         try:
-            response = requests.get(f"http://{leader_ip}:5001/data", timeout=5)
-            response.raise_for_status()
-            leader_data = response.json()
-
-            # Synchronize users
-            for key, value in leader_data.get("users", {}).items():
-                if key not in self.users or self.users[key] != value:
-                    self.users[key] = value
-                    logger.info(f"Replicated user record: {key} -> {value}\n")
-
-            # Synchronize bids
-            for key, value in leader_data.get("bids", {}).items():
-                if key not in self.bids or self.bids[key] != value:
-                    self.bids[key] = value
-                    logger.info(f"Replicated bid record: {key} -> {value}\n")
-
-            self._save_data(self.user_file, self.users)
-            self._save_data(self.bid_file, self.bids)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to synchronize with leader {leader_ip}: {e}\n")
-
-    def replicate_to_followers(self, key, value, db_type):
-        for peer in self.peers:
-            if peer != f"{SERVER_ID}":
+            if reset or (self.last_index == 0 and not self.users and not self.bids):
+                self._install_snapshot(leader_id)
+            while True:
+                after = self.last_index
+                response = self.client.get(f"{peer_url(leader_id)}/log", "catch_up",
+                                           params={"after": after, "limit": CATCH_UP_CHUNK})
+                if response.status_code == 410:
+                    self._install_snapshot(leader_id)
+                    continue
+                response.raise_for_status()
+                page = response.json()
                 try:
-                    requests.post(
-                        f"http://{peer}.database-server.database.svc.cluster.local:5001/replicate",
-                        json={"key": key, "value": value, "db_type": db_type},
-                        timeout=2
-                    )
-                    logger.info(f"Replicated {db_type} record {key} -> {value} to {peer}\n")
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Failed to replicate to {peer}: {e}\n")
-
-    def add_user(self, username, password, leader_ip):
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
-        if username in self.users:
-            return False
-        self.users[username] = {"password": password}
-        self._save_data(self.user_file, self.users)
-        logger.info(f"User {username} added.\n")
-        if SERVER_IP == leader_ip:
-            self.replicate_to_followers(username, self.users[username], "users")
-        return True
+                    if not self.apply_replicated(page["entries"], after, page.get("prev_term")):
+                        raise RuntimeError(f"Leader log does not continue from index {self.last_index}")
+                except LogConflict as e:
+                    logger.info(f"{e}, installing a snapshot from leader {leader_id}\n")
+                    self._install_snapshot(leader_id)
+                    continue
+                self.note_leader_contact(page["commit_index"])
+                if not page["entries"] or self.last_index >= page["last_index"]:
+                    break
+            logger.info(f"Caught up with leader {leader_id} at index {self.last_index}\n")
+        except (requests.exceptions.RequestException, RuntimeError) as e:
+            logger.error(f"Failed to synchronize with leader {leader_id}: {e}\n")
+        finally:
+            self.sync_lock.release()
+
+    def _install_snapshot(self, leader_id):
+        snapshot_id, cursor = None, 0
+        tables = {db_type: {} for db_type in DB_TYPES}
+        archived, bids = [], []
+        # Bids past the leader's commit index may have been rolled back with the rest of this log.
+        with self.lock:
+            self.ledger.truncate_after(min(self.ledger.last_index, self.leader_commit_index))
+        while cursor is not None:
+            response = self.client.get(f"{peer_url(leader_id)}/snapshot", "catch_up",
+                                       params={"snapshot_id": snapshot_id, "cursor": cursor, "limit": CATCH_UP_CHUNK,
+                                               "archive_after": self.archive.last_index,
+                                               "ledger_after": self.ledger.last_index})
+            response.raise_for_status()
+            page = response.json()
+            snapshot_id, index, cursor = page["snapshot_id"], page["index"], page["next_cursor"]
+            term = page.get("term") or 0
+            for db_type, key, value in page["records"]:
+                if db_type == "archive":
+                    archived.append({"index": value["index"], "key": key, "value": value["value"]})
+                elif db_type == "ledger":
+                    bids.append(dict(zip(("index", "time", "bidder", "amount"), value), key=key))
+                else:
+                    tables[db_type][key] = value
+
+        with self.lock:
+            if archived:
+                self.archive.append(archived)
+            self.ledger.append(bids)
+            # Only the differences are logged, all at the snapshot's index,
+            # followed by a marker so this log is never served from before it.
+            entries = []
+            for db_type in DB_TYPES:
+                table = self._table(db_type)
+                for key, value in tables[db_type].items():
+                    if key not in table or table[key] != value:
+                        entries.append({"db_type": db_type, "key": key, "value": value, "index": index, "term": term})
+                for key in table.keys() - tables[db_type].keys():
+                    entries.append({"op": "delete", "db_type": db_type, "key": key, "index": index, "term": term})
+            entries.append({"op": "snapshot", "index": index, "term": term})
+            self._append(entries)
+        logger.info(f"Installed snapshot at index {index} from leader {leader_id}\n")
+
+    def log_after(self, after, limit):
+        """Log entries after `after`; raises LogCompacted if they are gone."""
+        return self.wal.read_after(after, limit)
+
+    def snapshot_page(self, snapshot_id, cursor, limit, archive_after=None, ledger_after=None):
+        """Serve one page of a point-in-time copy of the data to a catching-up follower.
+
+        A new copy ends with the auctions archived after log index
+        `archive_after`, as ("archive", id, {"index", "value"}), and the bids
+        recorded after log index `ledger_after`, as ("ledger", auction id,
+        [index, time, bidder, amount]), for a follower whose archive and
+        ledger reach that far. Raises KeyError if `snapshot_id` has expired.
+        """
+        now = time.monotonic()
+        for expired in [sid for sid, snap in self.transfer_snapshots.items()
+                        if now - snap["used"] > SNAPSHOT_TRANSFER_TTL]:
+            self.transfer_snapshots.pop(expired, None)
+        if snapshot_id is None:
+            with self.lock:
+                records = [(db_type, key, value) for db_type in DB_TYPES
+                           for key, value in self._table(db_type).items()]
+                snapshot = {"index": self.last_index, "term": self.term_at(self.last_index), "records": records}
+            if archive_after is not None:
+                # Read outside the lock: the archive is append-only, and an
+                # auction archived since is only archived twice.
+                records += [("archive", record["key"], {"index": record["index"], "value": record["value"]})
+                            for record in self.archive.records_after(archive_after)]
+            if ledger_after is not None:
+                records += [("ledger", bid["auction_id"], [bid["index"], bid["time"], bid["bidder"], bid["amount"]])
+                            for bid in self.ledger.records_after(ledger_after) if bid["index"] <= snapshot["index"]]
+            snapshot_id = uuid.uuid4().hex
+            self.transfer_snapshots[snapshot_id] = snapshot
+        snapshot = self.transfer_snapshots[snapshot_id]
+        snapshot["used"] = now
+        records = snapshot["records"][cursor:cursor + limit]
+        next_cursor = cursor + limit if cursor + limit < len(snapshot["records"]) else None
+        if next_cursor is None:
+            self.transfer_snapshots.pop(snapshot_id, None)
+        return {"snapshot_id": snapshot_id, "index": snapshot["index"], "term": snapshot["term"], "records": records,
+                "next_cursor": next_cursor}
+
+    def replicate_to_followers(self, entries):
+        self.replicator.replicate(entries)
+        index = entries[-1]["index"]
+        self.replicator.on_quorum(index, lambda: self.bid_changes.commit(index))
+
+    def leadership_changed(self, term, leader_id):
+        """Reset replication whenever the leader changes; a new leader stamps its entries with `term`."""
+        with self.lock:
+            if leader_id == SERVER_ID:
+                self.term = term
+            self.replicator.reset(term, self.last_index)
+
+    def create_record(self, key, value, leader_id, db_type):
+        """Write a record only if `key` is not taken yet; returns its log index, or None if it exists."""
+        entries = [{"db_type": db_type, "key": key, "value": value}]
+        check_write(entries[0])
+        with self.lock:
+            if key in self._table(db_type):
+                return None
+            self._commit(entries)
+            if SERVER_ID == leader_id:
+                self.replicate_to_followers(entries)
+        return entries[-1]["index"]
+
+    def allocate_ids(self, name, count, leader_id):
+        """Reserve the next `count` values of the ID sequence `name`, which start at 1.
+
+        Returns the first reserved value and the log index of the reservation;
+        once that is committed, no leader hands the values out again.
+        """
+        with self.lock:
+            start = self.sequences.get(name, {}).get("next", 1)
+            entries = [{"db_type": "sequences", "key": name, "value": {"next": start + count}}]
+            self._commit(entries)
+            if SERVER_ID == leader_id:
+                self.replicate_to_followers(entries)
+        logger.info(f"Allocated IDs {start} to {start + count - 1} of sequence {name}\n")
+        return start, entries[-1]["index"]
+
+    def add_user(self, username, password, leader_id):
+        index = self.create_record(username, {"password": password}, leader_id, "users")
+        if index:
+            logger.info(f"User {username} added.\n")
+        return index
 
     def authenticate_user(self, username, password):
-        self.users = self._load_data(self.user_file)
-        self.bids = self._load_data(self.bid_file)
         user = self.users.get(username)
         if user and user["password"] == password:
             return True
         return False
-
@@ -0,0 +1,60 @@
+import collections
+import math
+import threading
+import time
+
+
+class PhiAccrualDetector:
+    """Phi accrual failure detector (Hayashibara et al.) for messages from one peer.
+
+    Keeps the last `window` intervals between messages and reports phi, the
+    -log10 probability that a message would be this late if the peer were
+    alive, modelling intervals as normally distributed. A peer that promises
+    a message at least every `expected_interval` seconds is judged against
+    that interval even while traffic is faster: shorter gaps are recorded as
+    `expected_interval`, so bursts of replication traffic do not widen the
+    distribution, and only lateness beyond the promise adds to the spread.
+    `acceptable_pause` is added for scheduling and GC hiccups, and the
+    spread never drops below `min_std`.
+    """
+
+    def __init__(self, expected_interval, threshold=8.0, window=100, min_std=0.1, acceptable_pause=None):
+        self.expected_interval = expected_interval
+        self.threshold = threshold
+        self.min_std = min_std
+        self.acceptable_pause = expected_interval / 4 if acceptable_pause is None else acceptable_pause
+        self.intervals = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.last_arrival = None
+
+    def heartbeat(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.last_arrival is not None:
+                self.intervals.append(max(now - self.last_arrival, self.expected_interval))
+            self.last_arrival = now
+
+    def reset(self, now=None):
+        """Forget the history, as when a new peer takes over; the clock starts at `now`."""
+        with self.lock:
+            self.intervals.clear()
+            self.last_arrival = time.monotonic() if now is None else now
+
+    def phi(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.last_arrival is None:
+                return 0.0
+            elapsed = now - self.last_arrival
+            if len(self.intervals) >= 2:
+                mean = sum(self.intervals) / len(self.intervals)
+                std = math.sqrt(sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals))
+            else:
+                mean, std = self.expected_interval, self.expected_interval / 10
+        mean += self.acceptable_pause
+        std = max(std, self.min_std)
+        late = 0.5 * math.erfc((elapsed - mean) / (std * math.sqrt(2)))
+        return float("inf") if late <= 0 else -math.log10(late)
+
+    def suspects(self, now=None):
+        return self.phi(now) > self.threshold
@@ -0,0 +1,71 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import tracing
+
+
+class GroupCommitter:
+    """Merges single writes that arrive close together into one flush.
+
+    While a flush is in progress new writes queue up; the next flush takes
+    everything queued, waiting at most `window` seconds for stragglers.
+    `flush` receives the list of records and returns one result per record.
+    The flush is traced under the first traced writer in the batch; the
+    others get a span of the same flush.
+    """
+
+    def __init__(self, flush, window=0.0002, max_batch=256):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, record):
+        """Queue a record; the returned future resolves once it is flushed."""
+        future = Future()
+        self.queue.put((record, future, tracing.current()))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            spans = [span for _, _, span in batch if span is not None]
+            started = time.perf_counter()
+            try:
+                with tracing.span("group_commit.flush", parent=spans[0] if spans else None, batch=len(batch)):
+                    results = self.flush([record for record, _, _ in batch])
+            except Exception as e:
+                results, error = None, e
+            # Recorded before the writers are answered, while their requests are still open.
+            for span in spans[1:]:
+                tracing.record("group_commit.flush", started, time.perf_counter() - started, parent=span,
+                               batch=len(batch), flushed_with=spans[0].trace_id)
+            if results is None:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
@@ -0,0 +1,467 @@
+"""The database server's request handling, shared by the Flask (app.py) and asyncio (async_app.py) servers.
+
+Handlers take a request's parsed arguments and return its (body, status), or
+a Forward when another node has to answer it. The servers only read requests,
+do the waiting — on a group commit, a quorum or a version to be applied —
+and send answers and forwards, each in its own way. Malformed requests raise
+BadRequest, which both servers answer with 400.
+"""
+from change_feed import FeedTruncated
+from database import DB_TYPES, HEARTBEATS_RECEIVED, SHARD_ID, check_write
+from storage import AUCTION_INDEX_FIELDS
+from wal import LogCompacted
+import tracing
+import math
+import time
+import os
+start_time = time.time()
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SERVER_ID = os.getenv("MY_POD_NAME")
+PORT = int(os.getenv("PORT", "5001"))
+
+# The leader sends a heartbeat to a follower only if nothing else reached it within this interval.
+# Followers suspect a leader nothing reached for an interval, a pause and the detector's margin,
+# so failover always takes longer than one interval; shorten the interval to fail over faster.
+heartbeat_interval = float(os.getenv("HEARTBEAT_INTERVAL", "2"))
+phi_threshold = float(os.getenv("PHI_THRESHOLD", "8"))
+# Enough for leader stalls of up to half a second at the default interval.
+heartbeat_pause = heartbeat_interval / 8
+election_timeout = float(os.getenv("ELECTION_TIMEOUT", "0.25"))
+read_consistency = os.getenv("READ_CONSISTENCY", "bounded")
+max_read_staleness = float(os.getenv("MAX_READ_STALENESS", "5"))
+# A leader only serves lease reads while no other node can have been elected:
+# followers never suspect it sooner than heartbeat_interval + heartbeat_pause.
+lease_duration = float(os.getenv("LEADER_LEASE_SECONDS", str(heartbeat_interval + heartbeat_pause)))
+version_wait_timeout = float(os.getenv("VERSION_WAIT_SECONDS", "1"))
+group_commit_window = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0.2")) / 1000
+# A snapshot is taken, and the log compacted, once this many entries were logged since the last.
+snapshot_entries = int(os.getenv("SNAPSHOT_ENTRIES", "100000"))
+
+WRITE_FORWARD_FAILED = "Failed to forward write request to the leader"
+READ_FORWARD_FAILED = "Failed to forward read request to the leader"
+
+# Set by configure(), once the server has created them.
+database = None
+leader_election = None
+router = None
+resynchronize = None
+
+
+def configure(node_database, node_leader_election, node_router, node_resynchronize):
+    """Handle requests with this node's database, election and shard router.
+
+    `node_resynchronize(leader_id, reset=False)` starts catching up with the
+    leader in the background.
+    """
+    global database, leader_election, router, resynchronize
+    database = node_database
+    leader_election = node_leader_election
+    router = node_router
+    resynchronize = node_resynchronize
+
+
+class BadRequest(ValueError):
+    """A malformed request, answered with 400 and the message."""
+
+
+class Forward:
+    """A request another node has to answer.
+
+    It goes to `shard`, that shard's leader unless `to_leader` is False, or
+    else to this shard's leader `leader_id`. `kwargs` are the json or params
+    to send. With `check`, an error status from the leader counts as a
+    failure to forward, answered with `failure` and `failure_status`.
+    """
+
+    def __init__(self, method, path, shard=None, leader_id=None, to_leader=True,
+                 failure="Failed to forward request to the leader", failure_status=500, check=False, **kwargs):
+        self.method = method
+        self.path = path
+        self.shard = shard
+        self.leader_id = leader_id
+        self.to_leader = to_leader
+        self.failure = failure
+        self.failure_status = failure_status
+        self.check = check
+        self.kwargs = kwargs
+
+    def failed(self, error):
+        """The answer when the other node could not be reached."""
+        if self.shard is not None:
+            logger.error(f"Failed to forward {self.path} to shard {self.shard}: {error}\n")
+            return {"error": f"Failed to forward request to shard {self.shard}"}, 503
+        logger.error(f"Failed to forward {self.path} to leader {self.leader_id}: {error}\n")
+        return {"error": self.failure}, self.failure_status
+
+
+def bad_request(error):
+    return {"error": str(error)}, 400
+
+def no_leader():
+    return {"error": "No leader is elected right now, retry shortly"}, 503
+
+def not_acknowledged(what, error):
+    logger.error(f"{what} not acknowledged by a quorum: {error}\n")
+    return {"error": "Write was not acknowledged by a quorum of replicas"}, 503
+
+def other_shard(key):
+    """The shard that owns `key`, or None if it is this node's shard."""
+    shard = router.shard_for(key)
+    return None if shard == SHARD_ID else shard
+
+def write_target(method, path, key=None, failure=WRITE_FORWARD_FAILED, check=False, **kwargs):
+    """Where a write of `key` goes: a Forward to its shard or to the leader, no_leader(), or None for this node."""
+    shard = None if key is None else other_shard(key)
+    if shard is not None:
+        return Forward(method, path, shard=shard, **kwargs)
+    leader_id = leader_election.get_leader()
+    if leader_id == SERVER_ID:
+        return None
+    if leader_id is None:
+        return no_leader()
+    return Forward(method, path, leader_id=leader_id, failure=failure, check=check, **kwargs)
+
+def shard_read_target(method, path, key, **kwargs):
+    """A Forward to any replica of the shard that owns `key`, or None if it is this node's shard."""
+    shard = other_shard(key)
+    return None if shard is None else Forward(method, path, shard=shard, to_leader=False, **kwargs)
+
+def may_read_locally(consistency, max_staleness):
+    """Whether this node may answer a read at the requested consistency without contacting the leader.
+
+    "lease" reads are only served by a leader holding a quorum lease,
+    "bounded" reads by any node whose data is at most max_staleness seconds
+    behind the leader, and "version" reads by any node. The servers first
+    wait briefly for this node to apply the read's min_version, for
+    read-your-writes.
+    """
+    if leader_election.is_leader():
+        return consistency != "lease" or database.replicator.has_lease(lease_duration)
+    if consistency == "lease":
+        return False
+    if consistency == "bounded":
+        return database.staleness() <= max_staleness
+    return True
+
+def refused_read(consistency, method, path, failure=READ_FORWARD_FAILED, **kwargs):
+    """The answer to a read this node may not serve: a Forward to the leader, or 503 on the leader itself."""
+    leader_id = leader_election.get_leader()
+    if leader_id == SERVER_ID:
+        return {"error": f"Leader cannot serve a {consistency} read right now"}, 503
+    if leader_id is None:
+        return no_leader()
+    return Forward(method, path, leader_id=leader_id, failure=failure, failure_status=503, **kwargs)
+
+
+def fields(data, *names):
+    """The values of `names` in a JSON request body; raises BadRequest if one is missing."""
+    if not isinstance(data, dict):
+        raise BadRequest("Request body must be a JSON object")
+    missing = [name for name in names if name not in data]
+    if missing:
+        raise BadRequest(f"Missing {', '.join(missing)}")
+    return [data[name] for name in names]
+
+def query_number(params, name, default, kind=int, low=None, high=None):
+    """Argument `name` as an int or float `kind`, clamped to [low, high]; raises BadRequest if malformed."""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = kind(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not math.isfinite(value):
+        raise BadRequest(f"{name} must be {'an integer' if kind is int else 'a number'}")
+    if low is not None:
+        value = max(value, low)
+    if high is not None:
+        value = min(value, high)
+    return value
+
+def read_options(params):
+    """The consistency, min_version and max_staleness a read asks for."""
+    consistency = params.get("consistency", read_consistency)
+    if consistency not in ("lease", "bounded", "version"):
+        raise BadRequest(f"Invalid consistency mode: {consistency}")
+    return (consistency, query_number(params, "min_version", 0),
+            query_number(params, "max_staleness", max_read_staleness, float))
+
+def parse_record(data):
+    key, value, db_type = fields(data, "key", "value", "db_type")
+    if not isinstance(key, str) or not key:
+        raise BadRequest("key must be a non-empty string")
+    record = {"key": key, "value": value, "db_type": db_type}
+    try:
+        check_write(record)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return record
+
+def parse_records(data):
+    (records,) = fields(data, "records")
+    if not isinstance(records, list) or not records:
+        raise BadRequest("records must be a non-empty list")
+    return [parse_record(record) for record in records]
+
+def parse_bid(data):
+    """The bid in a /bid request body."""
+    auction_id, bidder, amount = fields(data, "auction_id", "bidder", "amount")
+    for field, value in (("auction_id", auction_id), ("bidder", bidder)):
+        if not isinstance(value, str) or not value:
+            raise BadRequest(f"{field} must be a non-empty string")
+    try:
+        if isinstance(amount, bool):
+            raise TypeError
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise BadRequest("amount must be a number")
+    if not math.isfinite(amount):
+        raise BadRequest("amount must be a finite number")
+    return {"auction_id": auction_id, "bidder": bidder, "amount": amount}
+
+def parse_block(data):
+    """The ID block a /allocate_ids request body asks for."""
+    name, count = fields(data, "name", "count")
+    if not isinstance(name, str) or not name:
+        raise BadRequest("name must be a non-empty string")
+    try:
+        if isinstance(count, bool):
+            raise TypeError
+        count = int(count)
+    except (TypeError, ValueError):
+        raise BadRequest("count must be an integer")
+    if count < 1:
+        raise BadRequest("count must be at least 1")
+    return {"name": name, "count": count}
+
+def parse_user(data):
+    username, password = fields(data, "username", "password")
+    return {"username": username, "password": password}
+
+def active_options(params):
+    """The cursor and limit of an /auctions/active page."""
+    limit = query_number(params, "limit", 20, low=1, high=1000)
+    cursor = params.get("cursor")
+    if cursor:
+        expires, _, auction_id = cursor.partition(":")
+        try:
+            cursor = (float(expires), auction_id)
+        except ValueError:
+            raise BadRequest(f"Invalid cursor: {params['cursor']}")
+    return cursor, limit
+
+def search_options(params):
+    searched = [field for field in AUCTION_INDEX_FIELDS if field in params]
+    if len(searched) != 1:
+        raise BadRequest(f"Search by exactly one of: {', '.join(AUCTION_INDEX_FIELDS)}")
+    return searched[0], params[searched[0]], query_number(params, "limit", 100, low=1, high=1000)
+
+def snapshot_options(params):
+    """The snapshot_id, cursor, limit, archive_after and ledger_after of a /snapshot page."""
+    return (params.get("snapshot_id"), query_number(params, "cursor", 0, low=0),
+            query_number(params, "limit", 1000, low=1, high=10000),
+            query_number(params, "archive_after", None), query_number(params, "ledger_after", None))
+
+
+def flush_writes(records):
+    index = database.write_batch(records, leader_election.get_leader())
+    return [index] * len(records)
+
+def flush_bids(bids):
+    return database.place_bids(bids, leader_election.get_leader())
+
+def split_batch(records):
+    """A batch's records by the shard that owns them."""
+    records_by_shard = {}
+    for record in records:
+        records_by_shard.setdefault(router.shard_for(record["key"]), []).append(record)
+    return records_by_shard
+
+def written(record, index):
+    return {"message": f"Write successful to {record['db_type']} database", "version": index}, 200
+
+def batch_written(records, index):
+    return {"message": f"Wrote {len(records)} records", "version": index}, 200
+
+def batch_written_across(records_by_shard, answers):
+    """The answer to a batch sent to several shards, from each shard's (body, status).
+
+    The parts commit independently, not atomically.
+    """
+    versions = {}
+    for shard, (body, status) in answers.items():
+        if status != 200:
+            return body, status
+        versions[shard] = body["version"]
+    count = sum(len(records) for records in records_by_shard.values())
+    return {"message": f"Wrote {count} records to {len(versions)} shards", "versions": versions}, 200
+
+def bid_placed(outcome, auction, index):
+    if outcome == "not_found":
+        return {"error": "Auction not found."}, 404
+    if outcome == "invalid":
+        return {"error": "Auction record cannot take bids."}, 409
+    if outcome == "closed":
+        return {"error": "Auction is no longer active.", "auction": auction}, 400
+    if outcome == "too_low":
+        return {"error": "Bid must be higher than the current highest bid.", "auction": auction, "version": index}, 409
+    return {"message": "Bid accepted.", "auction": auction, "version": index}, 200
+
+def created(record, index):
+    if index is None:
+        return {"error": f"{record['key']} already exists in {record['db_type']} database"}, 409
+    return {"message": f"Created {record['key']} in {record['db_type']} database", "version": index}, 200
+
+def ids_allocated(block, start, index):
+    return {"start": start, "count": block["count"], "version": index}, 200
+
+def user_added(user, index):
+    if not index:
+        return {"error": f"User {user['username']} already exists."}, 400
+    return {"message": f"User {user['username']} added successfully.", "version": index}, 200
+
+
+def read_record(db_type, key):
+    if db_type not in DB_TYPES:
+        raise BadRequest(f"Invalid database type: {db_type}")
+    version = database.last_index
+    value = database.read_record(key, db_type)
+    if value is None:
+        return {"error": "Record not found", "version": version}, 404
+    return {"key": key, "value": value, "version": version}, 200
+
+def read_archived(auction_id):
+    version = database.last_index
+    auction = database.read_archived(auction_id)
+    if auction is None:
+        return {"error": "Auction not found in the archive", "version": version}, 404
+    return {"key": auction_id, "value": auction, "version": version}, 200
+
+def authenticate(user):
+    if database.authenticate_user(user["username"], user["password"]):
+        return {"message": "Authentication successful."}, 200
+    return {"error": "Invalid username or password."}, 401
+
+def active_auctions(cursor, limit):
+    version = database.last_index
+    auctions, next_cursor = database.active_auctions_page(cursor, limit)
+    if next_cursor:
+        next_cursor = f"{next_cursor[0]!r}:{next_cursor[1]}"
+    return {"auctions": auctions, "next_cursor": next_cursor, "version": version}, 200
+
+def search_auctions(field, value, limit):
+    version = database.last_index
+    return {"auctions": database.find_auctions(field, value, limit), "version": version}, 200
+
+def top_bids(auction_id, n):
+    version = database.last_index
+    return {"auction_id": auction_id, "bids": database.ledger.top(auction_id, n),
+            "count": database.ledger.count(auction_id), "version": version}, 200
+
+def bid_rate(auction_id, bucket, since):
+    version = database.last_index
+    return {"auction_id": auction_id, "bucket": bucket,
+            "rates": database.ledger.rate(auction_id, bucket, since), "version": version}, 200
+
+def bidder_bids(bidder, limit):
+    version = database.last_index
+    return {"bids": database.ledger.bids_by(bidder, limit), "version": version}, 200
+
+
+def leadership_changed(term, leader_id):
+    database.leadership_changed(term, leader_id)
+    if leader_id not in (None, SERVER_ID):
+        resynchronize(leader_id)
+
+def stale_term(data):
+    """The answer to a message from a leader of a past term, or None if its term is current."""
+    if leader_election.observe(data["term"], data["leader_id"]):
+        return None
+    return {"error": "Stale term", "term": leader_election.term}, 409
+
+def log_conflict(data, error):
+    logger.info(f"{error}, resynchronizing with leader {data['leader_id']}\n")
+    resynchronize(data["leader_id"], reset=True)
+    return {"error": "Log conflict", "last_index": database.last_index}, 409
+
+def replicated(data, applied):
+    """The answer to a /replicate_batch whose entries were `applied`, or not for a gap before them."""
+    database.note_leader_contact(data["commit_index"])
+    if not applied:
+        logger.info(f"Log gap before index {data['records'][0]['index']}, "
+                    f"resynchronizing with leader {data['leader_id']}\n")
+        resynchronize(data["leader_id"])
+        return {"error": "Log gap", "last_index": database.last_index}, 409
+    return {"message": "Replication successful", "last_index": database.last_index}, 200
+
+def new_leader(data):
+    logger.info(f"New leader elected: {data['leader_id']} for term {data['term']}\n")
+    return stale_term(data) or ({"message": "Leader update received"}, 200)
+
+def heartbeat(data):
+    stale = stale_term(data)
+    if stale is not None:
+        HEARTBEATS_RECEIVED.inc("stale_term")
+        return stale
+    HEARTBEATS_RECEIVED.inc("ok")
+    database.note_leader_contact(data["commit_index"])
+    if database.diverges_from(data["prev_index"], data["prev_term"], data["term"]):
+        logger.info(f"Log holds entries leader {data['leader_id']} does not have, resynchronizing\n")
+        resynchronize(data["leader_id"], reset=True)
+    return {"message": "Heartbeat received"}, 200
+
+def vote(ballot):
+    return leader_election.handle_vote(ballot), 200
+
+def advertised_staleness():
+    """Staleness advertised to read routers: 0 on the leader, None while behind the leader's commit index."""
+    if leader_election.is_leader():
+        return 0
+    staleness = database.staleness()
+    return None if staleness == float("inf") else staleness
+
+def election():
+    return dict(leader_election.status(), shard=SHARD_ID, uptime=time.time() - start_time,
+                last_index=database.last_index, staleness=advertised_staleness()), 200
+
+def liveness():
+    return {"message": "endpoint is live", "uptime": time.time() - start_time}, 200
+
+def log_page(after, limit):
+    """Log entries after index `after`, for a follower catching up; reads the log file."""
+    try:
+        entries = database.log_after(after, limit)
+    except LogCompacted as e:
+        return {"error": str(e)}, 410
+    return {"entries": entries, "last_index": database.last_index, "prev_term": database.term_at(after),
+            "commit_index": database.replicator.commit_index()}, 200
+
+def bid_changes(after, limit, timeout=0):
+    """Committed bid mutations after log index `after`, waiting up to `timeout` seconds for one.
+
+    A 410 means the subscriber fell too far behind: it has to re-read what
+    it tracks and continue from `next`.
+    """
+    try:
+        changes, next_index = database.bid_changes.read(after, limit, timeout)
+    except FeedTruncated as e:
+        return {"error": str(e), "next": database.bid_changes.position()}, 410
+    return {"changes": changes, "next": next_index}, 200
+
+def snapshot_page(snapshot_id, cursor, limit, archive_after, ledger_after):
+    """One page of a snapshot, for a follower too far behind for the log; reads the snapshot file."""
+    try:
+        return database.snapshot_page(snapshot_id, cursor, limit, archive_after, ledger_after), 200
+    except KeyError:
+        return {"error": f"Snapshot {snapshot_id} has expired"}, 410
+
+def traces(params):
+    return {"spans": tracing.COLLECTOR.export(query_number(params, "limit", None, low=1))}, 200
+
+def all_records():
+    return database.get_all_records(), 200
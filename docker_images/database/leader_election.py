@@ -1,81 +1,273 @@
-import psutil  # To get uptime information
 import requests
-import socket
+import asyncio
+import json
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from failure_detector import PhiAccrualDetector
+from metrics import REGISTRY
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-logger.info("Info log")
-logger.error("Error log")
 
-def get_uptime(start_time):
-    return time.time() - start_time
+ELECTIONS = REGISTRY.counter("elections_total", "Election rounds this node started, by result.", ("result",))
+LEADER_CHANGES = REGISTRY.counter("leader_changes_total", "Times the leader this node knows of changed or was lost.")
 
-SERVER_ID = os.getenv("MY_POD_NAME")
 
 class LeaderElection:
-    def __init__(self, peers, start_time):
-        self.server_ip = socket.gethostbyname(socket.gethostname())
-        self.peers = peers
-        self.leader_ip = None
-        self.uptime = get_uptime(start_time)
-
-    def start_election(self,start_time):
-        self.uptime = get_uptime(start_time)
-        logger.info(f"Server {self.server_ip} starting election with uptime {self.uptime}\n")
-        self.leader_ip = self.server_ip
-
-        max_uptime = self.uptime
-        max_uptime_ip = self.server_ip
-
-        for peer in self.peers:
-            if peer != f"{SERVER_ID}":
-                logger.info(f"Attempting to contact peer: {peer}\n")
-                try:
-                    response = requests.get(f"http://{peer}.database-server.database.svc.cluster.local:5001/election", timeout=20)
-                    logger.info(f"Received response: {response.status_code}\n")
-                    if response.status_code == 200:
-                        peer_info = response.json()
-                        if peer_info["uptime"] > max_uptime or (
-                                                peer_info["uptime"] == max_uptime and ip_address(peer_info["ip"]) > ip_address(max_uptime_ip)
-                                            ):
-                                                max_uptime = peer_info["uptime"]
-                                                max_uptime_ip = peer_info["ip"]
-                                                logger.info(f"New candidate leader: {max_uptime_ip} with uptime {max_uptime}\n")
-                except requests.exceptions.Timeout as e:
-                    logger.error(f"Timeout while contacting peer {peer}: {e}\n")
-                except requests.exceptions.ConnectionError as e:
-                    logger.error(f"Connection error while contacting peer {peer}: {e}\n")
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Request error while contacting peer {peer}: {e}\n")
-                except Exception as e:
-                    logger.error(f"Unexpected error while contacting peer {peer}: {e}\n")
-
-        self.leader_ip = max_uptime_ip
-        logger.info(f"Elected leader: {self.leader_ip}\n")
-        self.broadcast_leader()
+    """Term-based leader election, following Raft's election rules.
+
+    Every message from the leader, heartbeat or replication, feeds
+    `detector`. Once it suspects the leader, or when no leader is known, a
+    node waits a random part of `election_timeout` (a full one to two
+    timeouts when no leader is known), then starts the next term, votes for
+    itself and asks every peer for its vote concurrently. A node votes at
+    most once per term, only for a candidate whose log is at least as up to
+    date as its own, and not at all while it trusts a live leader, so each
+    term has at most one leader and all nodes agree on it. The current term
+    and vote are kept in `state_file` across restarts.
+
+    `log_position()` returns this node's (last log term, last log index).
+    `on_change(term, leader_id)` is called whenever the known leader changes;
+    leader_id is None while there is none.
+    """
+
+    def __init__(self, peers, server_id, peer_url, client, log_position, on_change=None,
+                 state_file="election.json", election_timeout=0.5, detector=None):
+        self.server_id = server_id
+        self.peers = [peer for peer in peers if peer != server_id]
+        self.cluster_size = len(self.peers) + 1
+        self.peer_url = peer_url
+        self.client = client
+        self.log_position = log_position
+        self.on_change = on_change or (lambda term, leader_id: None)
+        self.state_file = state_file
+        self.election_timeout = election_timeout
+        self.detector = detector or PhiAccrualDetector(expected_interval=2)
+        self.lock = threading.Lock()
+        state = self._load_state()
+        self.term = state.get("term", 0)
+        self.voted_for = state.get("voted_for")
+        self.leader_id = None
+        self.last_contact = time.monotonic()
+        self.timeout = self._random_timeout()
+        self.last_election_seconds = None
+
+    def _random_timeout(self):
+        return random.uniform(self.election_timeout, 2 * self.election_timeout)
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def _save_state(self):
+        """Durably record the term and vote. Caller holds self.lock."""
+        temp_file = f"{self.state_file}.tmp"
+        with open(temp_file, 'w') as file:
+            json.dump({"term": self.term, "voted_for": self.voted_for}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.state_file)
+
+    def get_leader(self):
+        """The current leader's node ID, or None during an election."""
+        return self.leader_id
+
+    def is_leader(self):
+        return self.leader_id == self.server_id
+
+    def election_due(self):
+        """True if this node should start an election now."""
+        if self.is_leader():
+            return False
+        if not self.peers:
+            return True
+        if self.leader_id is not None:
+            if not self.detector.suspects():
+                return False
+            with self.lock:
+                suspected, self.leader_id = self.leader_id, None
+                # A short random wait keeps followers that suspect the
+                # leader together from splitting the vote.
+                self.last_contact = time.monotonic()
+                self.timeout = random.uniform(0, self.election_timeout)
+            logger.info(f"Suspecting leader {suspected} (phi above {self.detector.threshold})\n")
+            LEADER_CHANGES.inc()
+            self.on_change(self.term, None)
+        return time.monotonic() - self.last_contact > self.timeout
+
+    def status(self):
+        return {"id": self.server_id, "term": self.term, "leader_id": self.leader_id,
+                "voted_for": self.voted_for, "last_election_seconds": self.last_election_seconds,
+                "phi": None if self.is_leader() else min(self.detector.phi(), 100)}
+
+    def observe(self, term, leader_id):
+        """Accept a message from `leader_id` as leader of `term`; False if that term is stale."""
+        with self.lock:
+            if term < self.term:
+                return False
+            changed = term != self.term or leader_id != self.leader_id
+            if term > self.term:
+                self.term = term
+                self.voted_for = None
+                self._save_state()
+            self.leader_id = leader_id
+            self.last_contact = time.monotonic()
+            if changed:
+                self.detector.reset(self.last_contact)
+            else:
+                self.detector.heartbeat(self.last_contact)
+        if changed:
+            logger.info(f"Following leader {leader_id} in term {term}\n")
+            LEADER_CHANGES.inc()
+            self.on_change(term, leader_id)
+        return True
+
+    def observe_term(self, term):
+        """Step down if a peer reports a term newer than ours."""
+        with self.lock:
+            if term <= self.term:
+                return
+            self.term = term
+            self.voted_for = None
+            self.leader_id = None
+            self.last_contact = time.monotonic()
+            self._save_state()
+        logger.info(f"Saw newer term {term}, waiting for its leader\n")
+        LEADER_CHANGES.inc()
+        self.on_change(term, None)
+
+    def handle_vote(self, ballot):
+        """Decide a vote request; returns {"term", "granted"}."""
+        with self.lock:
+            candidate = ballot["candidate"]
+            # Ignore candidates while a leader is trusted, so a node that was
+            # merely cut off cannot depose it; this also keeps leases safe.
+            leader_alive = self.leader_id is not None and (self.is_leader() or not self.detector.suspects())
+            if ballot["term"] < self.term or (leader_alive and self.leader_id != candidate):
+                return {"term": self.term, "granted": False}
+            if ballot["term"] > self.term:
+                self.term = ballot["term"]
+                self.voted_for = None
+                self.leader_id = None
+            up_to_date = (ballot["last_term"], ballot["last_index"]) >= self.log_position()
+            granted = up_to_date and self.voted_for in (None, candidate)
+            if granted:
+                self.voted_for = candidate
+                self.last_contact = time.monotonic()
+            self._save_state()
+            return {"term": self.term, "granted": granted}
+
+    def _begin_election(self):
+        with self.lock:
+            self.term += 1
+            self.voted_for = self.server_id
+            self.leader_id = None
+            self.last_contact = time.monotonic()
+            self.timeout = self._random_timeout()
+            self._save_state()
+            last_term, last_index = self.log_position()
+            return self.term, {"term": self.term, "candidate": self.server_id,
+                               "last_term": last_term, "last_index": last_index}
+
+    def _count_votes(self, term, responses, started):
+        """Become leader of `term` if a majority voted for us; True if we did."""
+        answered = [response for response in responses if response]
+        newest = max([response["term"] for response in answered] + [term])
+        if newest > term:
+            ELECTIONS.inc("stale_term")
+            self.observe_term(newest)
+            return False
+        votes = 1 + sum(1 for response in answered if response["granted"])
+        with self.lock:
+            if self.term != term or 2 * votes <= self.cluster_size:
+                logger.info(f"Election for term {term} failed with {votes} of {self.cluster_size} votes\n")
+                ELECTIONS.inc("lost")
+                return False
+            self.leader_id = self.server_id
+            self.last_election_seconds = time.monotonic() - started
+        logger.info(f"Elected leader for term {term} with {votes} of {self.cluster_size} votes "
+                    f"in {self.last_election_seconds * 1000:.1f} ms\n")
+        ELECTIONS.inc("won")
+        LEADER_CHANGES.inc()
+        self.on_change(term, self.server_id)
+        return True
+
+    def _request_vote(self, peer, ballot):
+        try:
+            response = self.client.post(f"{self.peer_url(peer)}/vote", "election", json=ballot)
+            if response.status_code == 200:
+                return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to request a vote from {peer}: {e}\n")
+        return None
+
+    def start_election(self):
+        """Run one election round, contacting all peers at once."""
+        started = time.monotonic()
+        term, ballot = self._begin_election()
+        logger.info(f"Server {self.server_id} starting election for term {term}\n")
+        with ThreadPoolExecutor(max_workers=max(1, len(self.peers))) as pool:
+            responses = list(pool.map(lambda peer: self._request_vote(peer, ballot), self.peers))
+        if self._count_votes(term, responses, started):
+            self.broadcast_leader()
+
+    def _notify(self, peer, announcement):
+        try:
+            response = self.client.post(f"{self.peer_url(peer)}/new_leader", "leader_broadcast", json=announcement)
+            logger.info(f"Notified {peer} about new leader: {self.server_id}\n")
+            if response.status_code == 409:
+                return response.json()["term"]
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to notify {peer} about new leader: {e}\n")
+        return None
 
     def broadcast_leader(self):
         logger.info("broadcasting new leader to peers\n")
-        for peer in self.peers:
-            if peer != f"{SERVER_ID}":
-                try:
-                    requests.post(f"http://{peer}.database-server.database.svc.cluster.local:5001/new_leader", json={"leader_ip": self.leader_ip}, timeout=5)
-                    logger.info(f"Notified {peer} about new leader: {self.leader_ip}\n")
-                except requests.exceptions.Timeout as e:
-                    logger.error(f"Failed to notify {peer} about new leader\n")
-                except requests.exceptions.ConnectionError as e:
-                    logger.error(f"Failed to notify {peer} about new leader\n")
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Failed to notify {peer} about new leader\n")
-                except Exception as e:
-                    logger.error(f"Failed to notify {peer} about new leader\n")
-
-    def get_leader(self,start_time):
-        """Returns the current leader IP or starts an election."""
-        if not self.leader_ip:
-            self.start_election(start_time)
-        return self.leader_ip
+        announcement = {"leader_id": self.server_id, "term": self.term}
+        with ThreadPoolExecutor(max_workers=max(1, len(self.peers))) as pool:
+            terms = list(pool.map(lambda peer: self._notify(peer, announcement), self.peers))
+        self.observe_term(max(filter(None, terms), default=0))
 
+
+class AsyncLeaderElection(LeaderElection):
+    """LeaderElection for the asyncio server: peers are contacted from the
+    event loop with an AsyncHttpClient."""
+
+    async def _request_vote(self, peer, ballot):
+        try:
+            response = await self.client.post(f"{self.peer_url(peer)}/vote", "election", json=ballot)
+            if response.status_code == 200:
+                return response.json()
+        except Exception as e:
+            logger.error(f"Failed to request a vote from {peer}: {e}\n")
+        return None
+
+    async def start_election(self):
+        started = time.monotonic()
+        term, ballot = self._begin_election()
+        logger.info(f"Server {self.server_id} starting election for term {term}\n")
+        responses = await asyncio.gather(*(self._request_vote(peer, ballot) for peer in self.peers))
+        if self._count_votes(term, responses, started):
+            await self.broadcast_leader()
+
+    async def _notify(self, peer, announcement):
+        try:
+            response = await self.client.post(f"{self.peer_url(peer)}/new_leader", "leader_broadcast", json=announcement)
+            logger.info(f"Notified {peer} about new leader: {self.server_id}\n")
+            if response.status_code == 409:
+                return response.json()["term"]
+        except Exception as e:
+            logger.error(f"Failed to notify {peer} about new leader: {e}\n")
+        return None
+
+    async def broadcast_leader(self):
+        logger.info("broadcasting new leader to peers\n")
+        announcement = {"leader_id": self.server_id, "term": self.term}
+        terms = await asyncio.gather(*(self._notify(peer, announcement) for peer in self.peers))
+        self.observe_term(max(filter(None, terms), default=0))
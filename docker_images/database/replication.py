@@ -0,0 +1,285 @@
+import asyncio
+import collections
+import heapq
+import itertools
+import threading
+import time
+import logging
+import requests
+
+import tracing
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QuorumTimeout(Exception):
+    pass
+
+
+def _batch_span(spans, batch):
+    """Take the spans of requests whose entries `batch` carries; returns the first. Caller holds the channel's lock."""
+    first = None
+    while spans and spans[0][0] <= batch[-1]["index"]:
+        span = spans.popleft()[1]
+        first = first or span
+    return first
+
+
+class FollowerChannel:
+    """Streams log entries to one follower over the shared keep-alive client.
+
+    Entries stay queued until the follower acknowledges them, so a follower
+    that is slow or briefly unreachable catches up on its own without
+    holding up the leader. Each batch is traced as part of the first traced
+    request whose entries it carries.
+    """
+
+    def __init__(self, peer, url, client, on_ack, message, max_batch=512, max_pending=100000):
+        self.peer = peer
+        self.url = url
+        self.client = client
+        self.on_ack = on_ack
+        self.message = message
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        # (last index, span) of the traced requests whose entries are queued.
+        self.spans = collections.deque(maxlen=1000)
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, entries):
+        with self.condition:
+            if len(self.pending) + len(entries) > self.max_pending:
+                # The follower detects the gap and resynchronizes itself.
+                logger.error(f"Replication queue for {self.peer} overflowed, dropping {len(self.pending)} entries\n")
+                self.pending.clear()
+            self.pending.extend(entries)
+            span = tracing.current()
+            if span is not None:
+                self.spans.append((entries[-1]["index"], span))
+            self.condition.notify()
+
+    def clear(self):
+        with self.condition:
+            self.pending.clear()
+            self.spans.clear()
+
+    def _run(self):
+        backoff = 0.05
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                batch = list(itertools.islice(self.pending, self.max_batch))
+                span = _batch_span(self.spans, batch)
+            sent_at = time.monotonic()
+            try:
+                with tracing.span("replicate", parent=span, follower=self.peer, entries=len(batch)):
+                    response = self.client.post(f"{self.url}/replicate_batch", "replication",
+                                                json=dict(self.message(batch[0]["index"] - 1), records=batch))
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Failed to replicate to {self.peer}: {e}\n")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 2)
+                continue
+            backoff = 0.05
+            with self.condition:
+                # send() may have cleared the queue while the batch was in flight.
+                while self.pending and self.pending[0]["index"] <= batch[-1]["index"]:
+                    self.pending.popleft()
+            self.on_ack(self.peer, batch[-1]["index"], sent_at)
+
+
+class AsyncFollowerChannel:
+    """FollowerChannel for the asyncio server: one task on the event loop per follower.
+
+    `send` may be called from any thread, such as the group-commit thread.
+    Must be created on the running event loop with an AsyncHttpClient.
+    """
+
+    def __init__(self, peer, url, client, on_ack, message, max_batch=512, max_pending=100000):
+        self.peer = peer
+        self.url = url
+        self.client = client
+        self.on_ack = on_ack
+        self.message = message
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        self.spans = collections.deque(maxlen=1000)
+        self.lock = threading.Lock()
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = self.loop.create_task(self._run())
+
+    def send(self, entries):
+        with self.lock:
+            if len(self.pending) + len(entries) > self.max_pending:
+                logger.error(f"Replication queue for {self.peer} overflowed, dropping {len(self.pending)} entries\n")
+                self.pending.clear()
+            self.pending.extend(entries)
+            span = tracing.current()
+            if span is not None:
+                self.spans.append((entries[-1]["index"], span))
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.spans.clear()
+
+    async def _run(self):
+        backoff = 0.05
+        while True:
+            await self.wakeup.wait()
+            with self.lock:
+                if not self.pending:
+                    self.wakeup.clear()
+                    continue
+                batch = list(itertools.islice(self.pending, self.max_batch))
+                span = _batch_span(self.spans, batch)
+            sent_at = time.monotonic()
+            try:
+                with tracing.span("replicate", parent=span, follower=self.peer, entries=len(batch)):
+                    response = await self.client.post(f"{self.url}/replicate_batch", "replication",
+                                                      json=dict(self.message(batch[0]["index"] - 1), records=batch))
+                    response.raise_for_status()
+            except Exception as e:
+                logger.error(f"Failed to replicate to {self.peer}: {e}\n")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 2)
+                continue
+            backoff = 0.05
+            with self.lock:
+                while self.pending and self.pending[0]["index"] <= batch[-1]["index"]:
+                    self.pending.popleft()
+            self.on_ack(self.peer, batch[-1]["index"], sent_at)
+
+
+class Replicator:
+    """Fans log entries out to every follower concurrently and tracks acknowledgements.
+
+    `quorum` counts the leader itself; it defaults to a majority of the cluster.
+    `channel` is the follower channel class, FollowerChannel or AsyncFollowerChannel.
+    """
+
+    def __init__(self, peers, server_id, peer_url, client, quorum=None, timeout=2, channel=FollowerChannel):
+        self.server_id = server_id
+        self.timeout = timeout
+        self.term = 0
+        # Set by the Database to look up the term of a log entry.
+        self.term_at = lambda index: None
+        self.condition = threading.Condition()
+        self.waiters = []
+        self.waiter_ids = itertools.count()
+        self.last_index = 0
+        self.match_index = {}
+        self.last_contact = {}
+        self.last_heartbeat = {}
+        self.followers = {}
+        for peer in peers:
+            if peer != server_id:
+                self.match_index[peer] = 0
+                self.last_contact[peer] = float("-inf")
+                self.last_heartbeat[peer] = float("-inf")
+                self.followers[peer] = channel(peer, peer_url(peer), client, self._on_ack, self.message)
+        self.quorum = quorum or (len(self.followers) + 1) // 2 + 1
+
+    def replicate(self, entries):
+        """Queue entries for every follower without waiting for them to be sent."""
+        self.last_index = entries[-1]["index"]
+        for follower in self.followers.values():
+            follower.send(entries)
+
+    def reset(self, term, last_index):
+        """Start over in `term`: forget follower progress and drop anything still queued for them."""
+        with self.condition:
+            self.term = term
+            self.last_index = last_index
+            for peer in self.match_index:
+                self.match_index[peer] = 0
+                self.last_contact[peer] = float("-inf")
+                self.last_heartbeat[peer] = float("-inf")
+            self.waiters = []
+            self.condition.notify_all()
+        for follower in self.followers.values():
+            follower.clear()
+
+    def message(self, prev_index):
+        """Leader state sent with each batch and heartbeat.
+
+        prev_index/prev_term identify the entry just before the batch, so a
+        follower can tell whether its log agrees with the leader's up to there.
+        """
+        return {"term": self.term, "leader_id": self.server_id, "commit_index": self.commit_index(),
+                "prev_index": prev_index, "prev_term": self.term_at(prev_index)}
+
+    def _on_ack(self, peer, index, sent_at):
+        committed = []
+        with self.condition:
+            self.match_index[peer] = max(self.match_index[peer], index)
+            self.condition.notify_all()
+            commit_index = self.commit_index()
+            while self.waiters and self.waiters[0][0] <= commit_index:
+                committed.append(heapq.heappop(self.waiters)[2])
+        self.record_contact(peer, sent_at)
+        for callback in committed:
+            callback()
+
+    def record_contact(self, peer, sent_at):
+        """Note that `peer` answered a request the leader sent at monotonic time `sent_at`."""
+        self.last_contact[peer] = max(self.last_contact[peer], sent_at)
+
+    def idle_followers(self, interval):
+        """Followers that need a heartbeat: neither replication nor a heartbeat reached them
+        within `interval` seconds. They are marked as heartbeated now."""
+        now = time.monotonic()
+        idle = [peer for peer in self.followers
+                if now - max(self.last_contact[peer], self.last_heartbeat[peer]) >= interval]
+        for peer in idle:
+            self.last_heartbeat[peer] = now
+        return idle
+
+    def lag(self):
+        """Per follower, the entries it is behind this leader and the seconds since it last answered."""
+        now = time.monotonic()
+        return {peer: (self.last_index - match, now - self.last_contact[peer])
+                for peer, match in self.match_index.items()}
+
+    def has_lease(self, duration):
+        """True if a quorum answered within `duration` seconds, so no other leader can have been elected."""
+        now = time.monotonic()
+        recent = sum(1 for contact in self.last_contact.values() if now - contact < duration)
+        return 1 + recent >= self.quorum
+
+    def commit_index(self):
+        """Highest index held by a quorum of nodes."""
+        indexes = sorted([self.last_index] + list(self.match_index.values()), reverse=True)
+        return indexes[self.quorum - 1]
+
+    def _acks(self, index):
+        return 1 + sum(1 for match in self.match_index.values() if match >= index)
+
+    def wait_for_quorum(self, index, timeout=None):
+        """Block until `quorum` nodes hold `index`; raise QuorumTimeout otherwise."""
+        with tracing.span("replication.wait_for_quorum", index=index, waits_on="replicate"), self.condition:
+            if not self.condition.wait_for(lambda: self._acks(index) >= self.quorum,
+                                           timeout if timeout is not None else self.timeout):
+                raise QuorumTimeout(f"Entry {index} acknowledged by {self._acks(index)} of {self.quorum} required nodes")
+
+    def on_quorum(self, index, callback):
+        """Call `callback()` once `quorum` nodes hold `index`, without blocking a thread.
+
+        The callback runs on whichever thread records the deciding acknowledgement,
+        or immediately if a quorum already holds `index`.
+        """
+        with self.condition:
+            if self._acks(index) < self.quorum:
+                heapq.heappush(self.waiters, (index, next(self.waiter_ids), callback))
+                return
+        callback()
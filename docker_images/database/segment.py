@@ -0,0 +1,245 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+MAGIC = b"AUCSEG01"
+# Footer: byte offset of the JSON descriptor, then MAGIC.
+FOOTER = struct.Struct("<Q8s")
+# Marks a key deleted since the segment was written.
+DELETED = object()
+MISSING = object()
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+class Segment:
+    """A read-only snapshot file, memory-mapped and searched in place.
+
+    Each table stores its records sorted by key, back to back, with an
+    array of record offsets and one of key lengths, so a lookup is a binary
+    search over the mapped file that decodes only the record it returns.
+    Opening a segment reads nothing but its descriptor, however many
+    records it holds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        descriptor_offset, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot segment")
+        self.descriptor = json.loads(self.map[descriptor_offset:len(self.map) - FOOTER.size])
+        view = memoryview(self.map)
+        self.tables = {}
+        for name, table in self.descriptor["tables"].items():
+            count = table["count"]
+            offsets = view[table["offsets"]:table["offsets"] + 8 * (count + 1)].cast('Q')
+            key_lengths = view[table["key_lengths"]:table["key_lengths"] + 4 * count].cast('I')
+            self.tables[name] = (offsets, key_lengths)
+
+    @property
+    def wal_offset(self):
+        return self.descriptor["wal_offset"]
+
+    def count(self, table):
+        return len(self.tables[table][1]) if table in self.tables else 0
+
+    def _key(self, table, position):
+        offsets, key_lengths = self.tables[table]
+        start = offsets[position]
+        return self.map[start:start + key_lengths[position]]
+
+    def _value(self, table, position):
+        offsets, key_lengths = self.tables[table]
+        return self.map[offsets[position] + key_lengths[position]:offsets[position + 1]]
+
+    def _bisect(self, table, key):
+        """Position of the first record whose key is not below `key`."""
+        low, high = 0, self.count(table)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(table, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, table, key):
+        """The encoded value stored under `key` (bytes), or None."""
+        position = self._bisect(table, key)
+        if position < self.count(table) and self._key(table, position) == key:
+            return self._value(table, position)
+        return None
+
+    def items(self, table, prefix=b""):
+        """Yield (key, encoded value) in key order, for the keys starting with `prefix`."""
+        for position in range(self._bisect(table, prefix) if prefix else 0, self.count(table)):
+            key = self._key(table, position)
+            if not key.startswith(prefix):
+                break
+            yield key, self._value(table, position)
+
+
+def write_segment(path, tables, descriptor):
+    """Write a segment from {name: iterable of (key bytes, value bytes) sorted by key}, durably and atomically."""
+    temp_file = f"{path}.tmp"
+    descriptor = dict(descriptor, tables={})
+    with open(temp_file, 'wb') as file:
+        position = 0
+        for name, items in tables.items():
+            offsets, key_lengths = array('Q'), array('I')
+            for key, value in items:
+                offsets.append(position)
+                key_lengths.append(len(key))
+                file.write(key)
+                file.write(value)
+                position += len(key) + len(value)
+            offsets.append(position)
+            padding = -position % 8
+            file.write(b"\0" * padding)
+            position += padding
+            descriptor["tables"][name] = {"count": len(key_lengths), "offsets": position,
+                                          "key_lengths": position + 8 * len(offsets)}
+            file.write(offsets.tobytes())
+            file.write(key_lengths.tobytes())
+            position += 8 * len(offsets) + 4 * len(key_lengths)
+            padding = -position % 8
+            file.write(b"\0" * padding)
+            position += padding
+        file.write(_encode(descriptor))
+        file.write(FOOTER.pack(position, MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def merge(segment_items, changes):
+    """Merge a segment's sorted (key, value bytes) with changed records {key: value or DELETED}."""
+    changed = sorted((key.encode(), value) for key, value in changes.items())
+    position = 0
+    for key, encoded in segment_items:
+        while position < len(changed) and changed[position][0] < key:
+            if changed[position][1] is not DELETED:
+                yield changed[position][0], _encode(changed[position][1])
+            position += 1
+        if position < len(changed) and changed[position][0] == key:
+            if changed[position][1] is not DELETED:
+                yield key, _encode(changed[position][1])
+            position += 1
+        else:
+            yield key, encoded
+    for key, value in changed[position:]:
+        if value is not DELETED:
+            yield key, _encode(value)
+
+
+class SegmentTable(MutableMapping):
+    """A table read from a Segment, with the changes since it was written kept in memory.
+
+    Lookups check the changes, then a cache of records already decoded,
+    then the segment. Mutations are made under the database lock; reads
+    take no lock.
+    """
+
+    def __init__(self, segment, name):
+        self.segment = segment
+        self.name = name
+        self.changes = {}
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.count = segment.count(name) if segment else 0
+
+    def _stored(self, key):
+        segment = self.segment
+        if segment is None:
+            return None
+        return segment.get(self.name, key.encode())
+
+    def __getitem__(self, key):
+        # Cache into the dict this read started with: rebase() swaps in a new
+        # one, so a value read from the old segment cannot outlive it.
+        cache = self.cache
+        value = self.changes.get(key, MISSING)
+        if value is MISSING:
+            value = cache.get(key, MISSING)
+        if value is DELETED:
+            raise KeyError(key)
+        if value is not MISSING:
+            return value
+        encoded = self._stored(key)
+        if encoded is None:
+            raise KeyError(key)
+        value = cache[key] = json.loads(encoded)
+        return value
+
+    def __contains__(self, key):
+        value = self.changes.get(key, MISSING)
+        if value is not MISSING:
+            return value is not DELETED
+        return key in self.cache or self._stored(key) is not None
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key not in self:
+                self.count += 1
+            self.changes[key] = value
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.count -= 1
+            self.changes[key] = DELETED
+            self.cache.pop(key, None)
+
+    def __iter__(self):
+        changes = dict(self.changes)
+        if self.segment is not None:
+            for key, _ in self.segment.items(self.name):
+                key = key.decode()
+                if key not in changes:
+                    yield key
+        for key, value in changes.items():
+            if value is not DELETED:
+                yield key
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        """Yield (key, value) pairs, decoding stored records without caching them."""
+        changes = dict(self.changes)
+        if self.segment is not None:
+            for key, encoded in self.segment.items(self.name):
+                key = key.decode()
+                if key not in changes:
+                    yield key, json.loads(encoded)
+        for key, value in changes.items():
+            if value is not DELETED:
+                yield key, value
+
+    def freeze(self):
+        """A copy of the changes, for writing the next segment."""
+        with self.lock:
+            return dict(self.changes)
+
+    def rebase(self, segment, frozen):
+        """Switch to `segment`, which holds the `frozen` changes; later changes are kept."""
+        with self.lock:
+            self.segment = segment
+            for key, value in frozen.items():
+                if self.changes.get(key) is value:
+                    del self.changes[key]
+            self.cache = {}
@@ -0,0 +1,246 @@
+import glob
+import heapq
+import json
+import os
+import sqlite3
+import threading
+
+from segment import DELETED, Segment, SegmentTable, merge, write_segment
+
+# Auction fields find_auctions can look up; the SQLite and snapshot engines index each of them.
+AUCTION_INDEX_FIELDS = ("creator", "highest_bidder")
+
+
+def _dump(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _write_atomically(path, text):
+    temp_file = f"{path}.tmp"
+    with open(temp_file, 'w') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, path)
+
+
+class JsonStore:
+    """Each table as one compact JSON file, rewritten whole at a checkpoint.
+
+    Mutations only reach the files at a checkpoint; until then the
+    write-ahead log holds them. find_auctions scans every auction.
+    """
+
+    def __init__(self, directory=".", db_types=()):
+        self.paths = {db_type: os.path.join(directory, f"{db_type}.json") for db_type in db_types}
+        self.checkpoint_file = os.path.join(directory, "checkpoint.json")
+        self.tables = {}
+
+    def _read(self, path):
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def load(self):
+        """Return the stored tables and the write-ahead log offset they are current up to.
+
+        The caller keeps applying mutations to the returned dicts.
+        """
+        self.tables = {db_type: self._read(path) for db_type, path in self.paths.items()}
+        return self.tables, self._read(self.checkpoint_file).get("wal_offset", 0)
+
+    def apply(self, entries, wal_offset):
+        pass
+
+    def checkpoint(self, wal_offset):
+        """Write out the tables, which reflect the log up to `wal_offset`. Caller blocks mutations.
+
+        Engines may return a function finishing the checkpoint, which the
+        caller runs once mutations are allowed again; this one does not.
+        """
+        for db_type, path in self.paths.items():
+            _write_atomically(path, _dump(self.tables[db_type]))
+        # Written last: a crash before it only replays log entries the tables already hold.
+        _write_atomically(self.checkpoint_file, _dump({"wal_offset": wal_offset}))
+
+    def find_auctions(self, field, value, limit):
+        if field not in AUCTION_INDEX_FIELDS:
+            raise ValueError(f"Cannot search auctions by {field}")
+        matches = sorted(key for key, auction in self.tables["bids"].items()
+                         if isinstance(auction, dict) and auction.get(field) == value)
+        return [dict(self.tables["bids"][key], id=key) for key in matches[:limit]]
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """Tables in an embedded SQLite database, updated with every log append.
+
+    Values are stored as JSON text, and partial indexes on the auctions'
+    AUCTION_INDEX_FIELDS answer find_auctions without a scan. Commits do not
+    wait for fsync (WAL journal, synchronous=NORMAL): a commit lost in a
+    crash is redone from the write-ahead log, since the log offset is saved
+    in the same transaction.
+    """
+
+    def __init__(self, directory=".", db_types=()):
+        self.db_types = db_types
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, "database.sqlite"), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS records (db_type TEXT NOT NULL, key TEXT NOT NULL, "
+                                    "value TEXT NOT NULL, PRIMARY KEY (db_type, key)) WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for field in AUCTION_INDEX_FIELDS:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS bids_by_{field} ON records "
+                                        f"(json_extract(value, '$.{field}')) WHERE db_type = 'bids'")
+
+    def load(self):
+        """Return the stored tables and the write-ahead log offset they are current up to."""
+        with self.lock:
+            tables = {}
+            for db_type in self.db_types:
+                # One JSON document per table parses much faster than a json.loads per row.
+                row = self.connection.execute("SELECT json_group_object(key, json(value)) FROM records "
+                                              "WHERE db_type = ?", (db_type,)).fetchone()
+                tables[db_type] = json.loads(row[0])
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'wal_offset'").fetchone()
+        return tables, row[0] if row else 0
+
+    def apply(self, entries, wal_offset):
+        """Apply one group of log entries; the log holds them up to `wal_offset`."""
+        with self.lock, self.connection:
+            for entry in entries:
+                op = entry.get("op", "put")
+                if op == "put":
+                    self.connection.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+                                            (entry["db_type"], entry["key"], _dump(entry["value"])))
+                elif op == "bid":
+                    self.connection.execute("UPDATE records SET value = json_set(value, '$.highest_bid', ?, "
+                                            "'$.highest_bidder', ?) WHERE db_type = 'bids' AND key = ?",
+                                            (entry["amount"], entry["bidder"], entry["key"]))
+                elif op in ("delete", "archive"):
+                    # An archived auction lives on in the database's archive only.
+                    self.connection.execute("DELETE FROM records WHERE db_type = ? AND key = ?",
+                                            (entry["db_type"], entry["key"]))
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('wal_offset', ?)", (wal_offset,))
+
+    def checkpoint(self, wal_offset):
+        """Make every applied entry durable in the database file itself."""
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def find_auctions(self, field, value, limit):
+        if field not in AUCTION_INDEX_FIELDS:
+            raise ValueError(f"Cannot search auctions by {field}")
+        with self.lock:
+            rows = self.connection.execute(f"SELECT key, value FROM records WHERE db_type = 'bids' AND "
+                                           f"json_extract(value, '$.{field}') = ? ORDER BY key LIMIT ?",
+                                           (value, limit)).fetchall()
+        return [dict(json.loads(value), id=key) for key, value in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SnapshotStore:
+    """Point-in-time snapshots of the tables in segment files (see segment.py).
+
+    load() memory-maps the newest snapshot without reading its records, so
+    a restart takes about as long at a million records as at ten thousand;
+    records are decoded when first read. Between snapshots, mutations live
+    in memory and in the write-ahead log only. A checkpoint copies the
+    changes since the last snapshot while mutations are blocked, then
+    writes the next snapshot after they resume, carrying unchanged records
+    over without decoding them. Each snapshot holds sorted index tables
+    for AUCTION_INDEX_FIELDS.
+    """
+
+    def __init__(self, directory=".", db_types=()):
+        self.directory = directory
+        self.db_types = db_types
+        self.tables = {}
+        for temp_file in glob.glob(os.path.join(directory, "snapshot-*.seg.tmp")):
+            os.remove(temp_file)
+        # Named by log offset, which only grows, so the newest sorts last.
+        paths = sorted(glob.glob(os.path.join(directory, "snapshot-*.seg")))
+        self.segment = Segment(paths[-1]) if paths else None
+
+    def load(self):
+        """Return the tables and the write-ahead log offset they are current up to."""
+        self.tables = {db_type: SegmentTable(self.segment, db_type) for db_type in self.db_types}
+        return self.tables, self.segment.wal_offset if self.segment else 0
+
+    def apply(self, entries, wal_offset):
+        pass
+
+    def checkpoint(self, wal_offset):
+        """Freeze the changes up to `wal_offset` (caller blocks mutations); the returned function writes them."""
+        if self.segment is not None and self.segment.wal_offset == wal_offset:
+            return None
+        frozen = {db_type: table.freeze() for db_type, table in self.tables.items()}
+        return lambda: self._write_snapshot(frozen, wal_offset)
+
+    def _write_snapshot(self, frozen, wal_offset):
+        previous = self.segment
+        tables = {db_type: merge(previous.items(db_type) if previous else (), frozen[db_type])
+                  for db_type in self.db_types}
+        if "bids" in frozen:
+            for field in AUCTION_INDEX_FIELDS:
+                tables[f"bids.{field}"] = self._index_items(previous, field, frozen["bids"])
+        path = os.path.join(self.directory, f"snapshot-{wal_offset:020d}.seg")
+        write_segment(path, tables, {"wal_offset": wal_offset})
+        self.segment = Segment(path)
+        for db_type, table in self.tables.items():
+            table.rebase(self.segment, frozen[db_type])
+        if previous is not None:
+            # Readers still holding the old map keep it until they finish.
+            os.remove(previous.path)
+
+    @staticmethod
+    def _index_items(previous, field, changes):
+        """Index entries b"<value>\\0<key>" for `field`: the previous snapshot's, updated with `changes`."""
+        kept = ((entry, b"") for entry, _ in (previous.items(f"bids.{field}") if previous else ())
+                if entry.rpartition(b"\0")[2].decode() not in changes)
+        added = sorted((f"{auction[field]}\0{key}".encode(), b"") for key, auction in changes.items()
+                       if isinstance(auction, dict) and isinstance(auction.get(field), str))
+        return heapq.merge(kept, added)
+
+    def find_auctions(self, field, value, limit):
+        if field not in AUCTION_INDEX_FIELDS:
+            raise ValueError(f"Cannot search auctions by {field}")
+        bids = self.tables["bids"]
+        # Changes first: a snapshot written meanwhile already holds them.
+        changes = dict(bids.changes)
+        segment = bids.segment
+        prefix = f"{value}\0".encode()
+        matches = {key for key, auction in changes.items()
+                   if auction is not DELETED and isinstance(auction, dict) and auction.get(field) == value}
+        if segment is not None:
+            matches.update(key for key in (entry[len(prefix):].decode() for entry, _ in
+                                           segment.items(f"bids.{field}", prefix)) if key not in changes)
+        auctions = []
+        for key in sorted(matches):
+            auction = bids.get(key)
+            if auction is not None and auction.get(field) == value:
+                auctions.append(dict(auction, id=key))
+                if len(auctions) == limit:
+                    break
+        return auctions
+
+    def close(self):
+        pass
+
+
+STORAGE_ENGINES = {"json": JsonStore, "sqlite": SqliteStore, "snapshot": SnapshotStore}
+
+
+def open_store(engine, directory=".", db_types=()):
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine: {engine}")
+    return STORAGE_ENGINES[engine](directory, db_types)
@@ -0,0 +1,187 @@
+import json
+import os
+import logging
+import shutil
+from array import array
+from bisect import bisect_right
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Byte offsets are remembered for roughly one in this many entries.
+OFFSET_INTERVAL = 1000
+
+
+class LogCompacted(Exception):
+    """The requested entries are no longer in the log; fetch a snapshot instead."""
+
+
+class WriteAheadLog:
+    """Append-only log of database mutations, one JSON entry per line.
+
+    A {"op": "snapshot"} entry marks the point where a follower installed a
+    snapshot; entries before it cannot be served to other nodes. Compaction
+    replaces the entries up to some index with such a marker.
+
+    Offsets handed out (replay, end_offset) are logical: they keep growing
+    across compactions, so a storage engine's saved offset stays valid.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_index = 0
+        self.start_index = 0
+        self.size = 0
+        # Logical offset of the first byte of the file.
+        self.base = 0
+        self.offset_indexes = array('q')
+        self.offset_positions = array('q')
+        self._file = None
+
+    def _note_offset(self, index, position):
+        if not self.offset_indexes or index >= self.offset_indexes[-1] + OFFSET_INTERVAL:
+            self.offset_indexes.append(index)
+            self.offset_positions.append(position)
+
+    def _note_entry(self, entry, group_offset):
+        self.last_index = entry["index"]
+        if entry.get("op") == "snapshot":
+            self.start_index = entry["index"]
+            # Installing a snapshot can move the log back to an earlier index;
+            # only entries from the snapshot on are ever read again.
+            self.offset_indexes = array('q', [entry["index"]])
+            self.offset_positions = array('q', [group_offset])
+
+    @property
+    def end_offset(self):
+        return self.base + self.size
+
+    def replay(self):
+        """Yield (logical offset, entry) for every intact entry in the log, in order."""
+        if not os.path.exists(self.path):
+            return
+        good_offset = 0
+        previous_index = None
+        group_offset = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash can only be the last line.
+                    logger.error(f"Discarding corrupt tail of write-ahead log {self.path}\n")
+                    break
+                if entry["index"] != previous_index:
+                    self._note_offset(entry["index"], good_offset)
+                    previous_index = entry["index"]
+                    group_offset = good_offset
+                if good_offset == 0 and "next_offset" in entry:
+                    # Left by compact(): the next line keeps its logical offset.
+                    self.base = entry["next_offset"] - len(line)
+                offset = good_offset
+                good_offset += len(line)
+                self._note_entry(entry, group_offset)
+                yield self.base + offset, entry
+        if good_offset != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as file:
+                file.truncate(good_offset)
+        self.size = good_offset
+
+    def append(self, entries):
+        """Durably append entries; each must already carry its log index."""
+        if not entries:
+            return self.last_index
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        lines = [json.dumps(entry, separators=(',', ':')).encode() + b"\n" for entry in entries]
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._note_offset(entries[0]["index"], self.size)
+        group_offset = self.size
+        for entry, line in zip(entries, lines):
+            if entry["index"] != self.last_index:
+                group_offset = self.size
+            self.size += len(line)
+            self._note_entry(entry, group_offset)
+        return self.last_index
+
+    def read_after(self, after, limit):
+        """Return up to about `limit` entries with an index above `after`.
+
+        Entries sharing an index are never split across calls.
+        """
+        if after < self.start_index:
+            raise LogCompacted(f"Log starts at index {self.start_index}")
+        position = bisect_right(self.offset_indexes, after + 1) - 1
+        offset = self.offset_positions[position] if position >= 0 else 0
+        end = self.size
+        entries = []
+        if end == 0:
+            return entries
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            while file.tell() < end:
+                entry = json.loads(file.readline())
+                if entry["index"] <= after:
+                    continue
+                if len(entries) >= limit and entry["index"] != entries[-1]["index"]:
+                    break
+                entries.append(entry)
+        return entries
+
+    def _position_after(self, index):
+        """File position of the first entry with an index above `index`, or None."""
+        position = bisect_right(self.offset_indexes, index + 1) - 1
+        offset = self.offset_positions[position] if position >= 0 else 0
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            while offset < self.size:
+                line = file.readline()
+                if json.loads(line)["index"] > index:
+                    return offset
+                offset += len(line)
+        return None
+
+    def compact(self, keep_after, term, before_offset):
+        """Drop the entries up to index `keep_after`, whose term is `term`, if they
+        all lie before logical offset `before_offset`; True if it did.
+
+        The log is rewritten to start with a snapshot marker at `keep_after`.
+        """
+        if keep_after <= self.start_index:
+            return False
+        position = self._position_after(keep_after)
+        if position is None or self.base + position > before_offset:
+            return False
+        marker = {"op": "snapshot", "index": keep_after, "term": term, "next_offset": self.base + position}
+        line = json.dumps(marker, separators=(',', ':')).encode() + b"\n"
+        temp_file = f"{self.path}.tmp"
+        with open(self.path, 'rb') as source, open(temp_file, 'wb') as target:
+            target.write(line)
+            source.seek(position)
+            shutil.copyfileobj(source, target)
+            target.flush()
+            os.fsync(target.fileno())
+        self.close()
+        os.replace(temp_file, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        shift = len(line) - position
+        kept = [(index, offset + shift) for index, offset in zip(self.offset_indexes, self.offset_positions)
+                if index > keep_after and offset >= position]
+        self.offset_indexes = array('q', [keep_after] + [index for index, _ in kept])
+        self.offset_positions = array('q', [0] + [offset for _, offset in kept])
+        self.base += position - len(line)
+        self.size += shift
+        self.start_index = keep_after
+        return True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
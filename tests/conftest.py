@@ -0,0 +1,16 @@
+"""Lets unit tests import the database and auction service modules directly."""
+import os
+import sys
+
+import logging
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# database.py finds its shard from these at import, as a single-node shard;
+# nodes started by local_cluster are given their own.
+os.environ.setdefault("MY_POD_NAME", "test-0")
+os.environ.setdefault("PEERS", "test-0")
+for module_dir in ("auction", "database", "common"):
+    sys.path.insert(0, os.path.join(ROOT, "docker_images", module_dir))
+
+logging.disable(logging.INFO)
@@ -0,0 +1,65 @@
+"""ExpiryIndex ordering and paging of live auctions.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import time
+
+from auction_index import AUCTION_DURATION, TIME_FORMAT, ExpiryIndex, expiry_time
+
+NOW = 1_700_000_000.0
+
+
+def auction(created):
+    return {"created_time": time.strftime(TIME_FORMAT, time.localtime(created)), "starting_bid": 1.0}
+
+
+def index_of(created_times):
+    index = ExpiryIndex()
+    for auction_id, created in created_times.items():
+        index.update(auction_id, auction(created))
+    return index
+
+
+def test_expiry_time():
+    assert expiry_time(auction(NOW)) == NOW + AUCTION_DURATION.total_seconds()
+    for record in ("text", {}, {"created_time": "yesterday"}, {"created_time": 5}):
+        assert expiry_time(record) is None
+
+
+def test_pages_follow_expiry_order():
+    index = index_of({f"a{i}": NOW - i * 60 for i in range(10)})
+    ids, cursor = index.active(NOW, limit=4)
+    assert ids == ["a9", "a8", "a7", "a6"]
+    ids, cursor = index.active(NOW, cursor, limit=4)
+    assert ids == ["a5", "a4", "a3", "a2"]
+    ids, cursor = index.active(NOW, cursor, limit=4)
+    assert ids == ["a1", "a0"] and cursor is None
+
+
+def test_expired_auctions_are_skipped_until_closed():
+    day = AUCTION_DURATION.total_seconds()
+    index = index_of({"old": NOW - day - 60, "live": NOW})
+    assert index.active(NOW) == (["live"], None)
+    assert [auction_id for _, auction_id in index.expired(NOW, 10)] == ["old"]
+    index.remove("old")
+    assert index.expired(NOW, 10) == [] and len(index) == 1
+
+
+def test_updates_move_and_drop_auctions():
+    index = index_of({"a": NOW, "b": NOW - 60})
+    index.update("b", auction(NOW + 60))
+    assert index.active(NOW)[0] == ["a", "b"]
+    index.update("a", "no longer an auction")
+    assert index.active(NOW)[0] == ["b"]
+
+
+def test_add_many_merges_with_existing_entries():
+    index = index_of({"b": NOW})
+    index.add_many(sorted((expiry_time(auction(NOW + i)), f"m{i}") for i in (-60, 60)))
+    assert index.active(NOW)[0] == ["m-60", "b", "m60"]
+
+
+def test_limit_below_one_returns_an_empty_page():
+    index = index_of({"a": NOW, "b": NOW})
+    assert index.active(NOW, limit=-5) == ([], None)
+    assert index.active(NOW, limit=0) == ([], None)
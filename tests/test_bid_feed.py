@@ -0,0 +1,50 @@
+"""BidFeed fan-out of bid changes to an auction's viewers.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import threading
+import time
+
+from bid_feed import BidFeed
+
+
+def feed():
+    # No shards, so nothing is followed; changes are published by the tests.
+    return BidFeed(None, 0, "changes")
+
+
+def bid(index, key, amount):
+    return {"index": index, "op": "bid", "key": key, "value": {"highest_bid": amount}}
+
+
+def test_latest_returns_the_newest_change_without_waiting():
+    bids = feed()
+    assert bids.latest("lamp", 0) is None
+    bids._publish(bid(3, "lamp", 10))
+    bids._publish(bid(5, "lamp", 12))
+    index, event, closed = bids.latest("lamp", 0)
+    assert index == 5 and "event: bid" in event and '"highest_bid": 12' in event and not closed
+    assert bids.latest("lamp", 5) is None
+
+
+def test_viewers_of_an_auction_share_its_changes():
+    bids = feed()
+    results = []
+    viewers = [threading.Thread(target=lambda: results.append(bids.wait("lamp", 0, 5))) for _ in range(3)]
+    for viewer in viewers:
+        viewer.start()
+    while bids.viewers() < 3:
+        time.sleep(0.001)
+    bids._publish(bid(7, "lamp", 15))
+    for viewer in viewers:
+        viewer.join()
+    assert [result[0] for result in results] == [7, 7, 7]
+    assert len({id(result[1]) for result in results}) == 1
+    assert bids.viewers() == 0
+
+
+def test_closing_is_reported():
+    bids = feed()
+    bids._publish({"index": 9, "op": "archive", "key": "lamp", "value": {"winner": "alice"}})
+    index, event, closed = bids.wait("lamp", 0, 0)
+    assert index == 9 and closed and event.startswith("id: 9\nevent: closed\n")
@@ -0,0 +1,92 @@
+"""BidLedger encoding, queries and recovery from a crash mid-append.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import tempfile
+
+import pytest
+
+from bid_ledger import RECORD, BidLedger
+
+
+@pytest.fixture
+def workdir():
+    with tempfile.TemporaryDirectory() as workdir:
+        yield workdir
+
+
+def bid(index, key, bidder, amount, time=1000.0):
+    return {"index": index, "time": time, "key": key, "bidder": bidder, "amount": amount}
+
+
+def filled(workdir):
+    ledger = BidLedger(workdir)
+    ledger.append([bid(1, "lamp", "alice", 10), bid(2, "chair", "bob", 5, 1030.0)])
+    ledger.append([bid(3, "lamp", "bob", 12.5, 1070.0), bid(4, "lamp", "alice", 20, 1130.0)])
+    return ledger
+
+
+def test_records_are_fixed_width_with_names_written_once(workdir):
+    filled(workdir).close()
+    assert os.path.getsize(os.path.join(workdir, "bids.ledger")) == 4 * RECORD.size
+    with open(os.path.join(workdir, "ledger.names")) as file:
+        assert file.read().splitlines() == ['"lamp"', '"alice"', '"chair"', '"bob"']
+    with open(os.path.join(workdir, "bids.ledger"), "rb") as file:
+        assert RECORD.unpack(file.read(RECORD.size)) == (1, 1000.0, 0, 1, 10.0)
+
+
+def test_queries(workdir):
+    ledger = filled(workdir)
+    assert len(ledger) == 4 and ledger.last_index == 4
+    assert ledger.count("lamp") == 3 and ledger.count("sofa") == 0
+    assert [(b["bidder"], b["amount"]) for b in ledger.top("lamp", 2)] == [("alice", 20.0), ("bob", 12.5)]
+    assert ledger.top("lamp", 0) == []
+    assert [b["index"] for b in ledger.bids_by("bob")] == [3, 2]
+    assert ledger.rate("lamp", bucket=60, since=1000) == [[960.0, 1], [1020.0, 1], [1080.0, 1]]
+    assert ledger.rate("lamp", bucket=60, since=1100) == [[1080.0, 1]]
+    assert [b["index"] for b in ledger.records_after(2)] == [3, 4]
+
+
+def test_reopening_restores_every_bid(workdir):
+    filled(workdir).close()
+    ledger = BidLedger(workdir)
+    assert [b["index"] for b in ledger.records_after(0)] == [1, 2, 3, 4]
+    assert ledger.top("lamp", 1)[0] == {"index": 4, "time": 1130.0, "auction_id": "lamp", "bidder": "alice",
+                                        "amount": 20.0}
+
+
+def test_replayed_bids_are_skipped(workdir):
+    ledger = filled(workdir)
+    ledger.append([bid(3, "lamp", "bob", 12.5), bid(5, "chair", "carol", 6)])
+    assert [b["index"] for b in ledger.records_after(0)] == [1, 2, 3, 4, 5]
+
+
+def test_truncate_after_drops_later_bids(workdir):
+    ledger = filled(workdir)
+    ledger.truncate_after(2)
+    assert ledger.count("lamp") == 1 and ledger.bids_by("alice")[0]["index"] == 1
+    ledger.append([bid(3, "lamp", "carol", 11)])
+    ledger.close()
+    assert [b["bidder"] for b in BidLedger(workdir).records_after(0)] == ["alice", "bob", "carol"]
+
+
+def test_torn_appends_are_discarded(workdir):
+    filled(workdir).close()
+    with open(os.path.join(workdir, "bids.ledger"), "ab") as file:
+        file.write(b"\1" * (RECORD.size // 2))
+    with open(os.path.join(workdir, "ledger.names"), "a") as file:
+        file.write('"so')
+    ledger = BidLedger(workdir)
+    assert len(ledger) == 4
+    assert os.path.getsize(os.path.join(workdir, "bids.ledger")) == 4 * RECORD.size
+    ledger.append([bid(5, "sofa", "dave", 30)])
+    ledger.close()
+    assert BidLedger(workdir).top("sofa", 1)[0]["bidder"] == "dave"
+
+
+def test_records_whose_names_were_lost_are_dropped(workdir):
+    filled(workdir).close()
+    with open(os.path.join(workdir, "bids.ledger"), "ab") as file:
+        file.write(RECORD.pack(5, 1200.0, 0, 9, 25.0))
+    assert BidLedger(workdir).last_index == 4
@@ -0,0 +1,74 @@
+"""ChangeFeed publishing, commit visibility, truncation and waiting.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import threading
+
+import pytest
+
+from change_feed import ChangeFeed, FeedTruncated
+
+
+def put(index, key, value=None, db_type="bids"):
+    return {"index": index, "db_type": db_type, "key": key, "value": value or {"n": index}}
+
+
+def test_only_committed_changes_of_the_table_are_read():
+    feed = ChangeFeed("bids")
+    feed.publish([put(1, "a"), put(2, "alice", db_type="users"), put(3, "b")])
+    assert feed.read(0) == ([], 0)
+    feed.commit(2)
+    changes, position = feed.read(0)
+    assert [change["key"] for change in changes] == ["a"] and position == 2
+    feed.commit(3)
+    changes, position = feed.read(position)
+    assert [change["key"] for change in changes] == ["b"] and position == 3
+
+
+def test_bids_and_deletes_are_reported_as_values():
+    feed = ChangeFeed("bids")
+    feed.publish([{"index": 1, "op": "bid", "db_type": "bids", "key": "a", "bidder": "alice", "amount": 5.0},
+                  {"index": 2, "op": "delete", "db_type": "bids", "key": "b"}])
+    feed.commit(2)
+    changes, _ = feed.read(0)
+    assert changes == [{"index": 1, "op": "bid", "key": "a", "value": {"highest_bid": 5.0, "highest_bidder": "alice"}},
+                       {"index": 2, "op": "delete", "key": "b", "value": None}]
+
+
+def test_limit_splits_reads():
+    feed = ChangeFeed("bids")
+    feed.publish([put(i, f"k{i}") for i in range(1, 6)])
+    feed.commit(5)
+    changes, position = feed.read(0, limit=2)
+    assert [change["index"] for change in changes] == [1, 2] and position == 2
+    changes, position = feed.read(position, limit=10)
+    assert [change["index"] for change in changes] == [3, 4, 5] and position == 5
+
+
+def test_subscribers_too_far_behind_start_over():
+    feed = ChangeFeed("bids", size=3)
+    feed.publish([put(i, f"k{i}") for i in range(1, 6)])
+    feed.commit(5)
+    with pytest.raises(FeedTruncated):
+        feed.read(1)
+    changes, _ = feed.read(2)
+    assert [change["index"] for change in changes] == [3, 4, 5]
+
+
+def test_snapshot_restarts_the_feed():
+    feed = ChangeFeed("bids")
+    feed.publish([put(1, "a")])
+    feed.publish([{"index": 10, "op": "snapshot", "term": 2}])
+    assert feed.position() == 10
+    with pytest.raises(FeedTruncated):
+        feed.read(5)
+    assert feed.read(10) == ([], 10)
+
+
+def test_read_waits_for_a_commit():
+    feed = ChangeFeed("bids")
+    feed.publish([put(1, "a")])
+    threading.Timer(0.05, feed.commit, args=(1,)).start()
+    changes, position = feed.read(0, timeout=5)
+    assert [change["key"] for change in changes] == ["a"] and position == 1
+    assert feed.read(1, timeout=0.01) == ([], 1)
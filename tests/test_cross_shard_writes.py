@@ -0,0 +1,55 @@
+"""Cross-shard batch writes on a local two-shard cluster, one node per shard.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import signal
+import sys
+import tempfile
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "benchmarks"), os.path.join(ROOT, "docker_images", "common")]
+
+from local_cluster import cluster_shards, start_cluster, stop_node  # noqa: E402
+from shard_router import shard_for  # noqa: E402
+
+BASE_PORT = 5401
+
+
+def key_on(shard, shard_count=2):
+    return next(f"key-{i}" for i in range(1000) if shard_for(f"key-{i}", shard_count) == shard)
+
+
+@pytest.fixture(params=["app.py", "async_app.py"])
+def cluster(request):
+    with tempfile.TemporaryDirectory() as workdir:
+        nodes = start_cluster(workdir, size=1, shards=2, script=request.param, base_port=BASE_PORT)
+        try:
+            yield nodes
+        finally:
+            for _, process in nodes.values():
+                process.send_signal(signal.SIGCONT)
+                stop_node(process)
+
+
+def test_write_batch_across_shards(cluster):
+    (shard_0,), (shard_1,) = cluster_shards(1, 2, BASE_PORT)
+    records = [{"key": key_on(0), "value": "a", "db_type": "users"},
+               {"key": key_on(1), "value": "b", "db_type": "users"}]
+    response = requests.post(f"{cluster[shard_0][0]}/write_batch", json={"records": records}, timeout=30)
+    assert response.status_code == 200
+    assert set(response.json()["versions"]) == {"0", "1"}
+
+
+def test_write_batch_with_a_shard_unreachable(cluster):
+    (shard_0,), (shard_1,) = cluster_shards(1, 2, BASE_PORT)
+    # A paused process still accepts connections but never answers, like a hung node.
+    cluster[shard_1][1].send_signal(signal.SIGSTOP)
+    records = [{"key": key_on(0), "value": "a", "db_type": "users"},
+               {"key": key_on(1), "value": "b", "db_type": "users"}]
+    response = requests.post(f"{cluster[shard_0][0]}/write_batch", json={"records": records}, timeout=60)
+    assert response.status_code == 503
+    assert response.json() == {"error": "Failed to forward request to shard 1"}
@@ -0,0 +1,82 @@
+"""Database behaviour on a single node, without a server in front of it.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import tempfile
+import time
+
+import pytest
+
+from auction_index import TIME_FORMAT
+from database import Database, DB_TYPES
+from storage import open_store
+from wal import WriteAheadLog
+
+ENGINES = ("json", "sqlite", "snapshot")
+
+
+@pytest.fixture
+def workdir():
+    with tempfile.TemporaryDirectory() as workdir:
+        yield workdir
+
+
+def open_database(engine, workdir):
+    return Database(["test-0"], open_store(engine, workdir, DB_TYPES), os.path.join(workdir, "database.wal"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_replay_skips_entries_that_cannot_be_applied(engine, workdir):
+    wal = WriteAheadLog(os.path.join(workdir, "database.wal"))
+    wal.append([
+        {"db_type": "users", "key": "alice", "value": {"password": "a"}, "index": 1, "term": 1},
+        {"db_type": "bids", "key": ["not", "a", "key"], "value": {}, "index": 2, "term": 1},
+        {"db_type": "teams", "key": "red", "value": {}, "index": 3, "term": 1},
+        {"db_type": "users", "key": "bob", "value": {"password": "b"}, "index": 4, "term": 1},
+    ])
+    wal.close()
+
+    database = open_database(engine, workdir)
+    assert database.last_index == 4
+    assert database.read_record("alice", "users") == {"password": "a"}
+    assert database.read_record("bob", "users") == {"password": "b"}
+    assert len(database.bids) == 0
+
+    database.write_record("carol", {"password": "c"}, None, "users")
+    database.store.close()
+    database.wal.close()
+    assert open_database(engine, workdir).read_record("carol", "users") == {"password": "c"}
+
+
+@pytest.mark.parametrize("records", [
+    [{"db_type": "bids", "key": ["a"], "value": {}}],
+    [{"db_type": "users", "key": "alice", "value": {}}, {"db_type": "users", "key": 7, "value": {}}],
+    [{"db_type": "teams", "key": "red", "value": {}}],
+    [{"db_type": "sequences", "key": "auctions", "value": {"next": 1}}],
+])
+def test_invalid_records_are_not_logged(records, workdir):
+    database = open_database("snapshot", workdir)
+    with pytest.raises(ValueError):
+        database.write_batch(records, None)
+    with pytest.raises(ValueError):
+        database.create_record(records[-1]["key"], {}, None, records[-1]["db_type"])
+    assert database.last_index == 0
+    assert database.wal.size == 0
+
+
+def test_bids_on_records_that_are_not_auctions_fail_alone(workdir):
+    database = open_database("snapshot", workdir)
+    now = time.strftime(TIME_FORMAT)
+    database.write_batch([
+        {"db_type": "bids", "key": "text", "value": "not an auction"},
+        {"db_type": "bids", "key": "priceless", "value": {"created_time": now, "starting_bid": "ten"}},
+        {"db_type": "bids", "key": "lamp", "value": {"created_time": now, "starting_bid": 10.0}},
+    ], None)
+    results = database.place_bids([
+        {"auction_id": "text", "bidder": "alice", "amount": 20.0},
+        {"auction_id": "priceless", "bidder": "alice", "amount": 20.0},
+        {"auction_id": "lamp", "bidder": "alice", "amount": 20.0},
+    ], None)
+    assert [outcome for outcome, _, _ in results] == ["invalid", "invalid", "accepted"]
+    assert database.read_record("lamp", "bids")["highest_bid"] == 20.0
@@ -0,0 +1,46 @@
+"""The auction service keeps at most EVENT_STREAM_LIMIT bid event streams open.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from local_cluster import start_auction_service, start_node, stop_node  # noqa: E402
+
+DATABASE_PORT = 5431
+AUCTION_PORT = 5432
+
+
+def hold(url):
+    try:
+        requests.get(url, timeout=60)
+    except requests.exceptions.RequestException:
+        pass
+
+
+def test_viewers_beyond_the_limit_are_told_to_poll():
+    with tempfile.TemporaryDirectory() as workdir:
+        node_name = f"127.0.0.1:{DATABASE_PORT}"
+        node = start_node(workdir, name=node_name, port=DATABASE_PORT)
+        service = start_auction_service([[node_name]], AUCTION_PORT, env=dict(EVENT_STREAM_LIMIT="1"))
+        url = f"http://127.0.0.1:{AUCTION_PORT}/auction/1/events"
+        try:
+            # Holds the only stream; it sends nothing before a bid or a keep-alive.
+            held = threading.Thread(target=hold, args=(url,), daemon=True)
+            held.start()
+            time.sleep(1)
+            polled = requests.get(url, timeout=10)
+            assert polled.status_code == 200
+            assert polled.headers["Content-Type"].startswith("text/event-stream")
+            assert polled.text.startswith("retry: 5000\n\n")
+        finally:
+            stop_node(service)
+            stop_node(node)
@@ -0,0 +1,60 @@
+"""PhiAccrualDetector suspicion, driven with explicit clock readings.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+from failure_detector import PhiAccrualDetector
+
+
+def steady(detector, interval, count, start=0.0):
+    """Feed `count` heartbeats `interval` apart; returns the time of the last."""
+    for i in range(count):
+        detector.heartbeat(start + i * interval)
+    return start + (count - 1) * interval
+
+
+def test_no_suspicion_before_the_first_heartbeat():
+    detector = PhiAccrualDetector(1.0)
+    assert detector.phi(100.0) == 0.0
+    assert not detector.suspects(100.0)
+
+
+def test_phi_grows_with_silence():
+    detector = PhiAccrualDetector(1.0, acceptable_pause=0.25)
+    last = steady(detector, 1.0, 20)
+    phis = [detector.phi(last + elapsed) for elapsed in (0.5, 1.0, 1.25, 1.5, 2.0)]
+    assert phis == sorted(phis)
+    assert not detector.suspects(last + 1.25)
+    assert detector.suspects(last + 2.0)
+
+
+def test_suspicion_waits_for_interval_pause_and_margin():
+    detector = PhiAccrualDetector(2.0, threshold=8, acceptable_pause=0.25)
+    last = steady(detector, 2.0, 20)
+    # With min_std 0.1, phi 8 is about 5.6 standard deviations past the interval and pause.
+    assert not detector.suspects(last + 2.25 + 0.5)
+    assert detector.suspects(last + 2.25 + 0.6)
+
+
+def test_faster_traffic_does_not_lower_the_bar():
+    detector = PhiAccrualDetector(1.0, acceptable_pause=0.25)
+    last = steady(detector, 0.01, 500)
+    assert not detector.suspects(last + 1.5)
+
+
+def test_late_heartbeats_widen_the_spread():
+    punctual = PhiAccrualDetector(1.0, acceptable_pause=0.25)
+    erratic = PhiAccrualDetector(1.0, acceptable_pause=0.25)
+    last = steady(punctual, 1.0, 20)
+    arrival = 0.0
+    for i in range(20):
+        arrival += 1.0 if i % 2 else 1.6
+        erratic.heartbeat(arrival)
+    assert erratic.phi(arrival + 1.8) < punctual.phi(last + 1.8)
+
+
+def test_reset_starts_the_clock_again():
+    detector = PhiAccrualDetector(1.0, acceptable_pause=0.25)
+    last = steady(detector, 1.0, 20)
+    assert detector.suspects(last + 5)
+    detector.reset(last + 5)
+    assert not detector.suspects(last + 5.5)
@@ -0,0 +1,43 @@
+"""An idle leader heartbeats each follower about once per HEARTBEAT_INTERVAL, on both servers.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from local_cluster import start_cluster, stop_node, wait_for_leader  # noqa: E402
+
+BASE_PORT = 5421
+HEARTBEAT_INTERVAL = 1.0
+MEASURE_SECONDS = 6
+
+
+def heartbeats_sent(url):
+    return requests.get(f"{url}/http_stats", timeout=10).json()["call_types"].get("heartbeat", {}).get("requests", 0)
+
+
+@pytest.mark.parametrize("script", ["app.py", "async_app.py"])
+def test_idle_heartbeat_rate(script):
+    with tempfile.TemporaryDirectory() as workdir:
+        nodes = start_cluster(workdir, 3, env=dict(HEARTBEAT_INTERVAL=str(HEARTBEAT_INTERVAL)), script=script,
+                              base_port=BASE_PORT)
+        try:
+            leader = wait_for_leader([url for url, _ in nodes.values()])
+            # Let replication of the election's entries go quiet first.
+            time.sleep(2 * HEARTBEAT_INTERVAL)
+            before = heartbeats_sent(f"http://{leader}")
+            time.sleep(MEASURE_SECONDS)
+            rate = (heartbeats_sent(f"http://{leader}") - before) / MEASURE_SECONDS
+        finally:
+            for _, process in nodes.values():
+                stop_node(process)
+    expected = (len(nodes) - 1) / HEARTBEAT_INTERVAL
+    assert 0.75 * expected <= rate <= 1.25 * expected
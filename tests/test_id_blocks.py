@@ -0,0 +1,76 @@
+"""IdBlockAllocator, against a router that answers /allocate_ids like a shard leader.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import threading
+
+import pytest
+
+from id_blocks import IdAllocationError, IdBlockAllocator
+
+
+class Response:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class SequenceRouter:
+    """Hands out blocks of one sequence starting at 1, as the leader does."""
+
+    def __init__(self, error=None):
+        self.next = 1
+        self.requests = []
+        self.error = error
+
+    def shard_for(self, key):
+        return 0
+
+    def post(self, shard, path, call_type, json):
+        self.requests.append((path, json))
+        if self.error:
+            return Response(503, {"error": self.error})
+        start, self.next = self.next, self.next + json["count"]
+        return Response(200, {"start": start, "count": json["count"], "version": 1})
+
+
+def test_ids_come_from_one_request_per_block():
+    router = SequenceRouter()
+    allocate = IdBlockAllocator(router, "auctions", 3)
+    assert [allocate() for _ in range(7)] == [1, 2, 3, 4, 5, 6, 7]
+    assert router.requests == [("/allocate_ids", {"name": "auctions", "count": 3})] * 3
+
+
+def test_allocators_sharing_a_sequence_never_repeat_an_id():
+    router = SequenceRouter()
+    first, second = IdBlockAllocator(router, "auctions", 4), IdBlockAllocator(router, "auctions", 4)
+    ids = [allocate() for _ in range(6) for allocate in (first, second)]
+    assert len(set(ids)) == len(ids)
+
+
+def test_concurrent_callers_get_distinct_ids():
+    allocate = IdBlockAllocator(SequenceRouter(), "auctions", 10)
+    ids = []
+    lock = threading.Lock()
+
+    def take():
+        for _ in range(100):
+            value = allocate()
+            with lock:
+                ids.append(value)
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(1, 401))
+
+
+def test_refused_allocation_raises():
+    allocate = IdBlockAllocator(SequenceRouter(error="No leader"), "auctions", 10)
+    with pytest.raises(IdAllocationError, match="No leader"):
+        allocate()
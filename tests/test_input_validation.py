@@ -0,0 +1,164 @@
+"""Malformed requests get a 400 from both servers, not a 500.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from local_cluster import start_node, stop_node  # noqa: E402
+
+PORT = 5411
+
+
+@pytest.fixture(scope="module", params=["app.py", "async_app.py"])
+def url(request):
+    with tempfile.TemporaryDirectory() as workdir:
+        node = start_node(workdir, name=f"127.0.0.1:{PORT}", script=request.param, port=PORT)
+        try:
+            yield f"http://127.0.0.1:{PORT}"
+        finally:
+            stop_node(node)
+
+
+def test_empty_write_batch(url):
+    response = requests.post(f"{url}/write_batch", json={"records": []}, timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/write", {"key": "1", "value": 1}),
+    ("/write", {"key": "1", "value": 1, "db_type": "tables"}),
+    ("/write", ["1", 1, "users"]),
+    ("/write_batch", {"records": [{"value": 1, "db_type": "users"}]}),
+    ("/write_batch", {"records": [{"key": "1", "value": 1, "db_type": "users"},
+                                  {"key": "2", "value": 1, "db_type": "tables"}]}),
+    ("/create", {"key": "1", "db_type": "bids"}),
+    ("/write", {"key": ["1"], "value": {}, "db_type": "bids"}),
+    ("/write", {"key": "", "value": {}, "db_type": "bids"}),
+    ("/write_batch", {"records": [{"key": {"id": 1}, "value": 1, "db_type": "users"}]}),
+    ("/create", {"key": 1, "value": {}, "db_type": "bids"}),
+])
+def test_malformed_write(url, path, body):
+    response = requests.post(f"{url}{path}", json=body, timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path", ["/add_user", "/authenticate_user"])
+@pytest.mark.parametrize("body", [{"username": "alice"}, {"password": "secret"}, "alice"])
+def test_malformed_user(url, path, body):
+    response = requests.post(f"{url}{path}", json=body, timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("body", [
+    {"name": "auctions"},
+    {"name": "auctions", "count": "many"},
+    {"name": "auctions", "count": True},
+    {"count": 5},
+    {"name": {"sequence": "auctions"}, "count": 5},
+])
+def test_malformed_id_allocation(url, body):
+    response = requests.post(f"{url}/allocate_ids", json=body, timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path", ["/write", "/write_batch", "/create"])
+def test_sequences_change_only_through_allocation(url, path):
+    name = f"sequence-via-{path[1:]}"
+    record = {"key": name, "value": {"next": 1}, "db_type": "sequences"}
+    first = requests.post(f"{url}/allocate_ids", json={"name": name, "count": 10}, timeout=10).json()["start"]
+    response = requests.post(f"{url}{path}", json={"records": [record]} if path == "/write_batch" else record,
+                             timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+    second = requests.post(f"{url}/allocate_ids", json={"name": name, "count": 10}, timeout=10).json()["start"]
+    assert second == first + 10
+
+
+@pytest.mark.parametrize("path", ["/write", "/write_batch", "/bid", "/add_user"])
+def test_body_that_is_not_json(url, path):
+    response = requests.post(f"{url}{path}", data="{not json", headers={"Content-Type": "application/json"},
+                             timeout=10)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", [
+    {"auction_id": "1", "bidder": "alice"},
+    {"auction_id": "1", "bidder": "alice", "amount": "lots"},
+    {"auction_id": "1", "bidder": "alice", "amount": None},
+    {"bidder": "alice", "amount": 10},
+    {"auction_id": "1", "amount": 10},
+    ["1", "alice", 10],
+])
+def test_malformed_bid(url, body):
+    response = requests.post(f"{url}/bid", json=body, timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path", [
+    "/bids/1/top?n=abc",
+    "/bids/1/rate?bucket=abc",
+    "/bids/1/rate?since=nan",
+    "/bidders/alice/bids?limit=1.5",
+    "/changes?after=abc",
+    "/changes?timeout=abc",
+    "/log?after=abc",
+    "/log?limit=1.5",
+    "/snapshot?cursor=abc",
+    "/snapshot?archive_after=abc",
+    "/traces?limit=abc",
+    "/auctions/active?cursor=soon:1",
+])
+def test_malformed_query_argument(url, path):
+    response = requests.get(f"{url}{path}", timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+@pytest.mark.parametrize("path", [
+    "/auctions/active?limit=-5",
+    "/auctions/active?limit=0",
+    "/auctions/search?creator=alice&limit=-1",
+    "/log?limit=-5",
+    "/snapshot?cursor=-3",
+    "/snapshot?limit=-5",
+    "/traces?limit=-5",
+])
+def test_out_of_range_query_argument_is_clamped(url, path):
+    auction = {"creator": "alice", "created_time": time.strftime("%Y-%m-%d %H:%M:%S"), "starting_bid": 1.0}
+    for key in ("clamped-1", "clamped-2"):
+        requests.post(f"{url}/write", json={"key": key, "value": auction, "db_type": "bids"}, timeout=10)
+    assert requests.get(f"{url}{path}", timeout=10).status_code == 200
+
+
+@pytest.mark.parametrize("options", [{"min_version": [1]}, {"max_staleness": {"seconds": 1}}, {"max_staleness": "inf"}])
+def test_malformed_read_options(url, options):
+    response = requests.post(f"{url}/authenticate_user", json=dict(options, username="alice", password="secret"),
+                             timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_read_of_an_unknown_database_type(url):
+    response = requests.get(f"{url}/read/tables/1", timeout=10)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_ledger_queries(url):
+    assert requests.get(f"{url}/bids/1/top?n=5", timeout=10).json()["bids"] == []
+    assert requests.get(f"{url}/bids/1/rate?bucket=10&since=0", timeout=10).json()["rates"] == []
+    assert requests.get(f"{url}/bidders/alice/bids?limit=5", timeout=10).json()["bids"] == []
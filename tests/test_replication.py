@@ -0,0 +1,102 @@
+"""Replicator quorum tracking, with follower channels that only record what they are sent.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import threading
+import time
+
+import pytest
+
+from replication import QuorumTimeout, Replicator
+
+PEERS = ["node-0", "node-1", "node-2"]
+
+
+class RecordingChannel:
+    def __init__(self, peer, url, client, on_ack, message):
+        self.peer = peer
+        self.on_ack = on_ack
+        self.sent = []
+
+    def send(self, entries):
+        self.sent.extend(entries)
+
+    def clear(self):
+        self.sent = []
+
+    def ack(self, index):
+        self.on_ack(self.peer, index, time.monotonic())
+
+
+def replicator(quorum=None):
+    """A leader on node-0 that has queued entries 1-5 for its followers."""
+    replicas = Replicator(PEERS, "node-0", lambda peer: f"http://{peer}", None, quorum=quorum, timeout=0.1,
+                          channel=RecordingChannel)
+    replicas.replicate([{"index": i} for i in range(1, 6)])
+    return replicas
+
+
+def test_entries_go_to_every_follower():
+    followers = replicator().followers
+    assert set(followers) == {"node-1", "node-2"}
+    assert all([entry["index"] for entry in channel.sent] == [1, 2, 3, 4, 5] for channel in followers.values())
+
+
+def test_majority_quorum_counts_the_leader():
+    replicas = replicator()
+    assert replicas.quorum == 2
+    assert replicas.commit_index() == 0
+    replicas.followers["node-1"].ack(3)
+    assert replicas.commit_index() == 3
+    replicas.followers["node-2"].ack(5)
+    assert replicas.commit_index() == 5
+
+
+def test_quorum_of_every_node():
+    replicas = replicator(quorum=3)
+    replicas.followers["node-1"].ack(5)
+    replicas.followers["node-2"].ack(2)
+    assert replicas.commit_index() == 2
+    with pytest.raises(QuorumTimeout):
+        replicas.wait_for_quorum(3)
+
+
+def test_wait_for_quorum_returns_on_the_deciding_ack():
+    replicas = replicator()
+    with pytest.raises(QuorumTimeout):
+        replicas.wait_for_quorum(4)
+    threading.Timer(0.02, replicas.followers["node-2"].ack, args=(4,)).start()
+    replicas.wait_for_quorum(4, timeout=5)
+
+
+def test_on_quorum_calls_back_once_committed():
+    replicas = replicator()
+    called = []
+    replicas.on_quorum(2, lambda: called.append(2))
+    replicas.on_quorum(4, lambda: called.append(4))
+    replicas.followers["node-1"].ack(3)
+    assert called == [2]
+    replicas.followers["node-2"].ack(4)
+    assert called == [2, 4]
+    replicas.on_quorum(1, lambda: called.append(1))
+    assert called == [2, 4, 1]
+
+
+def test_reset_forgets_progress_and_queued_entries():
+    replicas = replicator()
+    replicas.followers["node-1"].ack(5)
+    called = []
+    replicas.on_quorum(6, lambda: called.append(6))
+    replicas.reset(2, 5)
+    assert replicas.term == 2 and replicas.commit_index() == 0
+    assert all(not channel.sent for channel in replicas.followers.values())
+    replicas.followers["node-1"].ack(6)
+    assert called == []
+
+
+def test_lease_needs_a_quorum_of_recent_contacts():
+    replicas = replicator()
+    assert not replicas.has_lease(1)
+    replicas.followers["node-1"].ack(1)
+    assert replicas.has_lease(1)
+    assert not replicator(quorum=3).has_lease(1)
@@ -0,0 +1,103 @@
+"""Snapshot segment files and the SnapshotStore engine built on them.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import glob
+import os
+import tempfile
+
+import pytest
+
+from segment import DELETED, Segment, SegmentTable, merge, write_segment
+from storage import SnapshotStore
+
+
+@pytest.fixture
+def workdir():
+    with tempfile.TemporaryDirectory() as workdir:
+        yield workdir
+
+
+def encoded(records):
+    return sorted((key.encode(), f'"{value}"'.encode()) for key, value in records.items())
+
+
+def test_segment_lookups(workdir):
+    path = os.path.join(workdir, "test.seg")
+    write_segment(path, {"users": encoded({"bob": "b", "alice": "a", "alfred": "f"}), "empty": []},
+                  {"wal_offset": 42})
+    segment = Segment(path)
+    assert segment.wal_offset == 42
+    assert segment.count("users") == 3 and segment.count("empty") == 0 and segment.count("missing") == 0
+    assert segment.get("users", b"alice") == b'"a"'
+    assert segment.get("users", b"carol") is None
+    assert segment.get("empty", b"alice") is None
+    assert [key for key, _ in segment.items("users")] == [b"alfred", b"alice", b"bob"]
+    assert [key for key, _ in segment.items("users", b"al")] == [b"alfred", b"alice"]
+
+
+def test_file_that_is_not_a_segment(workdir):
+    path = os.path.join(workdir, "test.seg")
+    with open(path, "wb") as file:
+        file.write(b"\0" * 64)
+    with pytest.raises(ValueError):
+        Segment(path)
+
+
+def test_merge_applies_changes_in_key_order():
+    stored = encoded({"a": 1, "c": 3, "e": 5})
+    changes = {"b": 2, "c": 30, "e": DELETED, "f": 6, "g": DELETED}
+    assert list(merge(stored, changes)) == [(b"a", b'"1"'), (b"b", b"2"), (b"c", b"30"), (b"f", b"6")]
+
+
+def test_segment_table_overlays_changes(workdir):
+    path = os.path.join(workdir, "test.seg")
+    write_segment(path, {"users": encoded({"alice": "a", "bob": "b"})}, {"wal_offset": 0})
+    table = SegmentTable(Segment(path), "users")
+    assert table["alice"] == "a" and len(table) == 2
+    table["carol"] = "c"
+    table["alice"] = "A"
+    del table["bob"]
+    assert "bob" not in table and table.get("bob") is None
+    with pytest.raises(KeyError):
+        del table["bob"]
+    assert len(table) == 2
+    assert sorted(table) == ["alice", "carol"]
+    assert dict(table.items()) == {"alice": "A", "carol": "c"}
+
+
+def test_snapshot_store_round_trip(workdir):
+    store = SnapshotStore(workdir, ("users", "bids"))
+    tables, offset = store.load()
+    assert offset == 0 and len(tables["users"]) == 0
+    tables["users"]["alice"] = {"password": "a"}
+    tables["bids"]["1"] = {"creator": "alice", "title": "lamp"}
+    tables["bids"]["2"] = {"creator": "bob", "title": "chair"}
+    store.checkpoint(100)()
+    assert store.checkpoint(100) is None
+
+    tables["bids"]["3"] = {"creator": "alice", "title": "desk"}
+    del tables["bids"]["2"]
+    assert [auction["id"] for auction in store.find_auctions("creator", "alice", 10)] == ["1", "3"]
+    store.checkpoint(200)()
+    assert [os.path.basename(path) for path in glob.glob(os.path.join(workdir, "*.seg"))] == [
+        f"snapshot-{200:020d}.seg"]
+
+    tables, offset = SnapshotStore(workdir, ("users", "bids")).load()
+    assert offset == 200
+    assert tables["users"]["alice"] == {"password": "a"}
+    assert sorted(tables["bids"]) == ["1", "3"]
+
+
+def test_snapshot_store_finds_auctions_through_its_index(workdir):
+    store = SnapshotStore(workdir, ("bids",))
+    tables, _ = store.load()
+    for i in range(5):
+        tables["bids"][str(i)] = {"creator": "alice" if i % 2 else "bob"}
+    store.checkpoint(1)()
+    reopened = SnapshotStore(workdir, ("bids",))
+    reopened.load()
+    assert [auction["id"] for auction in reopened.find_auctions("creator", "alice", 10)] == ["1", "3"]
+    assert [auction["id"] for auction in reopened.find_auctions("creator", "bob", 2)] == ["0", "2"]
+    with pytest.raises(ValueError):
+        reopened.find_auctions("title", "lamp", 10)
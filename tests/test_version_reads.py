@@ -0,0 +1,58 @@
+"""Reads with a min_version wait for this node to apply it, on both servers.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from local_cluster import start_node, stop_node  # noqa: E402
+
+PORT = 5412
+
+
+@pytest.fixture(scope="module", params=["app.py", "async_app.py"])
+def url(request):
+    with tempfile.TemporaryDirectory() as workdir:
+        node = start_node(workdir, name=f"127.0.0.1:{PORT}", script=request.param, port=PORT)
+        try:
+            yield f"http://127.0.0.1:{PORT}"
+        finally:
+            stop_node(node)
+
+
+def write(url, key, value):
+    response = requests.post(f"{url}/write", json={"key": key, "value": value, "db_type": "users"}, timeout=10)
+    assert response.status_code == 200
+    return response.json()["version"]
+
+
+def test_read_waits_for_its_version(url):
+    version = write(url, "waiting-1", "a")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        read = pool.submit(requests.get, f"{url}/read/users/waiting-2", timeout=10,
+                           params={"consistency": "version", "min_version": version + 1})
+        time.sleep(0.2)
+        write(url, "waiting-2", "b")
+        response = read.result()
+    assert response.status_code == 200
+    assert response.json()["value"] == "b"
+
+
+def test_read_of_a_version_not_applied_in_time(url):
+    version = write(url, "waiting-3", "c")
+    start = time.monotonic()
+    response = requests.get(f"{url}/read/users/waiting-3", timeout=10,
+                            params={"consistency": "version", "min_version": version + 1000})
+    # The leader has nobody to forward to once the wait (VERSION_WAIT_SECONDS, 1) runs out.
+    assert response.status_code == 503
+    assert time.monotonic() - start < 5
+    assert requests.get(f"{url}/read/users/waiting-3", params={"consistency": "version"}, timeout=10).json()["value"] == "c"